@@ -0,0 +1,209 @@
+import asyncio
+import csv
+import hashlib
+import io
+import logging
+import os
+import time
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from decouple import config
+from sqlalchemy import func, select
+from app.database.engine import get_session
+from app.database.models import AllowedEmail
+from app.metrics import Counter, Gauge, Histogram
+from app.validation import canonical_email
+
+logger = logging.getLogger(__name__)
+
+# Откуда брать список: csv - файл ALLOWLIST_PATH, db - таблица allowed_emails (manage.py import-emails)
+ALLOWLIST_SOURCE = config('ALLOWLIST_SOURCE', default='csv')
+# CSV со списком оплативших участников: адреса в любых ячейках
+ALLOWLIST_PATH = config('ALLOWLIST_PATH', default=str(Path(__file__).parent / 'database' / 'emails.csv'))
+# Как часто проверять, изменился ли файл
+ALLOWLIST_RELOAD_INTERVAL = config('ALLOWLIST_RELOAD_INTERVAL', default=30, cast=float)
+# Компактное хранение (отсортированный массив байт вместо set строк) для очень больших списков
+ALLOWLIST_COMPACT = config('ALLOWLIST_COMPACT', default=False, cast=bool)
+
+def parse_emails(text):
+    return {canonical_email(cell) for row in csv.reader(io.StringIO(text)) for cell in row if cell.strip()}
+
+class CompactEmailSet:
+    # Все адреса лежат в одном bytes по порядку, поиск - бинарный по массиву смещений.
+    # Примерно в 4-5 раз меньше памяти, чем set из str
+    def __init__(self, emails):
+        items = sorted({email.encode('utf-8') for email in emails})
+        self._blob = b''.join(items)
+        self._offsets = array('Q', [0])
+        position = 0
+        for item in items:
+            position += len(item)
+            self._offsets.append(position)
+
+    def _item(self, index):
+        return self._blob[self._offsets[index]:self._offsets[index + 1]]
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._item(index).decode('utf-8')
+
+    def __contains__(self, email):
+        target = email.encode('utf-8')
+        index = bisect_left(range(len(self)), target, key=self._item)
+        return index < len(self) and self._item(index) == target
+
+    def union(self, emails):
+        return CompactEmailSet([*self, *emails])
+
+class EmailAllowList:
+    def __init__(self, path=ALLOWLIST_PATH, reload_interval=ALLOWLIST_RELOAD_INTERVAL, compact=ALLOWLIST_COMPACT,
+                 source=ALLOWLIST_SOURCE):
+        self.source = source
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self.compact = compact
+        self._emails = None
+        # Состояние файла на момент последней загрузки: (mtime, размер), конец последней целой строки,
+        # хеш содержимого до него и была ли прочитана недописанная последняя строка
+        self._signature = None
+        self._offset = 0
+        self._prefix_hash = None
+        self._partial = False
+        self._task = None
+        self._lock = asyncio.Lock()
+        self.hits = Counter('allowlist_hits_total', 'Email checks that found the address in the allow-list')
+        self.misses = Counter('allowlist_misses_total', 'Email checks that did not find the address in the allow-list')
+        self.loads = Histogram('allowlist_load_seconds', 'Time to load or reload the email allow-list')
+        self.addresses = Gauge('allowlist_size', 'Addresses in the loaded email allow-list', lambda: self.size)
+
+    @property
+    def size(self):
+        return len(self._emails) if self._emails is not None else 0
+
+    def _build(self, emails):
+        return CompactEmailSet(emails) if self.compact else frozenset(emails)
+
+    @staticmethod
+    def _parse(chunk):
+        # Недописанная строка может оборваться посреди символа
+        return parse_emails(chunk.decode('utf-8', errors='replace'))
+
+    def _appended(self, data):
+        # Только дописывание: прочитанная ранее часть файла не изменилась, а в прошлый раз
+        # не попал обрывок строки, который мог оказаться в списке как адрес
+        return (
+            self._emails is not None and not self._partial and self._prefix_hash is not None
+            and len(data) >= self._offset and hashlib.sha1(data[:self._offset]).digest() == self._prefix_hash
+        )
+
+    def reload(self, force=False):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if not force and signature == self._signature:
+            return False
+
+        started = time.perf_counter()
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        if not force and self._appended(data):
+            # Дочитываем только хвост и объединяем
+            emails = self._emails.union(self._parse(data[self._offset:]))
+        else:
+            emails = self._build(self._parse(data))
+
+        end = data.rfind(b'\n') + 1
+        self._offset = end
+        self._prefix_hash = hashlib.sha1(data[:end]).digest()
+        # Последняя строка без перевода строки могла быть прочитана на середине записи:
+        # при следующем изменении файл перечитывается целиком
+        self._partial = end < len(data)
+        self._swap(emails, signature, started)
+        return True
+
+    def _swap(self, emails, signature, started):
+        # Подмена одной ссылкой: читатели видят либо старый, либо новый список целиком
+        self._emails = emails
+        self._signature = signature
+        elapsed = time.perf_counter() - started
+        self.loads.observe(elapsed)
+        logger.info(f"Email allow-list loaded: {self.size} addresses in {elapsed * 1000:.1f} ms")
+
+    async def reload_db(self, force=False):
+        async for session in get_session():
+            count, last_added = (await session.execute(
+                select(func.count(), func.max(AllowedEmail.added_at))
+            )).one()
+            signature = (count, last_added)
+            if not force and signature == self._signature:
+                return False
+
+            started = time.perf_counter()
+            emails = None
+            if (not force and self._emails is not None and self._signature
+                    and self._signature[1] is not None and count > self._signature[0]):
+                result = await session.execute(
+                    select(AllowedEmail.email).where(AllowedEmail.added_at > self._signature[1])
+                )
+                added = list(result.scalars())
+                # Адреса только добавлялись, если новых ровно столько, насколько выросла таблица;
+                # иначе что-то удалили - перечитываем целиком
+                if self._signature[0] + len(added) == count:
+                    emails = self._emails.union(canonical_email(email) for email in added)
+            if emails is None:
+                result = await session.execute(select(AllowedEmail.email))
+                emails = self._build(canonical_email(email) for email in result.scalars())
+            self._swap(emails, signature, started)
+        return True
+
+    async def refresh(self):
+        async with self._lock:
+            if self.source == 'db':
+                return await self.reload_db()
+            return await asyncio.to_thread(self.reload)
+
+    async def ensure_loaded(self):
+        # Первая проверка адреса дожидается загрузки, если фоновая еще не закончилась
+        if self._emails is None:
+            await self.refresh()
+
+    def contains(self, email):
+        if self._emails is None:
+            if self.source == 'db':
+                # Таблица читается только асинхронно (start(), ensure_loaded()), до этого список пуст
+                logger.warning("Email allow-list is not loaded yet")
+                self.misses.inc()
+                return False
+            self.reload()
+        found = canonical_email(email) in self._emails
+        if found:
+            self.hits.inc()
+        else:
+            self.misses.inc()
+        return found
+
+    def __contains__(self, email):
+        return self.contains(email)
+
+    async def _watch(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error reloading email allow-list: {e}", exc_info=True)
+            await asyncio.sleep(self.reload_interval)
+
+    async def start(self):
+        # Список загружается в фоне: запуск бота не ждет чтения файла или таблицы
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+allowed_emails = EmailAllowList()
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+)
+from decouple import config
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from app.database.engine import get_session
+from app.database.models import BroadcastDelivery
+from app.outbound import TokenBucket, bulk_priority
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и не чаще 1 сообщения в секунду в один чат
+BROADCAST_GLOBAL_RATE = config('BROADCAST_GLOBAL_RATE', default=30, cast=float)
+BROADCAST_PER_CHAT_RATE = config('BROADCAST_PER_CHAT_RATE', default=1, cast=float)
+BROADCAST_CONCURRENCY = config('BROADCAST_CONCURRENCY', default=10, cast=int)
+BROADCAST_MAX_RETRIES = config('BROADCAST_MAX_RETRIES', default=3, cast=int)
+# Неудачные доставки пишутся в журнал пачками; успешные - сразу после отправки
+BROADCAST_LOG_BATCH = config('BROADCAST_LOG_BATCH', default=50, cast=int)
+
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+class PerChatLimiter:
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next_allowed = {}
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        allowed_at = max(self._next_allowed.get(chat_id, now), now)
+        self._next_allowed[chat_id] = allowed_at + self.interval
+        if allowed_at > now:
+            await asyncio.sleep(allowed_at - now)
+
+@dataclass
+class BroadcastReport:
+    broadcast_id: str
+    total: int = 0
+    sent: int = 0
+    skipped: int = 0
+    failed: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+    errors: dict = field(default_factory=dict)
+
+    @property
+    def throughput(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def as_text(self):
+        lines = [
+            f"Рассылка {self.broadcast_id} завершена за {self.elapsed:.1f} с",
+            f"Всего получателей: {self.total}",
+            f"Отправлено: {self.sent} ({self.throughput:.1f} сообщ./с)",
+            f"Пропущено (уже доставлено ранее): {self.skipped}",
+            f"Ошибок: {self.failed}",
+            f"Повторов после 429/сетевых ошибок: {self.retries}",
+        ]
+        for error, count in sorted(self.errors.items(), key=lambda item: -item[1])[:5]:
+            lines.append(f"  {count} × {error}")
+        return "\n".join(lines)
+
+class Broadcaster:
+    def __init__(self, bot, concurrency=BROADCAST_CONCURRENCY, global_rate=BROADCAST_GLOBAL_RATE,
+                 per_chat_rate=BROADCAST_PER_CHAT_RATE, max_retries=BROADCAST_MAX_RETRIES,
+                 session_maker=get_session):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.session_maker = session_maker
+        self.global_limiter = TokenBucket(global_rate)
+        self.chat_limiter = PerChatLimiter(per_chat_rate)
+        self._pending_log = []
+
+    async def _delivered(self, broadcast_id):
+        delivered = set()
+        async for session in self.session_maker():
+            result = await session.execute(
+                select(BroadcastDelivery.telegram_id).where(
+                    BroadcastDelivery.broadcast_id == broadcast_id,
+                    BroadcastDelivery.status == STATUS_SENT
+                )
+            )
+            delivered.update(result.scalars())
+        return delivered
+
+    async def _flush_log(self):
+        if not self._pending_log:
+            return
+        entries, self._pending_log = self._pending_log, []
+        async for session in self.session_maker():
+            try:
+                await self._save_log(session, entries)
+            except Exception as e:
+                # Ошибка журнала не должна останавливать рассылку
+                logger.error(f"Error saving broadcast delivery log: {e}", exc_info=True)
+                await session.rollback()
+
+    async def _save_log(self, session, entries):
+        stmt = insert(BroadcastDelivery).values(entries)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[BroadcastDelivery.broadcast_id, BroadcastDelivery.telegram_id],
+            set_={
+                'status': stmt.excluded.status,
+                'error': stmt.excluded.error,
+                'attempts': BroadcastDelivery.attempts + stmt.excluded.attempts,
+                'updated_at': func.now(),
+            }
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+    async def _log(self, broadcast_id, telegram_id, status, attempts, error=None):
+        self._pending_log.append({
+            'broadcast_id': broadcast_id,
+            'telegram_id': telegram_id,
+            'status': status,
+            'error': error,
+            'attempts': attempts,
+        })
+        # Отправленное сообщение фиксируется до следующего: после сбоя продолжение рассылки
+        # повторит только сообщения, отправленные в момент сбоя (или если запись журнала не удалась)
+        if status == STATUS_SENT or len(self._pending_log) >= BROADCAST_LOG_BATCH:
+            await self._flush_log()
+
+    async def _deliver(self, chat_id, text, report: BroadcastReport):
+        attempts = 0
+        while True:
+            attempts += 1
+            await self.global_limiter.acquire()
+            await self.chat_limiter.acquire(chat_id)
+            try:
+                # Через общий планировщик бота рассылка идет после интерактивных ответов
+                with bulk_priority():
+                    await self.bot.send_message(chat_id=chat_id, text=text)
+                return STATUS_SENT, attempts, None
+            except TelegramRetryAfter as e:
+                logger.warning(f"Flood limit on chat {chat_id}, retry after {e.retry_after}s")
+                self.global_limiter.pause(e.retry_after)
+                error = 'RetryAfter'
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Бот заблокирован или чат не существует - повтор не поможет
+                return STATUS_FAILED, attempts, type(e).__name__
+            except (TelegramNetworkError, TelegramAPIError) as e:
+                logger.warning(f"Error sending message to {chat_id}: {e}")
+                await asyncio.sleep(min(2 ** attempts, 30))
+                error = type(e).__name__
+            if attempts > self.max_retries:
+                return STATUS_FAILED, attempts, error
+            report.retries += 1
+
+    async def _worker(self, broadcast_id, queue: asyncio.Queue, report: BroadcastReport):
+        while True:
+            chat_id, text = await queue.get()
+            try:
+                status, attempts, error = await self._deliver(chat_id, text, report)
+                if status == STATUS_SENT:
+                    report.sent += 1
+                else:
+                    report.failed += 1
+                    report.errors[error] = report.errors.get(error, 0) + 1
+                    logger.error(f"Ошибка при отправке сообщения пользователю {chat_id}: {error}")
+                await self._log(broadcast_id, chat_id, status, attempts, error)
+            finally:
+                queue.task_done()
+
+    async def run(self, broadcast_id, messages):
+        # messages: {telegram_id: текст}. Уже доставленные в рамках broadcast_id получатели пропускаются
+        report = BroadcastReport(broadcast_id=broadcast_id, total=len(messages))
+        started = time.monotonic()
+
+        delivered = await self._delivered(broadcast_id)
+        queue = asyncio.Queue()
+        for chat_id, text in messages.items():
+            if chat_id in delivered:
+                report.skipped += 1
+            else:
+                queue.put_nowait((chat_id, text))
+
+        workers = [
+            asyncio.create_task(self._worker(broadcast_id, queue, report))
+            for _ in range(min(self.concurrency, queue.qsize()))
+        ]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self._flush_log()
+
+        report.elapsed = time.monotonic() - started
+        logger.info(report.as_text())
+        return report
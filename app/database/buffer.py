@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from decouple import config
+from app.metrics import Counter, Gauge, Histogram
+from .cache import status_cache
+from .changes import changes
+from .engine import get_session
+from .requests import upsert_users
+
+logger = logging.getLogger(__name__)
+
+# Режим записи ответов анкеты:
+#   sync     - каждый ответ сразу пишется в БД (без потерь при падении процесса)
+#   batch    - ответы копятся и пишутся пачками по таймеру/размеру и при завершении анкеты
+#   complete - ответы пишутся только при завершении анкеты и при остановке бота
+ANSWERS_FLUSH_MODE = config('ANSWERS_FLUSH_MODE', default='batch')
+ANSWERS_FLUSH_INTERVAL = config('ANSWERS_FLUSH_INTERVAL', default=2.0, cast=float)
+ANSWERS_BATCH_SIZE = config('ANSWERS_BATCH_SIZE', default=200, cast=int)
+
+FLUSH_MODES = ('sync', 'batch', 'complete')
+
+# Корзины гистограммы размера пачки, участников
+FLUSH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 200, 500, 1000)
+
+class AnswerBuffer:
+    def __init__(self, mode=ANSWERS_FLUSH_MODE, interval=ANSWERS_FLUSH_INTERVAL,
+                 batch_size=ANSWERS_BATCH_SIZE, session_maker=get_session):
+        if mode not in FLUSH_MODES:
+            raise ValueError(f"Unknown ANSWERS_FLUSH_MODE {mode!r}, expected one of {FLUSH_MODES}")
+        self.mode = mode
+        self.interval = interval
+        self.batch_size = batch_size
+        self.session_maker = session_maker
+        self.flush_size = Histogram('answers_flush_size', 'Participants written by one answer buffer flush', FLUSH_SIZE_BUCKETS)
+        self.flush_latency = Histogram('answers_flush_seconds', 'Answer buffer flush latency')
+        self.flush_statements = Counter('answers_flush_statements_total', 'SQL statements issued by answer buffer flushes')
+        self.flush_failures = Counter('answers_flush_failures_total', 'Answer buffer flushes that failed and were retried')
+        self.backlog = Gauge('answers_pending', 'Participants with answers not yet written to the DB', lambda: len(self._pending))
+        # telegram_id -> объединенные несохраненные поля
+        self._pending = {}
+        # Все записи идут под одной блокировкой, чтобы более старый снимок
+        # не закоммитился позже более нового
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    async def put(self, telegram_id, data):
+        self._pending.setdefault(telegram_id, {}).update(data)
+        status_cache.invalidate(telegram_id)
+        try:
+            if self.mode == 'sync':
+                await self.flush_user(telegram_id)
+            elif self.mode == 'batch' and len(self._pending) >= self.batch_size:
+                await self.flush()
+        except Exception:
+            # Ошибка уже залогирована, ответ остался в буфере и будет записан позже
+            pass
+
+    async def flush_user(self, telegram_id):
+        async with self._lock:
+            data = self._pending.pop(telegram_id, None)
+            if data:
+                await self._write({telegram_id: data})
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            snapshot, self._pending = self._pending, {}
+            await self._write(snapshot)
+
+    async def _write(self, snapshot):
+        started = time.perf_counter()
+        try:
+            async for session in self.session_maker():
+                try:
+                    statements = await upsert_users(session, snapshot)
+                    await session.commit()
+                    # Статус мог быть закеширован по данным до записи
+                    status_cache.invalidate(*snapshot)
+                    changes.publish(snapshot)
+                except Exception:
+                    await session.rollback()
+                    raise
+        except Exception as e:
+            self.flush_failures.inc()
+            # Возвращаем несохраненные ответы в буфер, не перетирая более свежие
+            for telegram_id, data in snapshot.items():
+                self._pending[telegram_id] = {**data, **self._pending.get(telegram_id, {})}
+            logger.error(f"Error flushing {len(snapshot)} buffered answers: {e}", exc_info=True)
+            raise
+
+        latency = time.perf_counter() - started
+        self.flush_size.observe(len(snapshot))
+        self.flush_latency.observe(latency)
+        self.flush_statements.inc(statements)
+        logger.debug(f"Flushed {len(snapshot)} users in {statements} statements, {latency * 1000:.1f} ms")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Ошибка уже залогирована, ответы остались в буфере до следующей попытки
+                pass
+
+    def start(self):
+        if self.mode == 'batch' and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+answers = AnswerBuffer()
@@ -0,0 +1,40 @@
+from cachetools import TTLCache
+from decouple import config
+from app.metrics import Counter, Gauge
+
+STATUS_CACHE_SIZE = config('STATUS_CACHE_SIZE', default=50000, cast=int)
+# Записи других процессов бота этот кеш не сбрасывают - TTL ограничивает устаревание
+STATUS_CACHE_TTL = config('STATUS_CACHE_TTL', default=60, cast=float)
+
+STATUS_ABSENT = 'absent'
+STATUS_INCOMPLETE = 'incomplete'
+STATUS_COMPLETE = 'complete'
+
+class RegistrationStatusCache:
+    # telegram_id -> статус регистрации (complete / incomplete / absent)
+    def __init__(self, maxsize=STATUS_CACHE_SIZE, ttl=STATUS_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = Counter('status_cache_hits_total', 'Registration status lookups served from cache (DB queries avoided)')
+        self.misses = Counter('status_cache_misses_total', 'Registration status lookups that went to the DB')
+        self.hit_ratio = Gauge('status_cache_hit_ratio', 'Registration status cache hit ratio', self.ratio)
+
+    def ratio(self):
+        total = self.hits.value + self.misses.value
+        return self.hits.value / total if total else 0.0
+
+    def get(self, telegram_id):
+        status = self._cache.get(telegram_id)
+        if status is None:
+            self.misses.inc()
+        else:
+            self.hits.inc()
+        return status
+
+    def set(self, telegram_id, status):
+        self._cache[telegram_id] = status
+
+    def invalidate(self, *telegram_ids):
+        for telegram_id in telegram_ids:
+            self._cache.pop(telegram_id, None)
+
+status_cache = RegistrationStatusCache()
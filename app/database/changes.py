@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from decouple import config
+from sqlalchemy import text
+from app.metrics import Counter, Gauge
+from .engine import get_engine
+
+logger = logging.getLogger(__name__)
+
+# Лента изменений участников: пути записи сообщают telegram_id измененных участников,
+# потребитель (выгрузка в Google таблицу) получает их пачками.
+# CHANGE_FEED_NOTIFY=true - события идут через Postgres NOTIFY в той же транзакции, что и запись,
+# и доходят до потребителя в любом процессе; обязательно при нескольких процессах бота (WEBHOOK_WORKERS > 1,
+# проверяется при запуске в run.py). Иначе события передаются внутри процесса, и в процессах без потребителя
+# не собираются
+CHANGE_FEED_NOTIFY = config('CHANGE_FEED_NOTIFY', default=False, cast=bool)
+CHANGE_FEED_CHANNEL = config('CHANGE_FEED_CHANNEL', default='user_changes')
+# Окно, за которое события схлопываются в одну выгрузку
+CHANGE_FEED_WINDOW = config('CHANGE_FEED_WINDOW', default=3.0, cast=float)
+# Верхняя граница окна при обратном давлении (ошибки и исчерпанная квота Google)
+CHANGE_FEED_MAX_WINDOW = config('CHANGE_FEED_MAX_WINDOW', default=120.0, cast=float)
+
+# Полезная нагрузка NOTIFY ограничена 8000 байт
+NOTIFY_IDS_PER_MESSAGE = 400
+
+class ChangeFeed:
+    def __init__(self, notify=CHANGE_FEED_NOTIFY, channel=CHANGE_FEED_CHANNEL,
+                 window=CHANGE_FEED_WINDOW, max_window=CHANGE_FEED_MAX_WINDOW):
+        self.notify = notify
+        self.channel = channel
+        self.base_window = window
+        self.window = window
+        self.max_window = max_window
+        # Измененные участники, еще не переданные потребителю; повторы схлопываются
+        self._pending = set()
+        self._wakeup = asyncio.Event()
+        self._consumer = None
+        self._task = None
+        self._listener = None
+        self.events = Counter('change_feed_events_total', 'Participant change events received')
+        self.batches = Counter('change_feed_batches_total', 'Coalesced change batches passed to the consumer')
+        self.failures = Counter('change_feed_failures_total', 'Change batches the consumer failed to process')
+        self.backlog = Gauge('change_feed_pending', 'Changed participants waiting for the consumer', lambda: len(self._pending))
+
+    async def stage(self, session, telegram_ids):
+        # Вызывается до коммита записи: NOTIFY доставляется только если транзакция закоммитится
+        if not self.notify or not telegram_ids:
+            return
+        telegram_ids = list(telegram_ids)
+        for start in range(0, len(telegram_ids), NOTIFY_IDS_PER_MESSAGE):
+            payload = ','.join(str(telegram_id) for telegram_id in telegram_ids[start:start + NOTIFY_IDS_PER_MESSAGE])
+            await session.execute(text("SELECT pg_notify(:channel, :payload)"), {'channel': self.channel, 'payload': payload})
+
+    def publish(self, telegram_ids):
+        # Вызывается после коммита. В режиме NOTIFY события приходят через слушателя
+        if self.notify or self._task is None:
+            return
+        self._add(telegram_ids)
+
+    def _add(self, telegram_ids):
+        before = len(self._pending)
+        self._pending.update(telegram_ids)
+        self.events.inc(len(self._pending) - before)
+        if self._pending:
+            self._wakeup.set()
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            self._add(int(telegram_id) for telegram_id in payload.split(','))
+        except ValueError:
+            logger.warning(f"Malformed change notification: {payload!r}")
+
+    async def _listen(self):
+        connection = await get_engine().connect()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.add_listener(self.channel, self._on_notification)
+        self._listener = connection
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Даем накопиться правкам нескольких участников и нескольким ответам одного
+            await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            batch, self._pending = self._pending, set()
+            if not batch:
+                continue
+            self.batches.inc()
+            try:
+                await self._consumer(batch)
+                self.window = self.base_window
+            except Exception as e:
+                # Обратное давление: события возвращаются в очередь, окно растет,
+                # следующая попытка реже и одной пачкой вместо нескольких
+                self.failures.inc()
+                self._pending |= batch
+                self.window = min(self.max_window, self.window * 2)
+                self._wakeup.set()
+                logger.error(f"Change feed consumer failed for {len(batch)} users, next try in {self.window:.0f}s: {e}",
+                             exc_info=True)
+
+    async def start(self, consumer):
+        self._consumer = consumer
+        if self.notify and self._listener is None:
+            await self._listen()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        if self._pending:
+            logger.info(f"Change feed stopped with {len(self._pending)} pending users, the periodic sync will pick them up")
+
+changes = ChangeFeed()
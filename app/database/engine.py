@@ -0,0 +1,114 @@
+import logging
+import time
+from decouple import config
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.metrics import Counter, Gauge, Histogram, current_update
+
+logger = logging.getLogger(__name__)
+
+# Логирование SQL только по явному запросу: в проде echo пишет каждый запрос
+DB_ECHO = config('DB_ECHO', default=False, cast=bool)
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=10, cast=int)
+DB_MAX_OVERFLOW = config('DB_MAX_OVERFLOW', default=10, cast=int)
+# Соединения старше DB_POOL_RECYCLE секунд пересоздаются (обрыв idle-соединений прокси/фаерволом)
+DB_POOL_RECYCLE = config('DB_POOL_RECYCLE', default=1800, cast=int)
+# Сколько ждать свободное соединение из пула
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=30, cast=float)
+DB_CONNECT_TIMEOUT = config('DB_CONNECT_TIMEOUT', default=10, cast=float)
+DB_COMMAND_TIMEOUT = config('DB_COMMAND_TIMEOUT', default=60, cast=float)
+# За pgbouncer (transaction pooling) подготовленные выражения не переживают смену соединения,
+# поэтому кеши asyncpg отключаются только в этом случае
+DB_PGBOUNCER = config('DB_PGBOUNCER', default=False, cast=bool)
+
+pool_wait = Histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled DB connection')
+pool_in_use = Gauge('db_pool_connections_in_use', 'DB connections currently checked out',
+                    lambda: _engine.pool.checkedout() if _engine is not None else 0)
+pool_size = Gauge('db_pool_connections_open', 'DB connections currently held by the pool',
+                  lambda: _engine.pool.checkedout() + _engine.pool.checkedin() if _engine is not None else 0)
+
+db_queries = Counter('db_queries_total', 'SQL statements executed')
+db_query_latency = Histogram('db_query_duration_seconds', 'SQL statement execution time')
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    db_queries.inc()
+    db_query_latency.observe(elapsed)
+    # Контекст asyncio доходит до синхронных событий через greenlet SQLAlchemy
+    stats = current_update.get()
+    if stats is not None:
+        stats.db_queries += 1
+        stats.db_time += elapsed
+
+def _handle_error(context):
+    # Упавший запрос не доходит до after_cursor_execute - снимаем его отметку времени
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    # Пул, замеряющий ожидание свободного соединения
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait.observe(time.perf_counter() - started)
+
+_engine = None
+_session_maker = None
+
+def database_url():
+    # Переменные окружения читаются при первом обращении к БД, а не при импорте
+    return 'postgresql+asyncpg://{user}:{password}@{host}:{port}/{name}'.format(
+        user=config('DB_USERNAME'),
+        password=config('DB_PASSWORD'),
+        host=config('DB_HOST'),
+        port=config('DB_PORT'),
+        name=config('DB_NAME')
+    )
+
+def get_engine():
+    # Единственный пул соединений процесса, создается при первом использовании
+    global _engine
+    if _engine is None:
+        connect_args = {'timeout': DB_CONNECT_TIMEOUT, 'command_timeout': DB_COMMAND_TIMEOUT}
+        if DB_PGBOUNCER:
+            connect_args.update(statement_cache_size=0, prepared_statement_cache_size=0)
+        _engine = create_async_engine(
+            database_url(),
+            echo=DB_ECHO,
+            poolclass=MeteredPool,
+            pool_pre_ping=True,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_timeout=DB_POOL_TIMEOUT,
+            connect_args=connect_args
+        )
+        event.listen(_engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(_engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(_engine.sync_engine, 'handle_error', _handle_error)
+        logger.info(f"Database engine created (pool_size={DB_POOL_SIZE}, max_overflow={DB_MAX_OVERFLOW})")
+    return _engine
+
+def get_session_maker():
+    global _session_maker
+    if _session_maker is None:
+        _session_maker = async_sessionmaker(get_engine(), expire_on_commit=False)
+    return _session_maker
+
+async def get_session():
+    async with get_session_maker()() as session:
+        yield session
+
+async def dispose_engine():
+    global _engine, _session_maker
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+        _session_maker = None
@@ -0,0 +1,71 @@
+import logging
+from sqlalchemy import text
+from .engine import get_engine
+from .models import IS_COMPLETE_SQL, Base
+
+logger = logging.getLogger(__name__)
+
+# Версионированные изменения схемы. Применяются по порядку, каждая один раз, номер записывается
+# в schema_migrations. Шаги идемпотентны (IF NOT EXISTS и т.п.), потому что базы, созданные
+# до появления миграций, уже содержат часть изменений. Новые изменения схемы - только новой миграцией
+# в конце списка, уже примененные миграции не меняются
+
+# Все процессы бота стартуют одновременно - миграции применяет один, остальные ждут
+MIGRATIONS_LOCK_KEY = 731011
+
+async def _create_tables(conn):
+    # Начальная схема: недостающие таблицы по моделям
+    await conn.run_sync(Base.metadata.create_all)
+
+MIGRATIONS = [
+    (1, 'initial tables', [_create_tables]),
+    (2, 'users updated_at', [
+        "ALTER TABLE nastavnichestvo ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()",
+    ]),
+    (3, 'single unique index on telegram_id', [
+        # unique=True и UniqueConstraint создавали два одинаковых индекса, каждый замедлял запись.
+        # Остается uq_telegram_id, на него опирается ON CONFLICT (telegram_id)
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_telegram_id') THEN
+                ALTER TABLE nastavnichestvo ADD CONSTRAINT uq_telegram_id UNIQUE (telegram_id);
+            END IF;
+        END $$
+        """,
+        "ALTER TABLE nastavnichestvo DROP CONSTRAINT IF EXISTS nastavnichestvo_telegram_id_key",
+    ]),
+    (4, 'users is_complete', [
+        f"ALTER TABLE nastavnichestvo ADD COLUMN IF NOT EXISTS is_complete BOOLEAN "
+        f"GENERATED ALWAYS AS ({IS_COMPLETE_SQL}) STORED",
+    ]),
+    (5, 'users updated_at index', [
+        # Выгрузка в таблицу по watermark выбирает участников по updated_at
+        "CREATE INDEX IF NOT EXISTS ix_nastavnichestvo_updated_at ON nastavnichestvo (updated_at)",
+    ]),
+]
+
+async def migrate():
+    # Все непримененные миграции - одной транзакцией: при ошибке схема остается прежней
+    async with get_engine().begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATIONS_LOCK_KEY})
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+            "applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())"
+        ))
+        applied = set((await conn.execute(text("SELECT version FROM schema_migrations"))).scalars())
+        for version, name, steps in MIGRATIONS:
+            if version in applied:
+                continue
+            for step in steps:
+                if callable(step):
+                    await step(conn)
+                else:
+                    await conn.execute(text(step))
+            await conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {'version': version, 'name': name}
+            )
+            logger.info(f"Applied migration {version}: {name}")
+    return MIGRATIONS[-1][0]
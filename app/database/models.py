@@ -1,37 +1,22 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
-from sqlalchemy import BigInteger, ARRAY, Integer, String, Enum, UniqueConstraint
-from decouple import config
-import enum
-
-DATABASE_URL = 'postgresql+asyncpg://{user}:{password}@{host}:{port}/{name}'.format(
-    user=config('DB_USERNAME'),
-    password=config('DB_PASSWORD'),
-    host=config('DB_HOST'),
-    port=config('DB_PORT'),
-    name=config('DB_NAME')
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncAttrs
+from sqlalchemy import (
+    BigInteger, ARRAY, Boolean, Computed, DateTime, ForeignKey, Index, Integer, String, Enum, UniqueConstraint,
+    PrimaryKeyConstraint, func
 )
+from datetime import datetime
+import enum
 
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,
-    pool_pre_ping=True,
-    connect_args={
-        "statement_cache_size": 0,
-        "prepared_statement_cache_size": 0
-    }
+# Анкета заполнена: все ответы непустые, возраст положительный, выбрана хотя бы одна программа.
+# Хранимая генерируемая колонка - Postgres пересчитывает ее при каждой записи
+IS_COMPLETE_SQL = (
+    "coalesce("
+    "btrim(name) <> '' AND btrim(phone) <> '' AND btrim(email) <> '' AND age > 0 "
+    "AND btrim(occupation) <> '' AND btrim(city) <> '' AND btrim(crypto_experience) <> '' "
+    "AND cardinality(programs) > 0, false)"
 )
 
-async_session = async_sessionmaker(engine, expire_on_commit=False)
-
-async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-
-async def get_session():
-    async with async_session() as session:
-        yield session
-
 class Base(AsyncAttrs, DeclarativeBase):
 	pass
 
@@ -39,12 +24,18 @@ class UserStatus(enum.Enum):
     student = 'ученик'
     captain = 'капитан'
 
+# Ответ участника, отказавшегося от роли капитана
+NOT_INTERESTED = "Не заинтересован"
+
 class User(Base):
     __tablename__ = 'nastavnichestvo'
-    __table_args__ = (UniqueConstraint('telegram_id', name='uq_telegram_id'),)
+    __table_args__ = (
+        UniqueConstraint('telegram_id', name='uq_telegram_id'),
+        Index('ix_nastavnichestvo_updated_at', 'updated_at'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger)
     name: Mapped[str] = mapped_column(String, nullable=True)
     phone: Mapped[str] = mapped_column(String, nullable=True)
     telegram: Mapped[str] = mapped_column(String, nullable=True)
@@ -56,4 +47,72 @@ class User(Base):
     programs: Mapped[list[str]] = mapped_column(ARRAY(String), nullable=True)
     captain_motivation: Mapped[str] = mapped_column(String, nullable=True)
     status: Mapped[UserStatus] = mapped_column(Enum(UserStatus), default=UserStatus.student)
-       
\ No newline at end of file
+    # Метка последнего изменения, по ней выгружаются только изменившиеся пользователи
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=True
+    )
+    is_complete: Mapped[bool] = mapped_column(Boolean, Computed(IS_COMPLETE_SQL, persisted=True))
+
+class SheetRow(Base):
+    # Индекс строк Google таблицы: telegram_id -> номер строки и хеш ее содержимого
+    __tablename__ = 'sheet_rows'
+
+    telegram_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    row: Mapped[int] = mapped_column(Integer)
+    row_hash: Mapped[str] = mapped_column(String(32))
+
+class SheetSyncMeta(Base):
+    # Служебные значения синхронизации (watermark последней выгрузки и т.п.)
+    __tablename__ = 'sheet_sync_meta'
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[str] = mapped_column(String, nullable=True)
+       
+class BroadcastDelivery(Base):
+    # Журнал доставки рассылок: позволяет продолжить прерванную рассылку без повторных сообщений
+    __tablename__ = 'broadcast_deliveries'
+    __table_args__ = (PrimaryKeyConstraint('broadcast_id', 'telegram_id'),)
+
+    broadcast_id: Mapped[str] = mapped_column(String)
+    telegram_id: Mapped[int] = mapped_column(BigInteger)
+    status: Mapped[str] = mapped_column(String)
+    error: Mapped[str] = mapped_column(String, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+class FSMRecord(Base):
+    # Состояние и данные FSM по ключу чата (см. app/database/storage.py)
+    __tablename__ = 'fsm_states'
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    state: Mapped[str] = mapped_column(String, nullable=True)
+    data: Mapped[dict] = mapped_column(JSONB, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+class Team(Base):
+    # «Десятка», сформированная app/teams.py
+    __tablename__ = 'teams'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    number: Mapped[int] = mapped_column(Integer, unique=True)
+    captain_telegram_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    # Ссылка на чат команды, задается командой /team_link
+    link: Mapped[str] = mapped_column(String, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+class TeamMember(Base):
+    __tablename__ = 'team_members'
+
+    telegram_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    team_id: Mapped[int] = mapped_column(ForeignKey('teams.id', ondelete='CASCADE'), index=True)
+
+class AllowedEmail(Base):
+    # Список оплативших участников (источник ALLOWLIST_SOURCE=db), заполняется manage.py import-emails
+    __tablename__ = 'allowed_emails'
+
+    email: Mapped[str] = mapped_column(String, primary_key=True)
+    added_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), index=True)
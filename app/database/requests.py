@@ -1,22 +1,57 @@
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
-from decouple import config
-from .models import Base
+from typing import Any, Dict, Iterable, Optional
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from .cache import status_cache
+from .changes import changes
+from .models import User, UserStatus
 
-DATABASE_URL = 'postgresql+asyncpg://{user}:{password}@{host}:{port}/{name}'.format(
-    user=config('DB_USERNAME'),
-    password=config('DB_PASSWORD'),
-    host=config('DB_HOST'),
-    port=config('DB_PORT'),
-    name=config('DB_NAME')
-)
+# Все запросы к таблице участников - по одному выражению на операцию
 
-engine = create_async_engine(DATABASE_URL, echo=True)
-async_session = async_sessionmaker(engine, expire_on_commit=False)
+USER_COLUMNS = tuple(User.__table__.columns)
 
-async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+async def get_user(session: AsyncSession, telegram_id: int) -> Optional[User]:
+    return await session.scalar(select(User).where(User.telegram_id == telegram_id))
 
-async def get_session():
-    async with async_session() as session:
-        yield session
\ No newline at end of file
+async def get_or_create_user(session: AsyncSession, telegram_id: int, telegram: Optional[str]) -> Row:
+    # Один INSERT ... ON CONFLICT: создает участника или возвращает существующего.
+    # Поле inserted истинно, если запись только что создана
+    stmt = insert(User).values(telegram_id=telegram_id, telegram=telegram, status=UserStatus.student)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={'telegram': func.coalesce(stmt.excluded.telegram, User.telegram)}
+    ).returning(*USER_COLUMNS, literal_column('(xmax = 0)').label('inserted'))
+    row = (await session.execute(stmt)).one()
+    if row.inserted:
+        await changes.stage(session, [telegram_id])
+    await session.commit()
+    if row.inserted:
+        changes.publish([telegram_id])
+    return row
+
+def _upsert_statement(rows: list, keys: Iterable[str]):
+    stmt = insert(User).values(rows)
+    set_ = {key: stmt.excluded[key] for key in keys}
+    set_['updated_at'] = func.now()
+    return stmt.on_conflict_do_update(index_elements=[User.telegram_id], set_=set_)
+
+async def upsert_user(session: AsyncSession, telegram_id: int, **fields: Any) -> None:
+    # Частичное обновление: меняются только переданные поля, отсутствующий участник создается
+    await session.execute(_upsert_statement([{'telegram_id': telegram_id, **fields}], fields))
+    await changes.stage(session, [telegram_id])
+    await session.commit()
+    status_cache.invalidate(telegram_id)
+    changes.publish([telegram_id])
+
+async def upsert_users(session: AsyncSession, users: Dict[int, Dict[str, Any]]) -> int:
+    # Пачка частичных обновлений: участники с одинаковым набором полей пишутся одним выражением,
+    # чтобы не затирать NULL-ами поля, которых нет в конкретном обновлении.
+    # Коммит и changes.publish после него - за вызывающим
+    groups = {}
+    for telegram_id, fields in users.items():
+        groups.setdefault(frozenset(fields), []).append({'telegram_id': telegram_id, **fields})
+    for keys, rows in groups.items():
+        await session.execute(_upsert_statement(rows, keys))
+    await changes.stage(session, users)
+    return len(groups)
@@ -0,0 +1,104 @@
+import json
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+from decouple import config
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import NOT_INTERESTED
+
+# Незаполненная анкета без изменений дольше этого числа часов считается брошенной
+STATS_ABANDONED_AFTER = config('STATS_ABANDONED_AFTER', default=24, cast=float)
+
+# Шаги анкеты в порядке вопросов: участник «застрял» на первом шаге без ответа
+QUESTION_STEPS = ('name', 'phone', 'email', 'age', 'occupation', 'city', 'crypto_experience', 'programs')
+
+# Один проход по таблице: CTE материализуется один раз и используется тремя агрегатами
+REGISTRATION_STATS_SQL = text("""
+WITH users AS MATERIALIZED (
+    SELECT
+        is_complete,
+        status,
+        captain_motivation,
+        programs,
+        updated_at < now() - make_interval(secs => :abandoned_after) AS stale,
+        CASE
+            WHEN is_complete THEN NULL
+            WHEN coalesce(btrim(name), '') = '' THEN 'name'
+            WHEN coalesce(btrim(phone), '') = '' THEN 'phone'
+            WHEN coalesce(btrim(email), '') = '' THEN 'email'
+            WHEN coalesce(age, 0) <= 0 THEN 'age'
+            WHEN coalesce(btrim(occupation), '') = '' THEN 'occupation'
+            WHEN coalesce(btrim(city), '') = '' THEN 'city'
+            WHEN coalesce(btrim(crypto_experience), '') = '' THEN 'crypto_experience'
+            ELSE 'programs'
+        END AS step
+    FROM nastavnichestvo
+),
+totals AS (
+    SELECT
+        count(*) AS total,
+        count(*) FILTER (WHERE is_complete) AS complete,
+        count(*) FILTER (WHERE NOT is_complete AND NOT coalesce(stale, false)) AS in_progress,
+        count(*) FILTER (WHERE NOT is_complete AND coalesce(stale, false)) AS abandoned,
+        count(*) FILTER (WHERE status = 'captain') AS captains,
+        count(*) FILTER (WHERE captain_motivation = :not_interested) AS not_interested
+    FROM users
+),
+steps AS (
+    SELECT json_object_agg(step, json_build_array(in_progress, abandoned)) AS steps
+    FROM (
+        SELECT
+            step,
+            count(*) FILTER (WHERE NOT coalesce(stale, false)) AS in_progress,
+            count(*) FILTER (WHERE coalesce(stale, false)) AS abandoned
+        FROM users
+        WHERE step IS NOT NULL
+        GROUP BY step
+    ) s
+),
+program_counts AS (
+    SELECT json_object_agg(program, total) AS programs
+    FROM (
+        SELECT program, count(*) AS total
+        FROM users, unnest(programs) AS program
+        WHERE is_complete
+        GROUP BY program
+    ) p
+)
+SELECT totals.*, steps.steps, program_counts.programs
+FROM totals, steps, program_counts
+""")
+
+@dataclass
+class RegistrationStats:
+    total: int = 0
+    complete: int = 0
+    in_progress: int = 0
+    abandoned: int = 0
+    captains: int = 0
+    not_interested: int = 0
+    # шаг -> (в процессе, брошено)
+    steps: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    # программа -> число заполнивших анкету участников
+    programs: Dict[str, int] = field(default_factory=dict)
+
+def _json(value):
+    # Колонки json из текстового запроса драйвер отдает строкой
+    return json.loads(value) if isinstance(value, str) else (value or {})
+
+async def registration_stats(session: AsyncSession, abandoned_after=STATS_ABANDONED_AFTER):
+    row = (await session.execute(REGISTRATION_STATS_SQL, {
+        'abandoned_after': abandoned_after * 3600,
+        'not_interested': NOT_INTERESTED,
+    })).one()
+    steps = _json(row.steps)
+    return RegistrationStats(
+        total=row.total,
+        complete=row.complete,
+        in_progress=row.in_progress,
+        abandoned=row.abandoned,
+        captains=row.captains,
+        not_interested=row.not_interested,
+        steps={step: tuple(steps[step]) for step in QUESTION_STEPS if step in steps},
+        programs=dict(sorted(_json(row.programs).items(), key=lambda item: -item[1])),
+    )
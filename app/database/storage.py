@@ -0,0 +1,84 @@
+import copy
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from cachetools import TTLCache
+from decouple import config
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from .engine import get_session
+from .models import FSMRecord
+
+FSM_CACHE_SIZE = config('FSM_CACHE_SIZE', default=10000, cast=int)
+# Кеш чтения верен, только пока состояние пишет один процесс: при WEBHOOK_WORKERS > 1
+# апдейты одного пользователя попадают в разные процессы, и кеш нужно выключить (0)
+FSM_CACHE_TTL = config('FSM_CACHE_TTL', default=5.0, cast=float)
+
+class PostgresStorage(BaseStorage):
+    def __init__(self, session_maker=get_session, cache_size=FSM_CACHE_SIZE, cache_ttl=FSM_CACHE_TTL):
+        self.session_maker = session_maker
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl > 0 else None
+
+    @staticmethod
+    def _key(key: StorageKey):
+        return ':'.join(str(part) if part is not None else '' for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    async def _load(self, key):
+        if self._cache is not None and key in self._cache:
+            return self._cache[key]
+
+        record = None
+        async for session in self.session_maker():
+            result = await session.execute(select(FSMRecord.state, FSMRecord.data).where(FSMRecord.key == key))
+            record = result.one_or_none()
+        entry = (record.state, record.data or {}) if record else (None, {})
+        if self._cache is not None:
+            self._cache[key] = entry
+        return entry
+
+    async def _store(self, key, column, value):
+        # Запись сразу в БД: следующий апдейт пользователя может обработать другой процесс,
+        # и к этому моменту состояние уже должно быть сохранено. Пишется только своя колонка:
+        # set_state и set_data одного ключа не затирают друг друга, даже если выполняются одновременно
+        async for session in self.session_maker():
+            if value is None or value == {}:
+                # Пустое значение не создает строку, только сбрасывает колонку существующей
+                stmt = update(FSMRecord).where(FSMRecord.key == key).values({column: value, 'updated_at': func.now()})
+            else:
+                stmt = insert(FSMRecord).values({'key': key, column: value})
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[FSMRecord.key],
+                    set_={column: getattr(stmt.excluded, column), 'updated_at': func.now()}
+                )
+            result = await session.execute(stmt.returning(FSMRecord.state, FSMRecord.data))
+            record = result.one_or_none()
+            if record is not None and record.state is None and not record.data:
+                # Строку без состояния и данных (state.clear()) удаляем, если ее никто не успел заполнить
+                await session.execute(delete(FSMRecord).where(
+                    FSMRecord.key == key, FSMRecord.state.is_(None),
+                    or_(FSMRecord.data.is_(None), FSMRecord.data == {})
+                ))
+            await session.commit()
+        # Кеш обновляется из строки, которую вернула сама запись, - с колонкой, записанной параллельно
+        entry = (record.state, record.data or {}) if record else (None, {})
+        if self._cache is not None:
+            self._cache[key] = entry
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._store(self._key(key), 'state', state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._store(self._key(key), 'data', copy.deepcopy(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self._key(key))
+        return copy.deepcopy(data)
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,11 @@
+from aiogram.filters import BaseFilter
+from aiogram.types import TelegramObject
+from decouple import Csv, config
+
+# Telegram ID администраторов через запятую
+ADMIN_IDS = set(config('ADMIN_IDS', default='', cast=Csv(int)))
+
+class IsAdmin(BaseFilter):
+    async def __call__(self, event: TelegramObject) -> bool:
+        user = getattr(event, 'from_user', None)
+        return user is not None and user.id in ADMIN_IDS
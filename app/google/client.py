@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import random
+import time
+from decouple import config
+from app.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+# Жесткий таймаут одного обращения к Google (HTTP-таймаут gspread и ожидание в event loop)
+SHEETS_TIMEOUT = config('SHEETS_TIMEOUT', default=30, cast=float)
+SHEETS_RETRIES = config('SHEETS_RETRIES', default=5, cast=int)
+SHEETS_BACKOFF = config('SHEETS_BACKOFF', default=1.0, cast=float)
+SHEETS_MAX_BACKOFF = config('SHEETS_MAX_BACKOFF', default=60, cast=float)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Записи не повторяются, если запрос мог дойти до Google: по таймауту поток с запросом продолжает работать,
+# а 5xx приходит и на уже примененную запись. Повтор добавил бы строки сетки второй раз или перезаписал
+# правки, сделанные после первой попытки. Несохраненный индекс строк исправит следующая выгрузка
+WRITE_METHODS = {'batch_update', 'add_rows'}
+
+sheets_calls = Counter('sheets_api_calls_total', 'Google Sheets API calls, including retries')
+sheets_latency = Histogram('sheets_api_latency_seconds', 'Google Sheets API call latency')
+
+def is_retryable(error, write=False):
+    # gspread и requests к этому моменту уже загружены первым обращением к таблице
+    import gspread
+    import requests
+    if isinstance(error, gspread.exceptions.APIError):
+        # 429 - запрос отклонен квотой и не выполнялся
+        return error.code == 429 if write else error.code in RETRYABLE_STATUS
+    if write:
+        # Соединение не установлено - запрос точно не отправлен
+        return isinstance(error, requests.exceptions.ConnectTimeout)
+    return isinstance(error, (requests.exceptions.RequestException, asyncio.TimeoutError, TimeoutError))
+
+class AsyncSheet:
+    # Асинхронная обертка над листом gspread. Подключение создается при первом
+    # обращении и кешируется, блокирующие HTTP-вызовы выполняются в отдельном потоке
+    def __init__(self, url, credentials_path, timeout=SHEETS_TIMEOUT, retries=SHEETS_RETRIES):
+        self.url = url
+        self.credentials_path = credentials_path
+        self.timeout = timeout
+        self.retries = retries
+        self.api_calls = 0
+        self._spreadsheet = None
+        self._worksheet = None
+        self._lock = asyncio.Lock()
+
+    def _open(self):
+        # gspread тянет google-auth и requests - импорт откладывается до первой выгрузки
+        import gspread
+        client = gspread.service_account(filename=self.credentials_path, scopes=SCOPES)
+        client.set_timeout(self.timeout)
+        self._spreadsheet = client.open_by_url(self.url)
+        return self._spreadsheet.sheet1
+
+    async def _run(self, func, *args, write=False, **kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            self.api_calls += 1
+            sheets_calls.inc()
+            started = time.perf_counter()
+            try:
+                # Поток по таймауту не прерывается, но event loop дальше не ждет;
+                # сам запрос ограничен HTTP-таймаутом клиента
+                return await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), self.timeout)
+            except Exception as e:
+                error = e
+            finally:
+                sheets_latency.observe(time.perf_counter() - started)
+            if attempt > self.retries or not is_retryable(error, write):
+                raise error
+            # Экспоненциальная задержка с полным джиттером
+            delay = random.uniform(0, min(SHEETS_MAX_BACKOFF, SHEETS_BACKOFF * 2 ** attempt))
+            logger.warning(f"Google Sheets call {getattr(func, '__name__', func)} failed: {error!r}, retry in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def worksheet(self):
+        if self._worksheet is None:
+            async with self._lock:
+                if self._worksheet is None:
+                    self._worksheet = await self._run(self._open)
+        return self._worksheet
+
+    async def call(self, method, *args, **kwargs):
+        worksheet = await self.worksheet()
+        return await self._run(getattr(worksheet, method), *args, write=method in WRITE_METHODS, **kwargs)
+
+    async def row_count(self):
+        # Размер сетки берется из метаданных, полученных при открытии листа
+        return (await self.worksheet()).row_count
+
+    async def modified_time(self):
+        # Время последнего изменения файла из метаданных Drive - без чтения содержимого
+        await self.worksheet()
+        return await self._run(self._spreadsheet.get_lastUpdateTime)
+
+    async def get_values(self, range_name):
+        return await self.call('get_values', range_name)
+
+    async def col_values(self, col):
+        return await self.call('col_values', col)
+
+    async def batch_update(self, data):
+        return await self.call('batch_update', data)
+
+    async def add_rows(self, rows):
+        return await self.call('add_rows', rows)
@@ -0,0 +1,122 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+from decouple import config
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.engine import get_engine
+from .sync import SyncStats, _get_meta, _set_meta
+
+# Ключ advisory lock Postgres, под которым идет выгрузка в таблицу во всех процессах бота
+SHEETS_SYNC_LOCK_KEY = config('SHEETS_SYNC_LOCK_KEY', default=731010, cast=int)
+# Сколько ждать, пока выгрузку закончит другой процесс
+SHEETS_SYNC_LOCK_TIMEOUT = config('SHEETS_SYNC_LOCK_TIMEOUT', default=600, cast=float)
+# Инкрементальная выгрузка пропускается, если предыдущая закончилась меньше этого числа секунд назад
+SHEETS_SYNC_MIN_INTERVAL = config('SHEETS_SYNC_MIN_INTERVAL', default=60, cast=float)
+
+LAST_SYNC_KEY = 'last_sync_finished'
+LOCK_POLL_INTERVAL = 1.0
+
+class SyncBusy(Exception):
+    # Выгрузку слишком долго держит другой процесс
+    pass
+
+@dataclass
+class SyncOutcome:
+    stats: Optional[SyncStats] = None
+    # Выгрузка уже шла в этом процессе - вызывающий получил ее результат
+    joined: bool = False
+    # Предыдущая выгрузка закончилась недавно - новая не запускалась
+    skipped: bool = False
+    # Сколько секунд назад закончилась предыдущая выгрузка (для skipped)
+    last_age: float = 0.0
+    elapsed: float = 0.0
+
+class SyncCoordinator:
+    # Единственная выгрузка на все процессы: внутри процесса - asyncio.Lock и общий future
+    # для одинаковых запросов, между процессами - pg_try_advisory_lock
+    def __init__(self, lock_key=SHEETS_SYNC_LOCK_KEY, lock_timeout=SHEETS_SYNC_LOCK_TIMEOUT,
+                 min_interval=SHEETS_SYNC_MIN_INTERVAL):
+        self.lock_key = lock_key
+        self.lock_timeout = lock_timeout
+        self.min_interval = min_interval
+        self._lock = asyncio.Lock()
+        # full -> future выгрузки, к которой присоединяются следующие вызовы того же вида
+        self._inflight = {}
+
+    @asynccontextmanager
+    async def _advisory_lock(self):
+        # Блокировка уровня сессии Postgres: держится на отдельном соединении до явного снятия.
+        # Если снятие не завершилось (отмена задачи, ошибка), соединение не возвращается в пул с блокировкой,
+        # а закрывается: Postgres снимает блокировку вместе с сессией
+        async with get_engine().connect() as connection:
+            released = False
+            try:
+                deadline = time.monotonic() + self.lock_timeout
+                while not await connection.scalar(text("SELECT pg_try_advisory_lock(:key)"), {'key': self.lock_key}):
+                    if time.monotonic() > deadline:
+                        released = True
+                        raise SyncBusy("Google Sheet sync is held by another process")
+                    await asyncio.sleep(LOCK_POLL_INTERVAL)
+                try:
+                    yield
+                finally:
+                    released = await connection.scalar(text("SELECT pg_advisory_unlock(:key)"), {'key': self.lock_key})
+            finally:
+                if not released:
+                    await connection.invalidate()
+
+    async def _last_age(self, session: AsyncSession):
+        stored = await _get_meta(session, LAST_SYNC_KEY)
+        if not stored:
+            return None
+        return (datetime.now(timezone.utc) - datetime.fromisoformat(stored)).total_seconds()
+
+    async def _execute(self, session: AsyncSession, sync, check_interval, stamp=True):
+        started = time.perf_counter()
+        async with self._lock:
+            async with self._advisory_lock():
+                # Время последней выгрузки хранится в БД: окно действует и для выгрузок других процессов
+                if check_interval:
+                    age = await self._last_age(session)
+                    if age is not None and age < self.min_interval:
+                        return SyncOutcome(skipped=True, last_age=age, elapsed=time.perf_counter() - started)
+                stats = await sync()
+                # Выгрузки из ленты изменений идут каждые несколько секунд и проходят только по своим
+                # участникам: если бы они обновляли отметку, окно пропускало бы периодическую выгрузку
+                if stamp:
+                    await _set_meta(session, LAST_SYNC_KEY, datetime.now(timezone.utc).isoformat())
+                await session.commit()
+        return SyncOutcome(stats=stats, elapsed=time.perf_counter() - started)
+
+    async def run(self, session: AsyncSession, sync, full=False, force=False, targeted=False):
+        # targeted - выгрузка конкретных участников из ленты изменений: не присоединяется к другим
+        # и не пропускается по окну, только дожидается своей очереди
+        if targeted:
+            return await self._execute(session, sync, check_interval=False, stamp=False)
+
+        inflight = self._inflight.get(full)
+        if inflight is not None:
+            outcome = await asyncio.shield(inflight)
+            return SyncOutcome(stats=outcome.stats, joined=True, skipped=outcome.skipped,
+                               last_age=outcome.last_age, elapsed=outcome.elapsed)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[full] = future
+        try:
+            outcome = await self._execute(session, sync, check_interval=not (full or force))
+            future.set_result(outcome)
+            return outcome
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ошибку получат присоединившиеся; если их нет, asyncio не должен ругаться на необработанную
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(full, None)
@@ -1,71 +1,49 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from app.database.models import User, UserStatus
+import logging
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from datetime import datetime
+from decouple import config
+from app.database.changes import changes
+from app.database.engine import get_session
+from .client import AsyncSheet
+from .coordinator import SyncCoordinator
+from .sync import sync_users
 
-# Настройка аутентификации
-scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-creds = ServiceAccountCredentials.from_json_keyfile_name('app/google/nice-script-413614-cb7ad51ac23d.json', scope)
-client = gspread.authorize(creds)
+logger = logging.getLogger(__name__)
 
-# URL вашей Google Таблицы
-SHEET_URL = 'https://docs.google.com/spreadsheets/d/1XtQDtT2boACxE_glBcH2MNWL0Rq2yyIgfDztzUqJ2yg/edit#gid=0'
-sheet = client.open_by_url(SHEET_URL).sheet1
-
-async def update_google_sheet(session: AsyncSession):
-    # Получение всех пользователей из базы данных
-    result = await session.execute(select(User))
-    users = result.scalars().all()
-
-    # Получение всех данных из таблицы
-    all_values = sheet.get_all_values()
-    headers = all_values[0]
-    existing_data = {int(row[0]): row for row in all_values[1:] if row[0].isdigit()}
-
-    # Подготовка данных для обновления и добавления
-    rows_to_update = []
-    rows_to_append = []
-
-    for user in users:
-        user_data = [
-            user.telegram_id,
-            user.name,
-            user.phone,
-            user.telegram,
-            user.email,
-            user.age,
-            user.occupation,
-            user.city,
-            user.crypto_experience,
-            ', '.join(user.programs) if isinstance(user.programs, list) else str(user.programs),
-            user.captain_motivation,
-            user.status.value,
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        ]
+# Ключ сервисного аккаунта
+CREDENTIALS_PATH = config('GOOGLE_CREDENTIALS_PATH', default='app/google/nice-script-413614-cb7ad51ac23d.json')
 
-        if user.telegram_id in existing_data:
-            # Обновление существующей записи
-            row_num = all_values.index(existing_data[user.telegram_id]) + 1
-            rows_to_update.append({'row': row_num, 'values': user_data})
-        else:
-            # Добавление новой записи
-            rows_to_append.append(user_data)
-
-    # Обновление существующих записей
-    for row in rows_to_update:
-        sheet.update(f'A{row["row"]}:M{row["row"]}', [row['values']])
+# URL вашей Google Таблицы
+SHEET_URL = config(
+    'GOOGLE_SHEET_URL',
+    default='https://docs.google.com/spreadsheets/d/1XtQDtT2boACxE_glBcH2MNWL0Rq2yyIgfDztzUqJ2yg/edit#gid=0'
+)
+# Измененные участники выгружаются по ленте изменений через секунды после записи;
+# периодическая выгрузка по watermark подбирает то, что прошло мимо ленты (импорт, другие процессы)
+SHEETS_SYNC_INTERVAL = config('SHEETS_SYNC_INTERVAL', default=60, cast=float)
+# Подключение к Google откладывается до первой выгрузки
+sheet = AsyncSheet(SHEET_URL, CREDENTIALS_PATH)
+# Выгрузки не пересекаются ни в процессе, ни между процессами: иначе две могут добавить одного участника дважды
+coordinator = SyncCoordinator()
 
-    # Добавление новых записей
-    if rows_to_append:
-        sheet.append_rows(rows_to_append)
+async def update_google_sheet(session: AsyncSession, full=False, telegram_ids=None, force=False):
+    # Инкрементальная выгрузка: в таблицу пишутся только изменившиеся пользователи
+    outcome = await coordinator.run(
+        session, lambda: sync_users(session, sheet, full=full, telegram_ids=telegram_ids),
+        full=full, force=force, targeted=telegram_ids is not None
+    )
+    if outcome.stats is not None and not outcome.joined:
+        logger.info(f"Google Sheet sync finished in {outcome.elapsed:.1f}s")
+    return outcome
 
-    print(f"Updated {len(rows_to_update)} existing rows and added {len(rows_to_append)} new rows in Google Sheet.")
+async def sync_changed_users(telegram_ids):
+    async for session in get_session():
+        await update_google_sheet(session, telegram_ids=telegram_ids)
 
 def start_scheduler(session_maker):
+    # APScheduler импортируется только в процессе, который выгружает таблицу
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.interval import IntervalTrigger
+
     scheduler = AsyncIOScheduler()
     
     async def scheduled_update():
@@ -77,7 +55,7 @@ def start_scheduler(session_maker):
 
     scheduler.add_job(
         scheduled_update,
-        trigger=IntervalTrigger(hours=30),
+        trigger=IntervalTrigger(minutes=SHEETS_SYNC_INTERVAL),
         id='update_google_sheet',
         replace_existing=True
     )
@@ -86,4 +64,5 @@ def start_scheduler(session_maker):
 
 # Эту функцию нужно вызвать при запуске бота
 async def setup_google_sheet_update(session_maker):
+    await changes.start(sync_changed_users)
     start_scheduler(session_maker)
\ No newline at end of file
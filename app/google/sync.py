@@ -0,0 +1,257 @@
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from decouple import config
+from app.database.models import User, SheetRow, SheetSyncMeta
+from app.validation import format_phone
+
+logger = logging.getLogger(__name__)
+
+# Колонки A..L заполняются данными пользователя, M - время выгрузки
+DATA_COLUMNS = 12
+LAST_COLUMN = 'M'
+# Размер пачки пользователей: чтение из БД, поиск в индексе и запись в таблицу
+SYNC_CHUNK = config('SHEETS_SYNC_CHUNK', default=1000, cast=int)
+# Перекрытие watermark: транзакции, начатые до выгрузки, могут закоммититься после нее.
+# Повторно выбранные строки отсекаются по хешу и в таблицу не пишутся
+WATERMARK_OVERLAP = timedelta(minutes=1)
+WATERMARK_KEY = 'users_watermark'
+# Время изменения таблицы после нашей последней записи. Если оно другое - таблицу правили вручную
+# (сортировка, удаление строк), и номера строк в индексе сверяются с колонкой telegram_id
+SHEET_MODIFIED_KEY = 'sheet_modified_time'
+
+@dataclass
+class SyncStats:
+    scanned: int = 0
+    updated: int = 0
+    appended: int = 0
+    unchanged: int = 0
+    api_calls: int = 0
+    # Примерный объем прочитанных из таблицы данных, байт
+    downloaded: int = 0
+    # Индекс сверялся с таблицей после ручной правки
+    reconciled: bool = False
+
+# Выгружаются только нужные колонки, без загрузки ORM-объектов целиком
+EXPORT_COLUMNS = (
+    User.telegram_id, User.name, User.phone, User.telegram, User.email, User.age, User.occupation,
+    User.city, User.crypto_experience, User.programs, User.captain_motivation, User.status, User.updated_at,
+)
+
+def user_to_row(user):
+    return [
+        user.telegram_id,
+        user.name,
+        format_phone(user.phone),
+        user.telegram,
+        user.email,
+        user.age,
+        user.occupation,
+        user.city,
+        user.crypto_experience,
+        ', '.join(user.programs) if isinstance(user.programs, list) else str(user.programs),
+        user.captain_motivation,
+        user.status.value,
+    ]
+
+def payload_size(values):
+    return len(json.dumps(values, ensure_ascii=False).encode('utf-8'))
+
+def row_hash(values):
+    # Таблица возвращает все значения строками, а пустые ячейки - пустой строкой,
+    # поэтому хеш считается по нормализованному виду строки
+    normalized = ['' if value is None else str(value) for value in values[:DATA_COLUMNS]]
+    normalized += [''] * (DATA_COLUMNS - len(normalized))
+    payload = json.dumps(normalized, ensure_ascii=False).encode('utf-8')
+    return hashlib.md5(payload).hexdigest()
+
+async def _get_meta(session: AsyncSession, key):
+    return await session.scalar(select(SheetSyncMeta.value).where(SheetSyncMeta.key == key))
+
+async def _set_meta(session: AsyncSession, key, value):
+    stmt = insert(SheetSyncMeta).values(key=key, value=value)
+    stmt = stmt.on_conflict_do_update(index_elements=[SheetSyncMeta.key], set_={'value': stmt.excluded.value})
+    await session.execute(stmt)
+
+async def _save_index(session: AsyncSession, entries):
+    if not entries:
+        return
+    stmt = insert(SheetRow).values(entries)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SheetRow.telegram_id],
+        set_={'row': stmt.excluded.row, 'row_hash': stmt.excluded.row_hash}
+    )
+    await session.execute(stmt)
+
+async def reset_index(session: AsyncSession):
+    await session.execute(delete(SheetRow))
+    await session.execute(delete(SheetSyncMeta).where(SheetSyncMeta.key.in_([WATERMARK_KEY, SHEET_MODIFIED_KEY])))
+    await session.commit()
+
+async def _bootstrap_index(session: AsyncSession, sheet, stats: SyncStats):
+    # Первый запуск: строим индекс по текущему содержимому таблицы, читая ее диапазонами
+    row_count = await sheet.row_count()
+    last_row = 1
+    indexed = 0
+    for start in range(2, row_count + 1, SYNC_CHUNK):
+        end = min(start + SYNC_CHUNK - 1, row_count)
+        values = await sheet.get_values(f'A{start}:{LAST_COLUMN}{end}')
+        stats.api_calls += 1
+        stats.downloaded += payload_size(values)
+        if not values:
+            break
+        # Пустые строки в конце диапазона Google не возвращает
+        last_row = start + len(values) - 1
+        entries = [
+            {'telegram_id': int(row[0]), 'row': row_num, 'row_hash': row_hash(row)}
+            for row_num, row in enumerate(values, start=start) if row and row[0].isdigit()
+        ]
+        await _save_index(session, entries)
+        await session.commit()
+        indexed += len(entries)
+
+    logger.info(f"Sheet index bootstrapped with {indexed} rows")
+    return last_row
+
+async def _reconcile_index(session: AsyncSession, sheet, stats: SyncStats):
+    # Таблицу правили вручную: читаем одну колонку telegram_id вместо всего листа. Хеш остается
+    # только у строк на прежнем месте, переехавшие строки перезапишутся при следующем изменении участника
+    keys = await sheet.col_values(1)
+    stats.api_calls += 1
+    stats.downloaded += payload_size(keys)
+    stats.reconciled = True
+    positions = {int(key): row_num for row_num, key in enumerate(keys, start=1) if row_num > 1 and key.isdigit()}
+
+    result = await session.execute(select(SheetRow.telegram_id, SheetRow.row))
+    index = dict(result.all())
+    moved = [
+        {'telegram_id': telegram_id, 'row': row_num, 'row_hash': ''}
+        for telegram_id, row_num in positions.items() if index.get(telegram_id) != row_num
+    ]
+    removed = [telegram_id for telegram_id in index if telegram_id not in positions]
+    for start in range(0, len(moved), SYNC_CHUNK):
+        await _save_index(session, moved[start:start + SYNC_CHUNK])
+    for start in range(0, len(removed), SYNC_CHUNK):
+        await session.execute(delete(SheetRow).where(SheetRow.telegram_id.in_(removed[start:start + SYNC_CHUNK])))
+    await session.commit()
+
+    logger.info(f"Sheet edited outside the bot: {len(moved)} rows moved or added, {len(removed)} removed from the index")
+    # Новые строки - после последней заполненной, даже если ее добавили вручную
+    return max(len(keys), 1)
+
+async def _lookup_index(session: AsyncSession, telegram_ids):
+    result = await session.execute(
+        select(SheetRow.telegram_id, SheetRow.row, SheetRow.row_hash).where(SheetRow.telegram_id.in_(telegram_ids))
+    )
+    return {telegram_id: (row_num, hash_value) for telegram_id, row_num, hash_value in result}
+
+async def sync_users(session: AsyncSession, sheet, full=False, telegram_ids=None):
+    # telegram_ids - выгрузить только этих участников (лента изменений); watermark при этом не двигается,
+    # периодическая выгрузка пройдет по ним еще раз и отсеет по хешу
+    stats = SyncStats()
+
+    if full:
+        await reset_index(session)
+
+    last_row = await session.scalar(select(func.max(SheetRow.row)))
+    watermark = None
+    bootstrapped = last_row is None
+    if bootstrapped:
+        last_row = await _bootstrap_index(session, sheet, stats)
+    else:
+        stored = await _get_meta(session, WATERMARK_KEY)
+        watermark = datetime.fromisoformat(stored) if stored else None
+        # Дешевая проверка метаданных вместо чтения листа: индекс верен, пока таблицу меняли только мы
+        modified = await sheet.modified_time()
+        stats.api_calls += 1
+        if modified != await _get_meta(session, SHEET_MODIFIED_KEY):
+            last_row = await _reconcile_index(session, sheet, stats)
+
+    synced_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    row_count = await sheet.row_count()
+    new_watermark = watermark
+
+    async def push(users):
+        nonlocal last_row, row_count, new_watermark
+        stats.scanned += len(users)
+        index = await _lookup_index(session, [user.telegram_id for user in users])
+        updates = []
+        index_entries = []
+
+        for user in users:
+            if user.updated_at is not None and (new_watermark is None or user.updated_at > new_watermark):
+                new_watermark = user.updated_at
+
+            values = user_to_row(user)
+            hash_value = row_hash(values)
+            existing = index.get(user.telegram_id)
+
+            if existing is not None:
+                row_num, old_hash = existing
+                if old_hash == hash_value:
+                    stats.unchanged += 1
+                    continue
+                stats.updated += 1
+            else:
+                last_row += 1
+                row_num = last_row
+                stats.appended += 1
+
+            updates.append({'range': f'A{row_num}:{LAST_COLUMN}{row_num}', 'values': [values + [synced_at]]})
+            index_entries.append({'telegram_id': user.telegram_id, 'row': row_num, 'row_hash': hash_value})
+
+        if not updates:
+            return
+        # Новые строки пишутся тем же batch_update, поэтому сетку листа расширяем заранее
+        if last_row > row_count:
+            await sheet.add_rows(last_row - row_count)
+            stats.api_calls += 1
+            row_count = last_row
+        await sheet.batch_update(updates)
+        stats.api_calls += 1
+
+        # Индекс фиксируется после каждой пачки: при сбое следующая выгрузка
+        # не будет повторно добавлять уже записанные строки
+        await _save_index(session, index_entries)
+        await session.commit()
+
+    if telegram_ids is not None:
+        telegram_ids = sorted(telegram_ids)
+        for start in range(0, len(telegram_ids), SYNC_CHUNK):
+            result = await session.execute(
+                select(*EXPORT_COLUMNS).where(User.telegram_id.in_(telegram_ids[start:start + SYNC_CHUNK]))
+            )
+            await push(result.all())
+    else:
+        query = select(*EXPORT_COLUMNS).order_by(User.updated_at)
+        if watermark is not None:
+            query = query.where(User.updated_at > watermark - WATERMARK_OVERLAP)
+
+        # Пользователи читаются серверным курсором на отдельном соединении пачками по SYNC_CHUNK,
+        # каждая пачка сразу уходит в таблицу - память не зависит от числа участников
+        async with session.bind.connect() as connection:
+            result = await connection.stream(query.execution_options(yield_per=SYNC_CHUNK))
+            async for users in result.partitions():
+                await push(users)
+
+        if new_watermark is not None:
+            await _set_meta(session, WATERMARK_KEY, new_watermark.isoformat())
+
+    if bootstrapped or stats.reconciled or stats.updated or stats.appended:
+        # Запоминаем время изменения после своих записей. Ручная правка между записью и этим
+        # запросом останется незамеченной до следующей ручной правки
+        await _set_meta(session, SHEET_MODIFIED_KEY, await sheet.modified_time())
+        stats.api_calls += 1
+    await session.commit()
+
+    logger.info(
+        f"Sheet sync{' (changes)' if telegram_ids is not None else ''}: scanned {stats.scanned}, "
+        f"updated {stats.updated}, appended {stats.appended}, unchanged {stats.unchanged}, api calls {stats.api_calls}, "
+        f"downloaded {stats.downloaded} bytes{', index reconciled' if stats.reconciled else ''}"
+    )
+    return stats
@@ -1,65 +1,54 @@
+import asyncio
 import types
 from aiogram import F, Router
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.types import Message, CallbackQuery, ContentType, ReplyKeyboardRemove
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.database.models import User, UserStatus
-from app.database.models import get_session
+from app.database.models import NOT_INTERESTED, UserStatus
+from app.database.stats import registration_stats
+from app.database.engine import get_session
+from app.database.requests import get_or_create_user
+from app.database.buffer import answers
+from app.database.cache import status_cache, STATUS_ABSENT, STATUS_COMPLETE, STATUS_INCOMPLETE
+from app.google.coordinator import SyncBusy
 from app.google.google import update_google_sheet
+from app.broadcast import Broadcaster
+from app.allowlist import allowed_emails
+from app.filters import IsAdmin
+from app.metrics import Counter
+from app.teams import get_member_links, run_assignment, set_team_link
+from app.validation import normalize_email, normalize_phone, parse_age, parse_name
 import app.keyboards as kb
 import logging
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import update
-import re
 from .constants import start_message, character_captain, congratulation_prticipant, congratulation_captain
 import csv
+import hashlib
 from pathlib import Path
 
 # Путь к CSV файлу
-CSV_PATH = Path(__file__).parent / 'database' / 'emails.csv'
 CSV_PATH_LINKS = Path(__file__).parent / 'links.csv'
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 router = Router()
 
+program_toggles = Counter('bot_program_toggles_total', 'Program selection button taps')
+program_edits = Counter('bot_program_edits_total', 'Programs keyboard edits sent to Telegram')
+program_edits_skipped = Counter('bot_program_edits_skipped_total', 'Programs keyboard edits skipped as unchanged')
+
 def read_links_from_csv(file_path):
-    logger.info('START READ CSV LINKS FILE')
     links_dict = {}
     with open(file_path, mode='r', encoding='utf-8') as file:
         reader = csv.DictReader(file, delimiter=',')  # ожидаем разделитель ';'
         for row in reader:
-            logger.info(f'{row} START WORKING')
+            # Построчный лог - только выборочно (LOG_SAMPLE_RATE)
+            logger.debug(f"Links CSV row: {row}", extra={'sample': True})
             telegram_id = int(row['telegramId'])
             link = row['link'].strip()
             links_dict[telegram_id] = link
+    logger.info(f"Read {len(links_dict)} links from {file_path}")
     return links_dict
 
-def validate_name(name):
-    # Простая проверка: имя должно содержать хотя бы два слова
-    return len(name.split()) >= 2
-
-def validate_phone(phone):
-    # Регулярное выражение для проверки формата телефона
-    pattern = r'^(\+?\d{1,4})?[-.\s]?\(?[0-9]{1,4}\)?[-.\s]?[0-9]{1,4}[-.\s]?[0-9]{1,9}$'
-    return re.match(pattern, phone) is not None
-
-def validate_email(email):
-    # Простая проверка email
-    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
-    return re.match(pattern, email) is not None
-
-def read_emails_from_csv(file_path):
-    with open(file_path, 'r') as file:
-        reader = csv.reader(file)
-        return set(email.strip().lower() for row in reader for email in row)
-    
-# Загрузим emails при запуске приложения
-ALLOWED_EMAILS = read_emails_from_csv(CSV_PATH)
-
 class UserState(StatesGroup):
     waiting_for_name = State()
     waiting_for_phone = State()
@@ -94,66 +83,71 @@ state_order = [
     UserState.waiting_for_programs
 ]
 
-async def check_user_data_completeness(user):
-    required_fields = ['name', 'phone', 'email', 'age', 'occupation', 'city', 'crypto_experience', 'programs']
-    for field in required_fields:
-        value = getattr(user, field)
-        if field == 'age':
-            if not isinstance(value, int) or value <= 0:
-                logger.info(f"Field {field} is not complete: {value}")
-                return False
-        elif field == 'programs':
-            if not isinstance(value, list) or len(value) == 0:
-                logger.info(f"Field {field} is not complete: {value}")
-                return False
-        else:
-            if value is None or (isinstance(value, str) and value.strip() == ''):
-                logger.info(f"Field {field} is not complete: {value}")
-                return False
-    return True
+# Соответствие ключей FSM-данных полям пользователя
+answer_fields = {
+    'waiting_for_name': 'name',
+    'waiting_for_phone': 'phone',
+    'waiting_for_email': 'email',
+    'waiting_for_occupation': 'occupation',
+    'waiting_for_city': 'city',
+    'waiting_for_crypto_experience': 'crypto_experience',
+    'programs': 'programs',
+}
+
+def collect_answers(user_data):
+    # Собираем из FSM-данных только реально данные ответы, чтобы не затирать поля в БД
+    update_data = {field: user_data[key] for key, field in answer_fields.items() if user_data.get(key) is not None}
+    raw_age = user_data.get('waiting_for_age')
+    age = parse_age(raw_age)
+    if age is not None:
+        update_data['age'] = age
+    elif raw_age is not None:
+        logger.warning(f"Invalid age value: {raw_age}. Skipping age update.")
+    return update_data
 
 @router.message(F.text == '/start join')
 async def cmd_start(message: Message, state: FSMContext):
-    async for session in get_session():
-        try:
-            # Поиск пользователя в базе данных
-            query = select(User).where(User.telegram_id == message.from_user.id)
-            result = await session.execute(query)
-            user = result.scalar_one_or_none()
-
-            if user:
-                is_complete = await check_user_data_completeness(user)
-                logger.info(f"User data completeness: {is_complete}")
-                if is_complete:
-                    await message.answer(
-                        "Вы уже внесены в список участников! Ожидайте распределения!\n"
-                        "Если вы хотите отредактировать свою информацию, перейдите в меню справа снизу. Там указана команда для обновления данных!"
-                    )
+    telegram_id = message.from_user.id
+    status = status_cache.get(telegram_id)
+
+    if status is None:
+        async for session in get_session():
+            try:
+                # Несохраненные ответы должны попасть в БД до проверки анкеты
+                await answers.flush_user(telegram_id)
+                # Поиск пользователя в базе данных, новый создается тем же запросом
+                user = await get_or_create_user(session, telegram_id, message.from_user.username)
+
+                if user.inserted:
+                    status = STATUS_ABSENT
+                    status_cache.set(telegram_id, STATUS_INCOMPLETE)
                 else:
-                    await message.answer(
-                        "Вы начали регистрацию, но не завершили ее. Перейдите в меню справа снизу. Там указана команда для обновления данных!"
-                    )
-                    await state.set_state(UserState.waiting_for_name)
-            else:
-                # Если пользователь не найден, создаем нового
-                new_user = User(
-                    telegram_id=message.from_user.id,
-                    telegram=message.from_user.username,
-                    status=UserStatus.student
-                )
-                session.add(new_user)
-                await session.commit()
-
-                # Запускаем опрос с первого шага
-                await message.answer(start_message, reply_markup=kb.start_keyboard)
-                await state.set_state(UserState.waiting_for_name)
-
-        except Exception as e:
-            logger.error(f"Error in cmd_start: {e}", exc_info=True)
-            await session.rollback()
-            await message.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже.")
-        finally:
-            await session.close()
+                    # Полнота анкеты считается в БД (генерируемая колонка is_complete)
+                    status = STATUS_COMPLETE if user.is_complete else STATUS_INCOMPLETE
+                    status_cache.set(telegram_id, status)
+
+            except Exception as e:
+                logger.error(f"Error in cmd_start: {e}", exc_info=True)
+                await session.rollback()
+                await message.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже.")
+                return
+            finally:
+                await session.close()
+
+    if status == STATUS_COMPLETE:
+        await message.answer(
+            "Вы уже внесены в список участников! Ожидайте распределения!\n"
+            "Если вы хотите отредактировать свою информацию, перейдите в меню справа снизу. Там указана команда для обновления данных!"
+        )
+    elif status == STATUS_INCOMPLETE:
+        await message.answer(
+            "Вы начали регистрацию, но не завершили ее. Перейдите в меню справа снизу. Там указана команда для обновления данных!"
+        )
+        await state.set_state(UserState.waiting_for_name)
+    else:
+        # Запускаем опрос с первого шага
+        await message.answer(start_message, reply_markup=kb.start_keyboard)
+        await state.set_state(UserState.waiting_for_name)
     
 
 @router.callback_query(F.data == "become_participant")
@@ -161,29 +155,6 @@ async def process_callback_become_participant(callback: CallbackQuery, state: FS
     await state.set_state(UserState.waiting_for_name)
     await callback.message.edit_text("Отлично!🙂\nДавайте познакомимся\n\n" + questions[0])
 
-async def save_to_db(session, telegram_id, data):
-    try:
-        # Проверяем, существует ли пользователь
-        stmt = select(User).where(User.telegram_id == telegram_id)
-        result = await session.execute(stmt)
-        user = result.scalar_one_or_none()
-
-        if user:
-            # Если пользователь существует, обновляем данные
-            stmt = update(User).where(User.telegram_id == telegram_id).values(**data)
-            await session.execute(stmt)
-        else:
-            # Если пользователя нет, создаем нового
-            stmt = insert(User).values(telegram_id=telegram_id, **data)
-            await session.execute(stmt)
-
-        await session.commit()
-        return True
-    except Exception as e:
-        logger.error(f"Error saving user data to DB: {e}", exc_info=True)
-        await session.rollback()
-        return False
-
 @router.message(Command("edit"))
 async def cmd_edit(message: Message, state: FSMContext):
     await state.clear()  # Очищаем текущее состояние
@@ -198,78 +169,74 @@ async def cmd_edit(callback: CallbackQuery, state: FSMContext):
 
 @router.message(UserState.waiting_for_name)
 async def process_name(message: Message, state: FSMContext):
-    if not validate_name(message.text):
+    parts = parse_name(message.text)
+    if not parts:
         await message.answer("Пожалуйста, введите полное ФИО (имя и фамилию).")
         return
-    await state.update_data(waiting_for_name=message.text)
-    async for session in get_session():
-        await save_to_db(session, message.from_user.id, {'name': message.text})
+    name = ' '.join(parts)
+    await state.update_data(waiting_for_name=name)
+    await answers.put(message.from_user.id, {'name': name})
     await state.set_state(UserState.waiting_for_phone)
-    await message.answer(f"Приятно познакомиться, {message.text.split()[1]} 🙌\n\n{questions[1]}", reply_markup=kb.phone_keyboard)
+    await message.answer(f"Приятно познакомиться, {parts[1]} 🙌\n\n{questions[1]}", reply_markup=kb.phone_keyboard)
 
 @router.message(UserState.waiting_for_phone)
 async def process_phone(message: Message, state: FSMContext):
-    phone = message.text if message.content_type != ContentType.CONTACT else message.contact.phone_number
-    if not validate_phone(phone):
+    phone = normalize_phone(message.text if message.content_type != ContentType.CONTACT else message.contact.phone_number)
+    if not phone:
         await message.answer("Пожалуйста, введите корректный номер телефона в формате: 79871011090, +79871011090, или +7 (987)101-10-90")
         return
     await state.update_data(waiting_for_phone=phone)
-    async for session in get_session():
-        await save_to_db(session, message.from_user.id, {'phone': phone})
+    await answers.put(message.from_user.id, {'phone': phone})
     await state.set_state(UserState.waiting_for_email)
     await message.answer(questions[2], reply_markup=ReplyKeyboardRemove())
 
 @router.message(UserState.waiting_for_email)
 async def process_email(message: Message, state: FSMContext):
-    if not validate_email(message.text):
+    email = normalize_email(message.text)
+    if not email:
         await message.answer("Пожалуйста, введите корректный email адрес.")
         return
     
-    email = message.text.strip().lower()
-    
-    if email not in ALLOWED_EMAILS:
+    await allowed_emails.ensure_loaded()
+    if not allowed_emails.contains(email):
         await message.answer("Извините, но данный email не найден в списке участников. Пожалуйста, проверьте правильность введенного адреса или обратитесь к организаторам.")
         return
     
     await state.update_data(waiting_for_email=email)
-    async for session in get_session():
-        await save_to_db(session, message.from_user.id, {'email': email})
+    await answers.put(message.from_user.id, {'email': email})
     await state.set_state(UserState.waiting_for_age)
     await message.answer(questions[3])
 
 @router.message(UserState.waiting_for_age)
 async def process_age(message: Message, state: FSMContext):
-    if not message.text.isdigit() or int(message.text) < 10 or int(message.text) > 100:
+    age = parse_age(message.text)
+    if age is None:
         await message.answer("Пожалуйста, введите корректный возраст (число от 10 до 100).")
         return
-    age = int(message.text)
     await state.update_data(waiting_for_age=age)
-    async for session in get_session():
-        await save_to_db(session, message.from_user.id, {'age': age})
+    await answers.put(message.from_user.id, {'age': age})
     await state.set_state(UserState.waiting_for_occupation)
     await message.answer(questions[4])
 
 @router.message(UserState.waiting_for_occupation)
 async def process_occupation(message: Message, state: FSMContext):
     await state.update_data(waiting_for_occupation=message.text)
-    async for session in get_session():
-        await save_to_db(session, message.from_user.id, {'occupation': message.text})
+    await answers.put(message.from_user.id, {'occupation': message.text})
     await state.set_state(UserState.waiting_for_city)
     await message.answer(questions[5])
 
 @router.message(UserState.waiting_for_city)
 async def process_city(message: Message, state: FSMContext):
     await state.update_data(waiting_for_city=message.text)
-    async for session in get_session():
-        await save_to_db(session, message.from_user.id, {'city': message.text})
+    await answers.put(message.from_user.id, {'city': message.text})
     await state.set_state(UserState.waiting_for_crypto_experience)
     await message.answer(questions[6])
 
 @router.message(UserState.waiting_for_crypto_experience)
 async def process_crypto_experience(message: Message, state: FSMContext):
-    await state.update_data(waiting_for_crypto_experience=message.text)
-    async for session in get_session():
-        await save_to_db(session, message.from_user.id, {'crypto_experience': message.text})
+    # Клавиатура программ отправляется без отметок
+    await state.update_data(waiting_for_crypto_experience=message.text, programs_rendered=0)
+    await answers.put(message.from_user.id, {'crypto_experience': message.text})
     await state.set_state(UserState.waiting_for_programs)
     await message.answer(questions[7], reply_markup=kb.get_programs_keyboard())
 
@@ -285,12 +252,48 @@ async def process_program_selection(callback: CallbackQuery, state: FSMContext):
         programs.append(program)
     
     await state.update_data(programs=programs)  # Сохраняем обновленный список программ в состоянии
-    
-    async for session in get_session():
-        await save_to_db(session, callback.from_user.id, {'programs': programs})
+    program_toggles.inc()
     
     await callback.answer(f"{'Выбрано' if program in programs else 'Отменено'}: {program}")
-    await update_programs_message(callback.message, programs)
+    schedule_programs_update(callback.from_user.id, callback.message, state)
+
+# Серия быстрых нажатий одного пользователя схлопывается в одну запись в БД и одно редактирование
+PROGRAMS_DEBOUNCE = 0.5
+# telegram_id -> номер последнего нажатия; отложенное обновление выполняет только самое свежее
+programs_updates = {}
+# Ссылки на отложенные задачи, чтобы их не собрал сборщик мусора
+programs_tasks = set()
+
+def schedule_programs_update(telegram_id, message: Message, state: FSMContext):
+    seq = programs_updates.get(telegram_id, 0) + 1
+    programs_updates[telegram_id] = seq
+    task = asyncio.create_task(flush_programs_update(telegram_id, seq, message, state))
+    programs_tasks.add(task)
+    task.add_done_callback(programs_tasks.discard)
+
+def cancel_programs_update(telegram_id):
+    programs_updates.pop(telegram_id, None)
+
+async def flush_programs_update(telegram_id, seq, message: Message, state: FSMContext):
+    await asyncio.sleep(PROGRAMS_DEBOUNCE)
+    if programs_updates.get(telegram_id) != seq:
+        return
+    programs_updates.pop(telegram_id, None)
+    try:
+        user_data = await state.get_data()
+        programs = user_data.get('programs', [])
+        await answers.put(telegram_id, {'programs': programs})
+
+        # Сообщение не редактируем, если итоговый выбор совпадает с уже показанным
+        mask = kb.programs_mask(programs)
+        if mask == user_data.get('programs_rendered', 0):
+            program_edits_skipped.inc()
+            return
+        await update_programs_message(message, programs)
+        await state.update_data(programs_rendered=mask)
+        program_edits.inc()
+    except Exception as e:
+        logger.error(f"Error updating programs message: {e}", exc_info=True)
 
 async def update_programs_message(message: Message, programs: list):
     text = "Выбранные программы:\n" + "\n".join(f"✅ {program}" for program in programs) if programs else "Программы не выбраны"
@@ -305,8 +308,15 @@ async def confirm_programs(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Вы не выбрали ни одной программы. Выберите хотя бы одну или 'Не являюсь участником'.", show_alert=True)
         return
     
-    async for session in get_session():
-        await save_to_db(session, callback.from_user.id, {'programs': programs})
+    # Отложенное редактирование клавиатуры больше не нужно - сообщение сейчас заменится
+    cancel_programs_update(callback.from_user.id)
+    # Анкета заполнена - записываем накопленные ответы сразу
+    await answers.put(callback.from_user.id, {'programs': programs})
+    try:
+        await answers.flush_user(callback.from_user.id)
+    except Exception:
+        # Ответы остались в буфере и будут записаны при следующей пачке
+        pass
     
     await state.set_state(UserState.waiting_for_captain_motivation)
     await callback.message.edit_text(congratulation_prticipant, reply_markup=kb.captain_keyboard)
@@ -325,58 +335,22 @@ async def process_callback_become_captain(callback: CallbackQuery, state: FSMCon
 async def process_callback_not_interested(callback: CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
     
-    async for session in get_session():
-        try:
-            # Получаем существующего пользователя
-            existing_user = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-            existing_user = existing_user.scalar_one_or_none()
-
-            if existing_user:
-                # Обновляем только предоставленные поля
-                update_data = {}
-                if 'waiting_for_name' in user_data:
-                    update_data['name'] = user_data['waiting_for_name']
-                if 'waiting_for_phone' in user_data:
-                    update_data['phone'] = user_data['waiting_for_phone']
-                if 'waiting_for_email' in user_data:
-                    update_data['email'] = user_data['waiting_for_email']
-                if 'waiting_for_occupation' in user_data:
-                    update_data['occupation'] = user_data['waiting_for_occupation']
-                if 'waiting_for_city' in user_data:
-                    update_data['city'] = user_data['waiting_for_city']
-                if 'waiting_for_crypto_experience' in user_data:
-                    update_data['crypto_experience'] = user_data['waiting_for_crypto_experience']
-                if 'programs' in user_data:
-                    update_data['programs'] = user_data['programs']
-                
-                update_data['captain_motivation'] = "Не заинтересован"
-                update_data['status'] = UserStatus.student
-
-                if 'waiting_for_age' in user_data:
-                    age = user_data['waiting_for_age']
-                    if isinstance(age, int):
-                        update_data['age'] = age
-                    elif isinstance(age, str) and age.isdigit():
-                        update_data['age'] = int(age)
-
-                # Применяем обновления
-                for key, value in update_data.items():
-                    setattr(existing_user, key, value)
-
-                await session.commit()
-            else:
-                logger.warning(f"User with telegram_id {callback.from_user.id} not found in database")
-
-            await callback.message.edit_text(
-                "Спасибо за ваш ответ. Вы всегда можете вернуться к выбору роли капитана позже.",
-                reply_markup=kb.final_keyboard
-            )
-            
-        except Exception as e:
-            logger.error(f"Error updating user data: {e}", exc_info=True)
-            await session.rollback()
-        finally:
-            await session.close()
+    try:
+        # Обновляем только предоставленные поля
+        update_data = collect_answers(user_data)
+        update_data['captain_motivation'] = NOT_INTERESTED
+        update_data['status'] = UserStatus.student
+
+        await answers.put(callback.from_user.id, update_data)
+        await answers.flush_user(callback.from_user.id)
+
+        await callback.message.edit_text(
+            "Спасибо за ваш ответ. Вы всегда можете вернуться к выбору роли капитана позже.",
+            reply_markup=kb.final_keyboard
+        )
+        
+    except Exception as e:
+        logger.error(f"Error updating user data: {e}", exc_info=True)
     
     await state.clear()
 
@@ -390,74 +364,148 @@ async def process_callback_become_captain(callback: CallbackQuery, state: FSMCon
 async def process_captain_motivation(message: Message, state: FSMContext):
     await state.update_data(captain_motivation=message.text)
     user_data = await state.get_data()
-    logger.info(f"Updated state data: {user_data}")
-    
-    async for session in get_session():
-        try:
-            update_data = {
-                'name': user_data.get('waiting_for_name'),
-                'phone': user_data.get('waiting_for_phone'),
-                'email': user_data.get('waiting_for_email'),
-                'occupation': user_data.get('waiting_for_occupation'),
-                'city': user_data.get('waiting_for_city'),
-                'crypto_experience': user_data.get('waiting_for_crypto_experience'),
-                'programs': user_data.get('programs', []),
-                'captain_motivation': user_data.get('captain_motivation'),
-                'status': UserStatus.captain
-            }
-
-            age = user_data.get('waiting_for_age')
-            if age is not None:
-                try:
-                    update_data['age'] = int(age)
-                except ValueError:
-                    logger.warning(f"Invalid age value: {age}. Skipping age update.")
-
-            stmt = update(User).where(User.telegram_id == message.from_user.id).values(**update_data)
-            
-            await session.execute(stmt)
-            await session.commit()
-            
-            logger.info(f"User updated successfully")
-            
-            await message.answer(congratulation_captain)
-        except Exception as e:
-            logger.error(f"Error updating user in database: {e}", exc_info=True)
-            await session.rollback()
-            await message.answer("Произошла ошибка при сохранении данных. Пожалуйста, попробуйте еще раз позже.")
-        finally:
-            await session.close()
+
+    try:
+        update_data = collect_answers(user_data)
+        update_data['captain_motivation'] = user_data.get('captain_motivation')
+        update_data['status'] = UserStatus.captain
+
+        await answers.put(message.from_user.id, update_data)
+        await answers.flush_user(message.from_user.id)
+        
+        logger.info("Captain registration saved")
+
+        await message.answer(congratulation_captain)
+    except Exception as e:
+        logger.error(f"Error updating user in database: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при сохранении данных. Пожалуйста, попробуйте еще раз позже.")
     
     await state.clear()
-    logger.info("Finished process_captain_motivation")
 
-@router.message(Command("update_sheet"))
-async def cmd_update_sheet(message: Message):
+@router.message(Command("update_sheet"), IsAdmin())
+async def cmd_update_sheet(message: Message, command: CommandObject):
+    # /update_sheet full - сбросить индекс строк и выгрузить всех пользователей заново
+    # /update_sheet force - выгрузить, даже если предыдущая выгрузка была только что
+    args = set((command.args or '').split())
     await message.answer("Начинаю обновление Google таблицы...")
     try:
         async for session in get_session():
-            await update_google_sheet(session)
-        await message.answer("Google таблица успешно обновлена.")
+            outcome = await update_google_sheet(session, full='full' in args, force='force' in args)
+    except SyncBusy:
+        await message.answer("Таблицу сейчас обновляет другой процесс бота, попробуйте позже.")
+        return
     except Exception as e:
         logger.error(f"Error updating Google Sheet: {e}", exc_info=True)
         await message.answer("Произошла ошибка при обновлении Google таблицы.")
+        return
 
-@router.message(Command('send_links'))
-async def send_links_to_all_users(message: Message):
+    if outcome.skipped:
+        await message.answer(
+            f"Таблица обновлялась {outcome.last_age:.0f} с назад, повторное обновление пропущено.\n"
+            "Чтобы обновить принудительно: /update_sheet force"
+        )
+        return
+    stats = outcome.stats
+    await message.answer(
+        ("Обновление уже шло, его результат:\n" if outcome.joined else "Google таблица успешно обновлена.\n")
+        + f"Время: {outcome.elapsed:.1f} с\n"
+        f"Просмотрено: {stats.scanned}\n"
+        f"Обновлено строк: {stats.updated}\n"
+        f"Добавлено строк: {stats.appended}\n"
+        f"Без изменений: {stats.unchanged}\n"
+        f"Запросов к Google API: {stats.api_calls}\n"
+        f"Прочитано из таблицы: {stats.downloaded / 1024:.1f} КБ"
+        + ("\nИндекс строк сверен после ручной правки таблицы" if stats.reconciled else "")
+    )
+
+# Подписи шагов анкеты для /stats
+step_titles = {
+    'name': 'ФИО',
+    'phone': 'Телефон',
+    'email': 'Email',
+    'age': 'Возраст',
+    'occupation': 'Род деятельности',
+    'city': 'Город',
+    'crypto_experience': 'Опыт с криптовалютой',
+    'programs': 'Программы',
+}
+
+@router.message(Command('stats'), IsAdmin())
+async def cmd_stats(message: Message):
+    # Сводка регистрации одним агрегирующим запросом, без выгрузки в таблицу
     try:
-        # Загружаем данные из CSV
-        links_data = read_links_from_csv(CSV_PATH_LINKS)
+        async for session in get_session():
+            stats = await registration_stats(session)
+    except Exception as e:
+        logger.error(f"Error computing stats: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при подсчете статистики.")
+        return
 
-        # Проходим по каждому пользователю из CSV
-        for telegram_id, link in links_data.items():
-            try:
-                # Отправляем сообщение пользователю с его ссылкой
-                await message.bot.send_message(chat_id=telegram_id, text=f"Добрый день! Кажется вы все еще не вошли в свою \"Десятку\" 💫\n\nСкорее переходите по ссылке ниже, чтобы вступить в чат вашей команды:\n{link}")
-                logger.info(f"Сообщение отправлено пользователю с ID {telegram_id}")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке сообщения пользователю {telegram_id}: {e}")
+    lines = [
+        f"Всего начали регистрацию: {stats.total}",
+        f"Заполнили анкету: {stats.complete}",
+        f"Заполняют сейчас: {stats.in_progress}",
+        f"Бросили анкету: {stats.abandoned}",
+        f"Заявок в капитаны: {stats.captains}",
+        f"Отказались от роли капитана: {stats.not_interested}",
+    ]
+    if stats.steps:
+        lines += ["", "Остановились на шаге (заполняют / бросили):"]
+        lines += [
+            f"{step_titles[step]}: {in_progress} / {abandoned}"
+            for step, (in_progress, abandoned) in stats.steps.items()
+        ]
+    if stats.programs:
+        lines += ["", "Программы (заполнившие анкету):"]
+        lines += [f"{program}: {count}" for program, count in stats.programs.items()]
+    await message.answer("\n".join(lines))
+
+@router.message(Command('assign_teams'), IsAdmin())
+async def cmd_assign_teams(message: Message, command: CommandObject):
+    # /assign_teams [seed] - распределить всех заполнивших анкету по «Десяткам»
+    seed = int(command.args) if command.args and command.args.strip().isdigit() else 0
+    await message.answer("Начинаю распределение по командам...")
+    try:
+        async for session in get_session():
+            participants, teams, captains, elapsed = await run_assignment(session, seed=seed)
+        await message.answer(
+            f"Распределено участников: {participants}\nКоманд: {teams}, из них с капитаном: {captains}\n"
+            f"Время: {elapsed:.2f} с\n\nСсылки на чаты задаются командой /team_link <номер> <ссылка>"
+        )
+    except Exception as e:
+        logger.error(f"Error assigning teams: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при распределении по командам.")
+
+@router.message(Command('team_link'), IsAdmin())
+async def cmd_team_link(message: Message, command: CommandObject):
+    args = (command.args or '').split()
+    if len(args) != 2 or not args[0].isdigit():
+        await message.answer("Формат: /team_link <номер команды> <ссылка>")
+        return
+    async for session in get_session():
+        found = await set_team_link(session, int(args[0]), args[1])
+    await message.answer("Ссылка сохранена." if found else "Команда с таким номером не найдена.")
 
-        await message.answer("Все сообщения были отправлены!")
+@router.message(Command('send_links'), IsAdmin())
+async def send_links_to_all_users(message: Message):
+    try:
+        # Ссылки берутся из распределения по командам, а при его отсутствии - из CSV
+        async for session in get_session():
+            links_data = await get_member_links(session)
+        if not links_data and CSV_PATH_LINKS.exists():
+            links_data = read_links_from_csv(CSV_PATH_LINKS)
+        messages = {
+            telegram_id: f"Добрый день! Кажется вы все еще не вошли в свою \"Десятку\" 💫\n\nСкорее переходите по ссылке ниже, чтобы вступить в чат вашей команды:\n{link}"
+            for telegram_id, link in links_data.items()
+        }
+        # Идентификатор рассылки зависит от набора ссылок: повторный запуск с теми же ссылками
+        # продолжит прерванную рассылку, не отправляя сообщения повторно
+        payload = '\n'.join(f"{telegram_id}:{link}" for telegram_id, link in sorted(links_data.items()))
+        broadcast_id = 'links:' + hashlib.md5(payload.encode('utf-8')).hexdigest()[:12]
+
+        await message.answer(f"Начинаю рассылку ссылок: {len(messages)} получателей")
+        report = await Broadcaster(message.bot).run(broadcast_id, messages)
+        await message.answer(report.as_text())
     except Exception as e:
         logger.error(f"Ошибка при отправке сообщений: {e}")
-        await message.answer("Произошла ошибка при отправке сообщений.")
\ No newline at end of file
+        await message.answer("Произошла ошибка при отправке сообщений.")
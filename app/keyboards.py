@@ -1,3 +1,4 @@
+from functools import lru_cache
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
 start_keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -8,23 +9,31 @@ edit_keyboard = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="Заполнить заново", callback_data="edit_info")]
 ])
 
-def get_programs_keyboard(selected_programs=None):
-    if selected_programs is None:
-        selected_programs = []
-    
-    programs = [
-        "Не являюсь учеником",
-        "Деньги под ключ",
-        "Миллион на дропах",
-        "Мастер инвестиций"
-    ]
+programs = [
+    "Не являюсь учеником",
+    "Деньги под ключ",
+    "Миллион на дропах",
+    "Мастер инвестиций"
+]
+
+def programs_mask(selected_programs):
+    # Набор выбранных программ как битовая маска - ключ кеша клавиатур
+    selected_programs = selected_programs or ()
+    return sum(1 << i for i, program in enumerate(programs) if program in selected_programs)
+
+@lru_cache(maxsize=None)
+def programs_keyboard_by_mask(mask):
+    # Клавиатур всего 2^len(programs), каждая строится один раз
     keyboard = []
-    for program in programs:
-        text = f"✅ {program}" if program in selected_programs else program
+    for i, program in enumerate(programs):
+        text = f"✅ {program}" if mask & (1 << i) else program
         keyboard.append([InlineKeyboardButton(text=text, callback_data=f"program:{program}")])
     keyboard.append([InlineKeyboardButton(text="Подтвердить выбор", callback_data="confirm_programs")])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+def get_programs_keyboard(selected_programs=None):
+    return programs_keyboard_by_mask(programs_mask(selected_programs))
+
 # Клавиатура для информации о капитанах
 captain_keyboard = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="О капитанах", callback_data="about_captains")]
@@ -0,0 +1,130 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from aiogram import BaseMiddleware
+from decouple import config
+
+# Уровень логов по умолчанию и отдельные уровни модулей: "aiogram.event=WARNING,app.google=DEBUG"
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_LEVELS = config('LOG_LEVELS', default='')
+# json - одна JSON-запись на строку, text - для чтения глазами при разработке
+LOG_FORMAT = config('LOG_FORMAT', default='json')
+# Доля записей с extra={'sample': True} (построчные отладочные сообщения), которая попадает в лог
+LOG_SAMPLE_RATE = config('LOG_SAMPLE_RATE', default=0.01, cast=float)
+
+# Контекст апдейта: проставляется в каждую запись, сделанную во время его обработки
+log_update_id = ContextVar('log_update_id', default=None)
+log_user_id = ContextVar('log_user_id', default=None)
+
+EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+# Номера с + или российские 11-значные; telegram_id (до 10 цифр) не затрагиваются
+PHONE_RE = re.compile(r'\+\d[\d\s().-]{6,}\d|\b[78][\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}\b')
+
+def redact(text):
+    return PHONE_RE.sub('<phone>', EMAIL_RE.sub('<email>', text))
+
+class ContextFilter(logging.Filter):
+    # Работает в потоке, который пишет запись: контекст апдейта доступен только там
+    def filter(self, record):
+        record.update_id = log_update_id.get()
+        record.user_id = log_user_id.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return not getattr(record, 'sample', False) or random.random() < self.rate
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # В очередь уходит готовый текст: аргументы и исключение могут измениться до записи в фоне.
+        # Форматирование и вывод - в потоке QueueListener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(record.getMessage()),
+        }
+        if getattr(record, 'update_id', None) is not None:
+            entry['update_id'] = record.update_id
+        if getattr(record, 'user_id', None) is not None:
+            entry['user_id'] = record.user_id
+        if record.exc_text:
+            entry['exc'] = redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = redact(super().format(record))
+        if getattr(record, 'update_id', None) is not None:
+            line += f" [update={record.update_id} user={record.user_id}]"
+        return line
+
+class LogContextMiddleware(BaseMiddleware):
+    # Внешний middleware на dp.update, после UserContextMiddleware aiogram: пользователь уже известен
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        update_token = log_update_id.set(event.update_id)
+        user_token = log_user_id.set(user.id if user is not None else None)
+        try:
+            return await handler(event, data)
+        finally:
+            log_user_id.reset(user_token)
+            log_update_id.reset(update_token)
+
+_listener = None
+
+def setup_logging(level=LOG_LEVEL, levels=LOG_LEVELS, fmt=LOG_FORMAT):
+    # Обработчики и модули пишут только в очередь; вывод в stderr - в отдельном потоке QueueListener
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(SamplingFilter())
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    for item in filter(None, (part.strip() for part in levels.split(','))):
+        name, _, name_level = item.partition('=')
+        logging.getLogger(name.strip()).setLevel(name_level.strip().upper())
+
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    # Дописываем очередь при выходе из процесса
+    atexit.register(stop_logging)
+
+def stop_logging():
+    # Дописывает очередь и останавливает поток вывода
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
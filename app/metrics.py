@@ -0,0 +1,234 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from aiogram import BaseMiddleware
+from aiohttp import web
+from decouple import config
+
+# Период замера задержки event loop
+LOOP_LAG_INTERVAL = config('METRICS_LOOP_LAG_INTERVAL', default=0.5, cast=float)
+
+# Все созданные метрики, отдаются целиком через render_metrics()
+registry = []
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels(labels, **extra):
+    pairs = {**(labels or {}), **extra}
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs.items()) + '}'
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS, labels=None, register=True):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        if register:
+            registry.append(self)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        # Оценка по верхней границе корзины, в которую попадает q-й квантиль
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            lines.append(f'{self.name}_bucket{_labels(self.labels, le=bound)} {total}')
+        lines.append(f'{self.name}_bucket{_labels(self.labels, le="+Inf")} {self.count}')
+        lines.append(f"{self.name}_sum{_labels(self.labels)} {self.sum}")
+        lines.append(f"{self.name}_count{_labels(self.labels)} {self.count}")
+        return lines
+
+    def render(self):
+        return "\n".join([f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram", *self.samples()])
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, description, labels=None, register=True):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.value = 0
+        if register:
+            registry.append(self)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labels)} {self.value}"]
+
+    def render(self):
+        return "\n".join([f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter", *self.samples()])
+
+class MetricVec:
+    # Семейство метрик с одной меткой (handler, method): дочерняя метрика создается при первом обращении
+    def __init__(self, metric_class, name, description, label, **kwargs):
+        self.metric_class = metric_class
+        self.name = name
+        self.description = description
+        self.label = label
+        self.kwargs = kwargs
+        self.children = {}
+        registry.append(self)
+
+    def labels(self, value):
+        child = self.children.get(value)
+        if child is None:
+            child = self.children[value] = self.metric_class(
+                self.name, self.description, labels={self.label: value}, register=False, **self.kwargs
+            )
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_class.type}"]
+        for child in list(self.children.values()):
+            lines.extend(child.samples())
+        return "\n".join(lines)
+
+class Gauge:
+    # Значение считывается функцией в момент выдачи метрик
+    def __init__(self, name, description, func):
+        self.name = name
+        self.description = description
+        self.func = func
+        registry.append(self)
+
+    def render(self):
+        return f"# HELP {self.name} {self.description}\n# TYPE {self.name} gauge\n{self.name} {self.func()}"
+
+# Корзины для количества событий (запросов, вызовов) на один апдейт
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+update_latency = Histogram('bot_update_latency_seconds', 'Time spent processing one Telegram update')
+update_db_queries = Histogram('bot_update_db_queries', 'DB queries issued while processing one update', COUNT_BUCKETS)
+update_db_time = Histogram('bot_update_db_seconds', 'Time spent in DB queries while processing one update')
+update_api_calls = Histogram('bot_update_telegram_calls', 'Telegram API calls made while processing one update', COUNT_BUCKETS)
+update_api_time = Histogram('bot_update_telegram_seconds', 'Time spent in Telegram API calls while processing one update')
+handler_latency = MetricVec(Histogram, 'bot_handler_latency_seconds', 'Time spent in a message/callback handler', 'handler')
+loop_lag = Histogram('bot_event_loop_lag_seconds', 'Event loop scheduling delay',
+                     (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+class UpdateStats:
+    # Счетчики одного апдейта: пополняются хуками БД и сессии бота, пока апдейт обрабатывается
+    __slots__ = ('db_queries', 'db_time', 'api_calls', 'api_time')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.api_calls = 0
+        self.api_time = 0.0
+
+# Статистика текущего апдейта; вне обработки апдейта (фоновые задачи) - None
+current_update = ContextVar('current_update', default=None)
+
+class UpdateLatencyMiddleware(BaseMiddleware):
+    # Внешний middleware на dp.update: замеряет полную обработку апдейта
+    # и считает апдейты в работе, чтобы при остановке дождаться их завершения
+    def __init__(self, histogram=update_latency):
+        self.histogram = histogram
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.in_flight += 1
+        self._idle.clear()
+        stats = UpdateStats()
+        token = current_update.set(stats)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.histogram.observe(time.perf_counter() - started)
+            current_update.reset(token)
+            update_db_queries.observe(stats.db_queries)
+            update_db_time.observe(stats.db_time)
+            update_api_calls.observe(stats.api_calls)
+            update_api_time.observe(stats.api_time)
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.set()
+
+    async def drain(self, timeout):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.in_flight
+
+class HandlerLatencyMiddleware(BaseMiddleware):
+    # Внутренний middleware роутера: к этому моменту обработчик уже выбран фильтрами
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_object = data.get('handler')
+            name = handler_object.callback.__name__ if handler_object is not None else 'unknown'
+            handler_latency.labels(name).observe(time.perf_counter() - started)
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    # Насколько позже заказанного просыпается sleep - время, которое event loop был занят
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0.0, loop.time() - started - interval))
+
+_loop_monitor = None
+
+def start_loop_monitor():
+    global _loop_monitor
+    if _loop_monitor is None:
+        _loop_monitor = asyncio.create_task(monitor_loop_lag())
+
+async def stop_loop_monitor():
+    global _loop_monitor
+    if _loop_monitor is not None:
+        _loop_monitor.cancel()
+        try:
+            await _loop_monitor
+        except asyncio.CancelledError:
+            pass
+        _loop_monitor = None
+
+def render_metrics():
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+async def metrics_view(request):
+    return web.Response(text=render_metrics(), content_type='text/plain')
+
+async def start_metrics_server(host, port):
+    # Отдельный HTTP-сервер с /metrics для режима polling
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
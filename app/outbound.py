@@ -0,0 +1,179 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageReplyMarkup, EditMessageText
+from decouple import config
+from app.metrics import Counter, Gauge, Histogram, MetricVec
+
+# Общий лимит исходящих сообщений бота в секунду (лимит Telegram ~30).
+# Корзина у каждого процесса своя, поэтому при WEBHOOK_WORKERS > 1 каждый получает равную долю.
+# Доли не перераспределяются: процесс, в который пришло больше апдейтов, упирается в свою долю раньше
+OUTBOUND_RATE = config('OUTBOUND_RATE', default=30, cast=float)
+WEBHOOK_WORKERS = config('WEBHOOK_WORKERS', default=1, cast=int)
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = ('interactive', 'bulk')
+
+# Приоритет исходящих вызовов текущей задачи; рассылки помечают свои отправки как bulk
+outbound_priority = ContextVar('outbound_priority', default=INTERACTIVE)
+
+# Идущие подряд редактирования одного сообщения схлопываются: отправляется только последнее
+COALESCED_METHODS = (EditMessageText, EditMessageReplyMarkup)
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds):
+        # После 429 приостанавливаем всех потребителей корзины
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        now = time.monotonic()
+        if self._paused_until > now:
+            await asyncio.sleep(self._paused_until - now)
+            now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # Токен резервируется сразу (баланс может уйти в минус), ожидание - уже вне критической секции
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+@contextmanager
+def bulk_priority():
+    token = outbound_priority.set(BULK)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+class _Request:
+    __slots__ = ('priority', 'chat_id', 'method', 'enqueued', 'granted', 'send')
+
+    def __init__(self, priority, chat_id, method):
+        loop = asyncio.get_running_loop()
+        self.priority = priority
+        self.chat_id = chat_id
+        self.method = method
+        self.enqueued = time.monotonic()
+        # Разрешение диспетчера на отправку
+        self.granted = loop.create_future()
+        # Задача отправки редактирования, общая для всех схлопнутых с ним вызовов
+        self.send = None
+
+class OutboundScheduler(BaseRequestMiddleware):
+    # Middleware сессии бота: все вызовы с chat_id проходят через одну очередь.
+    # Диспетчер выдает разрешения по общему TokenBucket, сначала интерактивным ответам, затем рассылкам.
+    # Вызовы одного чата выполняются строго по очереди, следующий - после завершения предыдущего.
+    # Остальные вызовы (getUpdates, answerCallbackQuery и т.п.) идут без очереди
+    def __init__(self, rate=OUTBOUND_RATE / WEBHOOK_WORKERS):
+        self.bucket = TokenBucket(rate)
+        # Готовые к отправке запросы (первые в очереди своего чата) по приоритетам
+        self._ready = (deque(), deque())
+        # chat_id -> запросы чата по порядку; первый - готов к отправке или уже выполняется
+        self._chats = {}
+        self._depth = [0, 0]
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.wait_time = MetricVec(Histogram, 'outbound_wait_seconds', 'Time an outbound call waited in the scheduler', 'priority')
+        self.coalesced = Counter('outbound_coalesced_total', 'Message edits merged into a newer pending edit')
+        self.interactive_depth = Gauge('outbound_queue_interactive', 'Interactive outbound calls waiting to be sent',
+                                       lambda: self._depth[INTERACTIVE])
+        self.bulk_depth = Gauge('outbound_queue_bulk', 'Bulk outbound calls waiting to be sent', lambda: self._depth[BULK])
+
+    def _coalesce_target(self, chat, method):
+        # Только последний запрос чата и только пока он не отправлен - порядок в чате не меняется
+        last = chat[-1]
+        if (not last.granted.done() and type(last.method) is type(method)
+                and last.method.message_id == method.message_id and last.method.inline_message_id is None):
+            return last
+        return None
+
+    def _make_ready(self, request):
+        self._ready[request.priority].append(request)
+        self._wakeup.set()
+
+    def _release(self, request):
+        chat = self._chats[request.chat_id]
+        chat.popleft()
+        if chat:
+            self._make_ready(chat[0])
+        else:
+            del self._chats[request.chat_id]
+
+    async def _dispatch(self):
+        while True:
+            if not self._ready[INTERACTIVE] and not self._ready[BULK]:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self.bucket.acquire()
+            # Приоритет выбирается после ожидания токена: успевший прийти интерактивный ответ идет первым
+            request = (self._ready[INTERACTIVE] or self._ready[BULK]).popleft()
+            self._depth[request.priority] -= 1
+            if request.granted.done():
+                # Вызывающий отменен, пока ждал очереди
+                self._release(request)
+                continue
+            request.granted.set_result(None)
+
+    async def _send(self, request, make_request, bot):
+        try:
+            await request.granted
+        except asyncio.CancelledError:
+            # Если разрешение уже выдано, очередь чата освобождаем сами; иначе это сделает диспетчер
+            if not request.granted.cancelled():
+                self._release(request)
+            raise
+        self.wait_time.labels(PRIORITY_NAMES[request.priority]).observe(time.monotonic() - request.enqueued)
+
+        try:
+            # Метод читается после ожидания: за это время его могло заменить более свежее редактирование
+            return await make_request(bot, request.method)
+        except TelegramRetryAfter as e:
+            self.bucket.pause(e.retry_after)
+            raise
+        finally:
+            self._release(request)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        chat = self._chats.get(chat_id)
+        if chat and isinstance(method, COALESCED_METHODS):
+            pending = self._coalesce_target(chat, method)
+            if pending is not None:
+                pending.method = method
+                self.coalesced.inc()
+                return await asyncio.shield(pending.send)
+
+        request = _Request(outbound_priority.get(), chat_id, method)
+        if chat is None:
+            chat = self._chats[chat_id] = deque()
+        chat.append(request)
+        self._depth[request.priority] += 1
+        if len(chat) == 1:
+            self._make_ready(request)
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+        if not isinstance(method, COALESCED_METHODS):
+            return await self._send(request, make_request, bot)
+        # Редактирование отправляется отдельной задачей: к нему могут присоединиться более свежие правки,
+        # и отмена вызвавшего его апдейта не должна отменять их отправку
+        request.send = asyncio.create_task(self._send(request, make_request, bot))
+        # Ошибку забирает любой из ожидающих; если все они отменены, она не попадает в лог asyncio
+        request.send.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(request.send)
@@ -0,0 +1,30 @@
+import time
+from aiogram.client.session.aiohttp import AiohttpSession
+from app.metrics import Counter, Histogram, MetricVec, current_update
+
+api_calls = MetricVec(Counter, 'telegram_api_calls_total', 'Telegram Bot API calls', 'method')
+api_errors = MetricVec(Counter, 'telegram_api_errors_total', 'Telegram Bot API calls that raised', 'method')
+api_latency = MetricVec(Histogram, 'telegram_api_latency_seconds', 'Telegram Bot API call latency', 'method')
+
+class MeteringMixin:
+    # Замер каждого вызова Bot API по методам поверх любой сессии aiogram
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await super().make_request(bot, method, timeout=timeout)
+        except Exception:
+            api_errors.labels(name).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            api_calls.labels(name).inc()
+            api_latency.labels(name).observe(elapsed)
+            stats = current_update.get()
+            if stats is not None:
+                stats.api_calls += 1
+                stats.api_time += elapsed
+
+class MeteredSession(MeteringMixin, AiohttpSession):
+    # Сессия бота по умолчанию: aiohttp с замером вызовов
+    pass
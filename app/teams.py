@@ -0,0 +1,129 @@
+import logging
+import random
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from decouple import config
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.models import Team, TeamMember, User, UserStatus
+
+logger = logging.getLogger(__name__)
+
+TEAM_SIZE = config('TEAM_SIZE', default=10, cast=int)
+# Границы возрастных групп: до 25, 25-34, 35-44, 45-54, 55+
+AGE_BANDS = (25, 35, 45, 55)
+INSERT_CHUNK = 5000
+
+@dataclass(slots=True)
+class Participant:
+    telegram_id: int
+    city: str
+    age: int
+    crypto_experience: str
+    is_captain: bool
+
+@dataclass
+class TeamPlan:
+    number: int
+    size: int
+    captain: int = None
+    members: list = field(default_factory=list)
+
+def age_band(age):
+    return bisect_right(AGE_BANDS, age or 0)
+
+def has_experience(answer):
+    # Ответ на вопрос об опыте - свободный текст, отличаем только «нет» от всего остального
+    answer = (answer or '').strip().lower()
+    return bool(answer) and not answer.startswith(('нет', 'no', 'не ', '-'))
+
+def assign_teams(participants, team_size=TEAM_SIZE, seed=0):
+    # Детерминированное разбиение: при одном seed и одном наборе участников результат одинаков.
+    # Сложность O(n log n) - сортировка по признакам и раздача по кругу
+    participants = sorted(participants, key=lambda p: p.telegram_id)
+    if not participants:
+        return []
+    rng = random.Random(seed)
+    rng.shuffle(participants)
+
+    total = len(participants)
+    team_count = -(-total // team_size)
+    # Размеры команд отличаются не больше чем на одного человека
+    teams = [
+        TeamPlan(number=i + 1, size=total // team_count + (1 if i < total % team_count else 0))
+        for i in range(team_count)
+    ]
+
+    # По одному капитану на команду, пока капитаны есть; остальные идут участниками
+    captains = [p for p in participants if p.is_captain]
+    for team, captain in zip(teams, captains):
+        team.captain = captain.telegram_id
+        team.members.append(captain.telegram_id)
+    assigned = {team.captain for team in teams if team.captain is not None}
+
+    # Сортировка по опыту, возрасту и городу и раздача по кругу разносит похожих
+    # участников по разным командам - в каждой получается смесь групп
+    rest = [p for p in participants if p.telegram_id not in assigned]
+    rest.sort(key=lambda p: (has_experience(p.crypto_experience), age_band(p.age), (p.city or '').strip().lower()))
+
+    position = 0
+    for participant in rest:
+        while len(teams[position].members) >= teams[position].size:
+            position = (position + 1) % team_count
+        teams[position].members.append(participant.telegram_id)
+        position = (position + 1) % team_count
+
+    return teams
+
+async def load_participants(session: AsyncSession):
+    result = await session.execute(
+        select(User.telegram_id, User.city, User.age, User.crypto_experience, User.status).where(User.is_complete)
+    )
+    return [
+        Participant(telegram_id, city, age, crypto_experience, status == UserStatus.captain)
+        for telegram_id, city, age, crypto_experience, status in result
+    ]
+
+async def save_teams(session: AsyncSession, teams):
+    # Новое распределение полностью заменяет предыдущее
+    await session.execute(delete(TeamMember))
+    await session.execute(delete(Team))
+    if teams:
+        result = await session.execute(
+            insert(Team).values([{'number': team.number, 'captain_telegram_id': team.captain} for team in teams])
+            .returning(Team.number, Team.id)
+        )
+        team_ids = dict(result.all())
+        members = [
+            {'telegram_id': telegram_id, 'team_id': team_ids[team.number]}
+            for team in teams for telegram_id in team.members
+        ]
+        for i in range(0, len(members), INSERT_CHUNK):
+            await session.execute(insert(TeamMember).values(members[i:i + INSERT_CHUNK]))
+    await session.commit()
+
+async def run_assignment(session: AsyncSession, seed=0, team_size=TEAM_SIZE):
+    started = time.perf_counter()
+    participants = await load_participants(session)
+    teams = assign_teams(participants, team_size=team_size, seed=seed)
+    await save_teams(session, teams)
+    elapsed = time.perf_counter() - started
+    captains = sum(1 for team in teams if team.captain is not None)
+    logger.info(f"Assigned {len(participants)} participants to {len(teams)} teams in {elapsed:.2f}s")
+    return len(participants), len(teams), captains, elapsed
+
+async def set_team_link(session: AsyncSession, number, link):
+    team = await session.scalar(select(Team).where(Team.number == number))
+    if team is None:
+        return False
+    team.link = link
+    await session.commit()
+    return True
+
+async def get_member_links(session: AsyncSession):
+    result = await session.execute(
+        select(TeamMember.telegram_id, Team.link).join(Team, Team.id == TeamMember.team_id).where(Team.link.isnot(None))
+    )
+    return dict(result.all())
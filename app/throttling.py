@@ -0,0 +1,100 @@
+import logging
+import time
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+from decouple import config
+from app.metrics import Counter, Gauge, MetricVec
+
+logger = logging.getLogger(__name__)
+
+# Не больше THROTTLE_LIMIT апдейтов одного вида от одного пользователя за THROTTLE_WINDOW секунд.
+# Вид - команда (/start, /edit), префикс callback_data (program, confirm_programs) или обычное сообщение
+THROTTLE_LIMIT = config('THROTTLE_LIMIT', default=10, cast=int)
+THROTTLE_WINDOW = config('THROTTLE_WINDOW', default=5, cast=float)
+# Как часто удалять записи пользователей, которые давно ничего не присылали
+THROTTLE_EVICT_INTERVAL = config('THROTTLE_EVICT_INTERVAL', default=60, cast=float)
+
+THROTTLED_TEXT = "Слишком много запросов, подождите несколько секунд."
+
+class _Window:
+    # Скользящее окно из двух фиксированных: счетчик текущего окна и предыдущего.
+    # Оценка числа событий за последние window секунд - O(1) по времени и памяти
+    __slots__ = ('started', 'current', 'previous', 'warned')
+
+    def __init__(self, started):
+        self.started = started
+        self.current = 0
+        self.previous = 0
+        self.warned = False
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Внешний middleware роутера: отсекает флуд до фильтров, обработчиков и сессии БД
+    def __init__(self, limit=THROTTLE_LIMIT, window=THROTTLE_WINDOW, evict_interval=THROTTLE_EVICT_INTERVAL):
+        self.limit = limit
+        self.window = window
+        self.evict_interval = evict_interval
+        # (user_id, вид апдейта) -> _Window
+        self._windows = {}
+        self._next_eviction = time.monotonic() + evict_interval
+        self.throttled = MetricVec(Counter, 'bot_throttled_total', 'Updates dropped by the anti-flood limit', 'action')
+        self.tracked = Gauge('bot_throttle_tracked_keys', 'User/action pairs tracked by the anti-flood limit',
+                             lambda: len(self._windows))
+
+    @staticmethod
+    def action(event):
+        if isinstance(event, CallbackQuery):
+            return (event.data or 'callback').split(':', 1)[0]
+        text = event.text or ''
+        if text.startswith('/'):
+            return text.split(maxsplit=1)[0].split('@', 1)[0]
+        return 'message'
+
+    def _evict(self, now):
+        # Окно старше двух длительностей уже ничего не ограничивает
+        idle_since = now - 2 * self.window
+        self._windows = {key: entry for key, entry in self._windows.items() if entry.started > idle_since}
+        self._next_eviction = now + self.evict_interval
+
+    def hit(self, key, now):
+        # Учитывает событие и возвращает False, если лимит уже исчерпан
+        entry = self._windows.get(key)
+        if entry is None:
+            entry = self._windows[key] = _Window(now)
+        elapsed = now - entry.started
+        if elapsed >= self.window:
+            windows = int(elapsed // self.window)
+            entry.previous = entry.current if windows == 1 else 0
+            entry.current = 0
+            entry.started += windows * self.window
+            entry.warned = False
+            elapsed = now - entry.started
+        if entry.previous * (1 - elapsed / self.window) + entry.current >= self.limit:
+            return False
+        entry.current += 1
+        return True
+
+    async def _reject(self, event, key):
+        entry = self._windows[key]
+        if isinstance(event, CallbackQuery):
+            # Ответ на callback не идет через очередь исходящих сообщений и снимает «часики» с кнопки
+            await event.answer(THROTTLED_TEXT)
+        elif not entry.warned:
+            # На сообщения предупреждаем один раз за окно, остальные молча отбрасываем
+            entry.warned = True
+            await event.answer(THROTTLED_TEXT)
+
+    async def __call__(self, handler, event, data):
+        user = event.from_user
+        if user is None or not isinstance(event, (Message, CallbackQuery)):
+            return await handler(event, data)
+        now = time.monotonic()
+        if now >= self._next_eviction:
+            self._evict(now)
+        action = self.action(event)
+        key = (user.id, action)
+        if self.hit(key, now):
+            return await handler(event, data)
+        self.throttled.labels(action).inc()
+        logger.warning(f"Throttled {action} from user {user.id}")
+        await self._reject(event, key)
+        return None
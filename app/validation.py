@@ -0,0 +1,97 @@
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Проверка и нормализация ответов участников. Выражения компилируются один раз при импорте,
+# каждая функция разбирает строку за один проход и возвращает нормализованное значение или None
+
+# Допустимая запись номера: +7 (987) 101-10-90, 8-987-101-10-90, 79871011090 и т.п.
+# Количество цифр проверяется уже после разбора
+PHONE_RE = re.compile(r'^\+?[\d\s().-]{7,25}$')
+NON_DIGITS_RE = re.compile(r'\D+')
+EMAIL_RE = re.compile(r'^[\w.+-]+@[\w-]+(\.[\w-]+)*\.\w+$')
+AGE_RE = re.compile(r'\d{1,3}', re.ASCII)
+
+# Номера без кода страны считаются российскими
+DEFAULT_COUNTRY_CODE = '7'
+AGE_MIN = 10
+AGE_MAX = 100
+
+def parse_name(text: Optional[str]) -> Optional[List[str]]:
+    # ФИО - минимум два слова; возвращает слова, чтобы не разбирать строку повторно
+    if not text:
+        return None
+    parts = text.split()
+    return parts if len(parts) >= 2 else None
+
+def normalize_name(text: Optional[str]) -> Optional[str]:
+    parts = parse_name(text)
+    return ' '.join(parts) if parts else None
+
+def normalize_phone(text: Optional[str]) -> Optional[str]:
+    # Номер в формате E.164: +79871011090
+    if not text:
+        return None
+    text = text.strip()
+    if not PHONE_RE.match(text):
+        return None
+    digits = NON_DIGITS_RE.sub('', text)
+    if not text.startswith('+'):
+        if len(digits) == 11 and digits[0] == '8':
+            digits = DEFAULT_COUNTRY_CODE + digits[1:]
+        elif len(digits) == 10 and digits[0] == '9':
+            digits = DEFAULT_COUNTRY_CODE + digits
+    # E.164 допускает до 15 цифр; короче 11 цифр - номер без кода страны или оборванный
+    if not 11 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+def canonical_email(text: str) -> str:
+    return text.strip().lower()
+
+def normalize_email(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return None
+    email = canonical_email(text)
+    return email if EMAIL_RE.match(email) else None
+
+def parse_age(text: Any) -> Optional[int]:
+    if isinstance(text, int) and not isinstance(text, bool):
+        age = text
+    elif isinstance(text, str) and AGE_RE.fullmatch(text.strip()):
+        # int() пропускает не все пробельные символы, которые убирает strip() (например, \x1f)
+        age = int(text.strip())
+    else:
+        return None
+    return age if AGE_MIN <= age <= AGE_MAX else None
+
+def format_phone(value: Optional[str]) -> Optional[str]:
+    # Для выгрузки: номера, сохраненные до нормализации, приводятся к E.164, нераспознанные - как есть
+    return normalize_phone(value) or value
+
+# Поля участника, которые проверяются и нормализуются
+NORMALIZERS = {
+    'name': normalize_name,
+    'phone': normalize_phone,
+    'email': normalize_email,
+    'age': parse_age,
+}
+
+def normalize_fields(fields: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    # Нормализует известные поля; непрошедшие проверку остаются как есть и перечисляются во втором значении
+    result = dict(fields)
+    invalid = []
+    for field, normalizer in NORMALIZERS.items():
+        value = fields.get(field)
+        if value is None or value == '':
+            continue
+        normalized = normalizer(value)
+        if normalized is None:
+            invalid.append(field)
+        else:
+            result[field] = normalized
+    return result, invalid
+
+def normalize_batch(rows: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], List[str]]]:
+    # Потоковая пакетная проверка для импорта и выгрузки: строки не накапливаются в памяти
+    for row in rows:
+        yield normalize_fields(row)
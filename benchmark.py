@@ -0,0 +1,975 @@
+import argparse
+import asyncio
+import contextlib
+import csv
+import json
+import logging
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from collections import defaultdict
+from itertools import cycle, islice
+from pathlib import Path
+import aiohttp
+from aiogram import Bot
+from aiogram.types import Message, Update
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import web
+from sqlalchemy import delete, func, insert, select, text, update
+
+import app.handlers as handlers
+import app.keyboards as kb
+from app.allowlist import EmailAllowList, allowed_emails
+from app.database.buffer import answers
+from app.database.cache import STATUS_COMPLETE, status_cache
+from app.database.engine import db_queries, dispose_engine, get_session
+from app.database.migrations import migrate
+from app.database.models import FSMRecord, User
+from app.database.requests import upsert_user
+from app.database.storage import PostgresStorage
+from app.google.sync import payload_size, reset_index, sync_users
+from app.logs import setup_logging, stop_logging
+from app.metrics import HandlerLatencyMiddleware, UpdateLatencyMiddleware, start_loop_monitor, stop_loop_monitor
+from app.outbound import OutboundScheduler
+from app.session import MeteringMixin
+from app.throttling import ThrottlingMiddleware
+from app.teams import Participant, assign_teams, save_teams
+from app.validation import NORMALIZERS, normalize_batch
+from loadtest import delta, git_revision, percentile, previous_result
+from manage import USER_COLUMNS, driver_connection, export_emails, export_users, import_emails, import_users
+from app.handlers import router
+from run import WEBHOOK_PATH, WEBHOOK_SECRET, create_dispatcher, create_webhook_app, on_startup
+from tests.conftest import BASE_TELEGRAM_ID, FakeSession, FakeWorksheet, VirtualUser, fake_sheet
+
+# Замеры отдельных частей бота без Telegram и Google: лист - FakeWorksheet из tests/conftest.py.
+# Бенчмарки с БД работают с базой из .env (DB_*) и требуют отдельную базу без настоящих участников:
+#   python benchmark.py sheet-sync --users 10000
+#   python benchmark.py fsm-storage --users 1000 --concurrency 10
+#   python benchmark.py webhook --updates 5000 --concurrency 100
+#   python benchmark.py allowlist --addresses 1000000
+#   python benchmark.py sheet-export --sizes 10000,100000,1000000
+#   python benchmark.py teams --participants 50000
+#   python benchmark.py keyboard --sessions 200 --toggles 6
+#   python benchmark.py upsert --saves 5000
+#   python benchmark.py copy --rows 1000000
+#   python benchmark.py validation --inputs 1000000
+#   python benchmark.py metrics --updates 10000
+#   python benchmark.py throttle --users 100000
+#   python benchmark.py logging --updates 10000
+#   python benchmark.py sheet-snapshot --users 20000
+# Результаты дописываются в benchmark_results.jsonl и сравниваются с прошлым прогоном тех же параметров
+
+# Синтетические участники бенчмарков - свой диапазон telegram_id, не пересекается с loadtest.py
+SYNTHETIC_BASE_ID = BASE_TELEGRAM_ID + 2_000_000_000
+SHEET_HEADER = [
+    'telegram_id', 'name', 'phone', 'telegram', 'email', 'age', 'occupation', 'city',
+    'crypto_experience', 'programs', 'captain_motivation', 'status', 'synced_at',
+]
+
+def synthetic_record(index):
+    telegram_id = SYNTHETIC_BASE_ID + index
+    return (
+        telegram_id, f"Участник Бенчмарка{index}", f"+7900{index % 10_000_000:07d}", f"bench{index}",
+        f"bench{index}@benchmark.local", 18 + index % 50, 'Тестирование', ('Казань', 'Москва', 'Пермь')[index % 3],
+        'Нет', ['Трейдинг', 'DeFi'][:1 + index % 2], None, 'student',
+    )
+
+async def require_scratch_database():
+    await migrate()
+    # Выгрузка и индекс строк таблицы общие для всех участников: на базе с настоящими данными
+    # бенчмарк испортил бы индекс их Google таблицы
+    async for session in get_session():
+        real = await session.scalar(
+            select(func.count()).select_from(User).where(User.telegram_id < BASE_TELEGRAM_ID)
+        )
+        if real:
+            raise SystemExit(f"benchmark: the database has {real} real participants, point DB_* at a scratch database")
+
+async def create_users(count):
+    async with driver_connection() as connection:
+        await connection.execute("DELETE FROM nastavnichestvo WHERE telegram_id >= $1", SYNTHETIC_BASE_ID)
+        await connection.copy_records_to_table(
+            'nastavnichestvo', records=(synthetic_record(index) for index in range(count)), columns=USER_COLUMNS
+        )
+
+async def delete_users():
+    async with driver_connection() as connection:
+        await connection.execute("DELETE FROM nastavnichestvo WHERE telegram_id >= $1", SYNTHETIC_BASE_ID)
+
+async def touch_users(count, step):
+    # Каждый step-й участник меняет город - как правка анкеты через бота
+    async for session in get_session():
+        await session.execute(
+            text(
+                "UPDATE nastavnichestvo SET city = city || '*', updated_at = now() "
+                "WHERE telegram_id BETWEEN :first AND :last AND (telegram_id - :first) % :step = 0"
+            ),
+            {'first': SYNTHETIC_BASE_ID, 'last': SYNTHETIC_BASE_ID + count - 1, 'step': step},
+        )
+        await session.commit()
+
+async def legacy_update_google_sheet(session, sheet):
+    # Прежняя выгрузка (до инкрементальной): все участники ORM-объектами, весь лист целиком,
+    # поиск строки через list.index и отдельный запрос на каждую существующую строку
+    result = await session.execute(select(User))
+    users = result.scalars().all()
+
+    all_values = sheet.get_all_values()
+    existing_data = {int(row[0]): row for row in all_values[1:] if row[0].isdigit()}
+
+    rows_to_update = []
+    rows_to_append = []
+
+    for user in users:
+        user_data = [
+            user.telegram_id, user.name, user.phone, user.telegram, user.email, user.age, user.occupation,
+            user.city, user.crypto_experience,
+            ', '.join(user.programs) if isinstance(user.programs, list) else str(user.programs),
+            user.captain_motivation, user.status.value, datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        ]
+        if user.telegram_id in existing_data:
+            row_num = all_values.index(existing_data[user.telegram_id]) + 1
+            rows_to_update.append({'row': row_num, 'values': user_data})
+        else:
+            rows_to_append.append(user_data)
+
+    for row in rows_to_update:
+        sheet.update(f'A{row["row"]}:M{row["row"]}', [row['values']])
+    if rows_to_append:
+        sheet.append_rows(rows_to_append)
+    return payload_size(all_values)
+
+async def timed(coroutine):
+    started = time.perf_counter()
+    result = await coroutine
+    return result, round(time.perf_counter() - started, 3)
+
+async def sheet_sync(args):
+    # Инкрементальная выгрузка против прежней на одном и том же листе
+    await require_scratch_database()
+    await create_users(args.users)
+    results = {}
+    async for session in get_session():
+        await reset_index(session)
+
+        # Прежняя выгрузка: первая заполняет пустой лист, вторая - обычный повторный прогон
+        worksheet = FakeWorksheet([SHEET_HEADER], latency=args.latency)
+        await legacy_update_google_sheet(session, worksheet)
+        snapshot = [list(row) for row in worksheet.rows]
+        worksheet.calls.clear()
+        downloaded, results['legacy_seconds'] = await timed(legacy_update_google_sheet(session, worksheet))
+        results['legacy_api_calls'] = sum(worksheet.calls.values())
+        results['legacy_downloaded_bytes'] = downloaded
+
+        # Новая выгрузка на том же листе: первый прогон строит индекс строк, затем правки
+        # доли участников и прогон без изменений
+        worksheet = FakeWorksheet(snapshot, latency=args.latency)
+        sheet = fake_sheet(worksheet)
+        phases = [('bootstrap', None), ('incremental', max(1, round(1 / args.changed))), ('unchanged', None)]
+        for phase, step in phases:
+            if step:
+                await touch_users(args.users, step)
+            stats, results[f'{phase}_seconds'] = await timed(sync_users(session, sheet))
+            results[f'{phase}_api_calls'] = stats.api_calls
+            results[f'{phase}_downloaded_bytes'] = stats.downloaded
+            results[f'{phase}_rows_written'] = stats.updated + stats.appended
+
+        await reset_index(session)
+    if not args.keep:
+        await delete_users()
+    return results
+
+# bot_id ключей FSM бенчмарка: настоящий бот не может иметь id 0
+FSM_BENCH_BOT_ID = 0
+FSM_OPERATIONS = ('get_state', 'get_data', 'set_data', 'set_state')
+
+async def fsm_storage(args):
+    # Задержка и пропускная способность get/set состояния анкеты: MemoryStorage против PostgresStorage
+    # с кешем чтения (один процесс) и без него (несколько процессов, FSM_CACHE_TTL=0)
+    await migrate()
+    storages = {
+        'memory': MemoryStorage(),
+        'postgres_cached': PostgresStorage(cache_ttl=60),
+        'postgres': PostgresStorage(cache_ttl=0),
+    }
+    results = {}
+    for name, storage in storages.items():
+        timings = defaultdict(list)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def timed_call(operation, *call_args):
+            started = time.perf_counter()
+            result = await getattr(storage, operation)(*call_args)
+            timings[operation].append(time.perf_counter() - started)
+            return result
+
+        async def questionnaire(index):
+            # Шаг анкеты: обработчик читает состояние и данные, дописывает ответ и переходит дальше
+            key = StorageKey(bot_id=FSM_BENCH_BOT_ID, chat_id=SYNTHETIC_BASE_ID + index, user_id=SYNTHETIC_BASE_ID + index)
+            async with semaphore:
+                for step in range(args.steps):
+                    await timed_call('get_state', key)
+                    data = await timed_call('get_data', key)
+                    await timed_call('set_data', key, {**data, f'answer_{step}': f"Ответ {step}"})
+                    await timed_call('set_state', key, f'UserState:step_{step + 1}')
+                await storage.set_state(key, None)
+                await storage.set_data(key, {})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(questionnaire(index) for index in range(args.users)))
+        elapsed = time.perf_counter() - started
+        operations = sum(len(values) for values in timings.values())
+        results[f'{name}_ops_per_second'] = round(operations / elapsed, 1)
+        for operation in FSM_OPERATIONS:
+            results[f'{name}_{operation}_p50_us'] = round(percentile(timings[operation], 0.5) * 1e6, 1)
+            results[f'{name}_{operation}_p99_us'] = round(percentile(timings[operation], 0.99) * 1e6, 1)
+
+    async for session in get_session():
+        await session.execute(delete(FSMRecord).where(FSMRecord.key.startswith(f'{FSM_BENCH_BOT_ID}:')))
+        await session.commit()
+    return results
+
+PROCESSED_METRIC = 'bot_update_latency_seconds_count'
+
+def start_update(index):
+    telegram_id = SYNTHETIC_BASE_ID + index
+    sender = {'id': telegram_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench{index}'}
+    return {
+        'update_id': index,
+        'message': {
+            'message_id': index, 'date': int(time.time()), 'chat': {'id': telegram_id, 'type': 'private'},
+            'from': sender, 'text': '/start join',
+        },
+    }
+
+async def processed_updates(http, base_url):
+    # Апдейты обрабатываются в фоне после ответа на запрос: готовность считаем по метрикам бота
+    async with http.get(base_url + '/metrics') as response:
+        for line in (await response.text()).splitlines():
+            if line.startswith(PROCESSED_METRIC + ' '):
+                return int(line.split()[1])
+    return 0
+
+async def replay(http, base_url, updates, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    accepted = []
+
+    async def post(update):
+        async with semaphore:
+            started = time.perf_counter()
+            async with http.post(base_url + WEBHOOK_PATH, json=update, headers=headers) as response:
+                response.raise_for_status()
+            accepted.append(time.perf_counter() - started)
+
+    before = await processed_updates(http, base_url)
+    started = time.perf_counter()
+    await asyncio.gather(*(post(update) for update in updates))
+    while await processed_updates(http, base_url) < before + len(updates):
+        if time.perf_counter() - started > timeout:
+            raise SystemExit(f"benchmark: updates still in flight after {timeout}s")
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started, accepted
+
+async def webhook(args):
+    # Синтетические апдейты /start join через HTTP в обработчик вебхука. Без --url поднимается один
+    # процесс бота с фиктивной сессией Telegram; с --url - уже запущенный сервер (BOT_MODE=webhook,
+    # --workers его WEBHOOK_WORKERS), тогда его ответы уходят в настоящий Telegram
+    await delete_users()
+    runner = None
+    base_url = args.url
+    if base_url is None:
+        # Как в loadtest.py: у фиктивной сессии нет лимита Telegram, темп задает --rate планировщика
+        bot = Bot(token='123456:benchmark', session=FakeSession(args.api_latency))
+        bot.session.middleware(OutboundScheduler(args.rate))
+        dp, latency = create_dispatcher()
+        # Пустой список email: /start его не читает
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as emails_file:
+            allowed_emails.source = 'csv'
+            allowed_emails.path = Path(emails_file.name)
+
+        async def startup(app):
+            await on_startup(dp)
+
+        runner = web.AppRunner(create_webhook_app(bot, dp, latency, startup=startup))
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        base_url = f'http://{host}:{port}'
+
+    results = {}
+    try:
+        async with aiohttp.ClientSession() as http:
+            # Первый проход - новые участники (запись в БД), второй - повторный /start (кеш статуса)
+            for phase in ('new', 'repeat'):
+                updates = [start_update(index) for index in range(args.updates)]
+                elapsed, accepted = await replay(http, base_url, updates, args.concurrency, args.timeout)
+                results[f'{phase}_updates_per_second'] = round(len(updates) / elapsed, 1)
+                results[f'{phase}_updates_per_second_per_worker'] = round(len(updates) / elapsed / args.workers, 1)
+                results[f'{phase}_response_p50_ms'] = round(percentile(accepted, 0.5) * 1000, 2)
+                results[f'{phase}_response_p99_ms'] = round(percentile(accepted, 0.99) * 1000, 2)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+            allowed_emails.path.unlink()
+        await delete_users()
+    return results
+
+def measure_memory(func):
+    # Память, занятая после вызова: объекты, созданные func, живут, пока жив результат
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+async def allowlist(args):
+    # Загрузка, память, поиск и дочитывание дописанного хвоста списка email: set строк против компактного
+    directory = Path(tempfile.mkdtemp())
+    path = directory / 'emails.csv'
+    with open(path, 'w', encoding='utf-8') as file:
+        file.writelines(f"Student{index}@Example.com\n" for index in range(args.addresses))
+    probes = [f"student{index * 2}@example.com" for index in range(args.lookups // 2)]
+    probes += [f"missing{index}@example.com" for index in range(args.lookups - len(probes))]
+    results = {'file_mb': round(path.stat().st_size / 2 ** 20, 1)}
+
+    for name, compact in (('set', False), ('compact', True)):
+        emails = EmailAllowList(path, compact=compact, source='csv')
+        started = time.perf_counter()
+        emails.reload()
+        results[f'{name}_load_seconds'] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        found = sum(1 for email in probes if email in emails)
+        elapsed = time.perf_counter() - started
+        results[f'{name}_lookup_us'] = round(elapsed / len(probes) * 1e6, 2)
+        results[f'{name}_hits'] = found
+
+        # Дописываются новые оплатившие: перечитывается только хвост файла
+        with open(path, 'a', encoding='utf-8') as file:
+            file.writelines(f"late{name}{index}@example.com\n" for index in range(args.appended))
+        started = time.perf_counter()
+        emails.reload()
+        results[f'{name}_append_reload_seconds'] = round(time.perf_counter() - started, 3)
+        del emails
+
+        def load():
+            loaded = EmailAllowList(path, compact=compact, source='csv')
+            loaded.reload()
+            return loaded
+
+        loaded, memory = measure_memory(load)
+        results[f'{name}_memory_mb'] = round(memory / 2 ** 20, 1)
+        del loaded
+
+    path.unlink()
+    directory.rmdir()
+    return results
+
+class DiscardingWorksheet(FakeWorksheet):
+    # Лист, который только считает записанные строки: память бенчмарка не растет вместе с листом
+    def __init__(self, rows=(), latency=0.0):
+        super().__init__(rows, latency)
+        self.written = 0
+
+    def _write(self, range_name, rows):
+        _, last_row, _, _ = self._range(range_name)
+        if last_row > self.row_count:
+            raise ValueError(f"Range {range_name} exceeds grid limits ({self.row_count} rows)")
+        self.written += len(rows)
+        self.version += 1
+
+async def sheet_export(args):
+    # Полная выгрузка в пустой лист потоком из БД: скорость и пик памяти на разных объемах.
+    # Пик памяти меряется отдельным прогоном под tracemalloc - он замедляет выгрузку в разы
+    await require_scratch_database()
+    results = {}
+    for size in args.sizes:
+        await create_users(size)
+        async for session in get_session():
+            for traced in (False, True):
+                await reset_index(session)
+                worksheet = DiscardingWorksheet([SHEET_HEADER], latency=args.latency)
+                if traced:
+                    tracemalloc.start()
+                started = time.perf_counter()
+                stats = await sync_users(session, fake_sheet(worksheet))
+                elapsed = time.perf_counter() - started
+                if traced:
+                    results[f'{size}_peak_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+                    tracemalloc.stop()
+                else:
+                    results[f'{size}_rows_per_second'] = round(stats.appended / elapsed)
+                    results[f'{size}_api_calls'] = stats.api_calls
+                assert worksheet.written == size
+            await reset_index(session)
+    await delete_users()
+    return results
+
+def sizes(value):
+    return [int(size) for size in value.split(',')]
+
+def synthetic_participants(count, captain_share, seed=1):
+    rng = random.Random(seed)
+    cities = ('Москва', 'Казань', 'Новосибирск', 'Екатеринбург', 'Пермь', 'Минск')
+    experience = ('нет', 'Да, торгую год', 'немного', '-', 'больше трех лет')
+    return [
+        Participant(SYNTHETIC_BASE_ID + index, rng.choice(cities), rng.randint(16, 70), rng.choice(experience),
+                    rng.random() < captain_share)
+        for index in range(count)
+    ]
+
+async def teams(args):
+    # Разбиение на десятки в памяти (лучший из --runs прогонов) и, с --save, запись в таблицы teams
+    participants = synthetic_participants(args.participants, args.captains)
+    timings = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        plan = assign_teams(participants, seed=args.seed)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    results = {
+        'assign_seconds': round(best, 3),
+        'participants_per_second': round(args.participants / best),
+        'teams': len(plan),
+        'teams_with_captain': sum(1 for team in plan if team.captain is not None),
+    }
+    if args.save:
+        # save_teams заменяет текущее распределение целиком
+        await require_scratch_database()
+        async for session in get_session():
+            started = time.perf_counter()
+            await save_teams(session, plan)
+            results['save_seconds'] = round(time.perf_counter() - started, 3)
+            await save_teams(session, [])
+    return results
+
+def random_selections(count, seed=1):
+    rng = random.Random(seed)
+    return [rng.sample(kb.programs, rng.randint(0, len(kb.programs))) for _ in range(count)]
+
+async def keyboard(args):
+    # Клавиатура выбора программ: время построения из кеша и без него, затем вызовы Telegram и записи
+    # в БД за одну сессию выбора через диспетчер. БД не нужна: ответы остаются в буфере
+    selections = random_selections(args.builds)
+    build = kb.programs_keyboard_by_mask.__wrapped__
+    started = time.perf_counter()
+    for selected in selections:
+        build(kb.programs_mask(selected))
+    uncached = time.perf_counter() - started
+    started = time.perf_counter()
+    for selected in selections:
+        kb.get_programs_keyboard(selected)
+    cached = time.perf_counter() - started
+    results = {
+        'uncached_build_us': round(uncached / args.builds * 1e6, 2),
+        'cached_build_us': round(cached / args.builds * 1e6, 2),
+    }
+
+    bot = Bot(token='123456:benchmark', session=FakeSession())
+    bot.session.middleware(OutboundScheduler(args.rate))
+    dispatcher, _ = create_dispatcher()
+    # Буфер ответов в режиме complete ничего не пишет сам; считаем записи выбора, которые ушли бы в БД
+    answers.mode = 'complete'
+    program_writes = []
+    put = answers.put
+
+    async def counting_put(telegram_id, data):
+        if 'programs' in data:
+            program_writes.append(telegram_id)
+        await put(telegram_id, data)
+
+    answers.put = counting_put
+    rng = random.Random(args.seed)
+    timings = defaultdict(list)
+
+    async def session(index):
+        # Быстрые нажатия с паузами короче PROGRAMS_DEBOUNCE, как у живого участника
+        user = VirtualUser(index, bot, dispatcher, timings, think=0)
+        for program in [rng.choice(kb.programs) for _ in range(args.toggles)]:
+            await user.press('program', f"program:{program}")
+            await asyncio.sleep(rng.uniform(0, args.tap_interval))
+
+    await asyncio.gather(*(session(index) for index in range(args.sessions)))
+    await asyncio.gather(*list(handlers.programs_tasks))
+    calls = bot.session.calls
+    results.update({
+        'api_calls_per_session': round(sum(calls.values()) / args.sessions, 2),
+        'edits_per_session': round(calls['EditMessageText'] / args.sessions, 2),
+        'db_writes_per_session': round(len(program_writes) / args.sessions, 2),
+        # До кеша и отложенного обновления каждое нажатие - ответ, редактирование и запись в БД
+        'previous_api_calls_per_session': 2 * args.toggles,
+        'previous_db_writes_per_session': args.toggles,
+    })
+    answers._pending.clear()
+    return results
+
+async def legacy_save_to_db(session, telegram_id, data):
+    # Прежнее сохранение ответа из handlers.py: SELECT участника, затем UPDATE или INSERT
+    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    if result.scalar_one_or_none():
+        await session.execute(update(User).where(User.telegram_id == telegram_id).values(**data))
+    else:
+        await session.execute(insert(User).values(telegram_id=telegram_id, **data))
+    await session.commit()
+
+async def upsert_save(session, telegram_id, data):
+    await upsert_user(session, telegram_id, **data)
+
+async def upsert(args):
+    # Сохранение одного ответа анкеты отдельной сессией, как в обработчике: задержка и число SQL-выражений
+    # на сохранение. Первое сохранение участника создает запись, остальные обновляют.
+    # Влияние кеша подготовленных выражений - тот же прогон с DB_PGBOUNCER=1
+    await require_scratch_database()
+    results = {}
+    for name, save in (('legacy', legacy_save_to_db), ('upsert', upsert_save)):
+        await delete_users()
+        semaphore = asyncio.Semaphore(args.concurrency)
+        timings = []
+
+        async def one(index):
+            async with semaphore:
+                async for session in get_session():
+                    started = time.perf_counter()
+                    await save(session, SYNTHETIC_BASE_ID + index % args.users, {'city': f'Город {index}'})
+                    timings.append(time.perf_counter() - started)
+
+        queries_before = db_queries.value
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(args.saves)))
+        elapsed = time.perf_counter() - started
+        results[f'{name}_saves_per_second'] = round(args.saves / elapsed, 1)
+        results[f'{name}_statements_per_save'] = round((db_queries.value - queries_before) / args.saves, 2)
+        results[f'{name}_p50_ms'] = round(percentile(timings, 0.5) * 1000, 3)
+        results[f'{name}_p99_ms'] = round(percentile(timings, 0.99) * 1000, 3)
+    await delete_users()
+    return results
+
+def write_users_csv(path, count):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(USER_COLUMNS)
+        for index in range(count):
+            record = synthetic_record(index)
+            writer.writerow(
+                ', '.join(value) if isinstance(value, list) else '' if value is None else value for value in record
+            )
+
+async def copy(args):
+    # Команды manage.py на сгенерированных CSV: загрузка новых участников, повторная загрузка того же
+    # файла (обновление существующих), выгрузка; то же для списка email
+    await require_scratch_database()
+    directory = Path(tempfile.mkdtemp())
+    users_path, emails_path, export_path = directory / 'users.csv', directory / 'emails.csv', directory / 'export.csv'
+    write_users_csv(users_path, args.rows)
+    with open(emails_path, 'w', encoding='utf-8') as file:
+        file.writelines(f"bench{index}@benchmark.local\n" for index in range(args.rows))
+    await delete_users()
+    results = {}
+    steps = (
+        ('import_users', import_users, users_path),
+        ('reimport_users', import_users, users_path),
+        ('export_users', export_users, export_path),
+        ('import_emails', import_emails, emails_path),
+        ('export_emails', export_emails, export_path),
+    )
+    try:
+        for name, command, path in steps:
+            started = time.perf_counter()
+            await command(path)
+            results[f'{name}_rows_per_second'] = round(args.rows / (time.perf_counter() - started))
+    finally:
+        await delete_users()
+        async with driver_connection() as connection:
+            await connection.execute("DELETE FROM allowed_emails WHERE email LIKE '%@benchmark.local'")
+        for path in (users_path, emails_path, export_path):
+            path.unlink(missing_ok=True)
+        directory.rmdir()
+    return results
+
+def synthetic_inputs(count, seed=1):
+    # Ответы в том виде, как их вводят участники: разные записи телефона, регистр email, мусор
+    rng = random.Random(seed)
+    phone_formats = ('+7 ({}) {}-{}-{}', '8 {} {} {} {}', '8{}{}{}{}', '7-{}-{}-{}-{}')
+    inputs = defaultdict(list)
+    for index in range(count):
+        digits = f"9{rng.randrange(10 ** 9):09d}"
+        phone = rng.choice(phone_formats).format(digits[:3], digits[3:6], digits[6:8], digits[8:])
+        inputs['phone'].append(phone if rng.random() < 0.9 else digits[:rng.randint(1, 6)])
+        email = f"User{index}@Example.com" if rng.random() < 0.9 else f"user{index}example.com"
+        inputs['email'].append(f" {email} " if index % 2 else email)
+        inputs['age'].append(str(rng.randint(-5, 150)) if rng.random() < 0.95 else 'двадцать')
+        inputs['name'].append(f"Участник Бенчмарка{index}" if rng.random() < 0.9 else f"Участник{index}")
+    return inputs
+
+# Прежние проверки из handlers.py: строка шаблона на каждый вызов, возраст через трижды вызванный int
+def legacy_validate_phone(phone):
+    return re.match(r'^(\+?\d{1,4})?[-.\s]?\(?[0-9]{1,4}\)?[-.\s]?[0-9]{1,4}[-.\s]?[0-9]{1,9}$', phone) is not None
+
+def legacy_validate_email(email):
+    return re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', email) is not None
+
+def legacy_validate_age(text):
+    if not text.isdigit() or int(text) < 10 or int(text) > 100:
+        return None
+    return int(text)
+
+def legacy_validate_name(name):
+    return len(name.split()) >= 2
+
+LEGACY_VALIDATORS = {
+    'name': legacy_validate_name,
+    'phone': legacy_validate_phone,
+    'email': legacy_validate_email,
+    'age': legacy_validate_age,
+}
+
+def ns_per_call(func, values, calls):
+    started = time.perf_counter()
+    for value in islice(cycle(values), calls):
+        func(value)
+    return round((time.perf_counter() - started) / calls * 1e9)
+
+async def validation(args):
+    # Нормализация полей анкеты на --inputs вызовов каждой функции по --distinct разным значениям,
+    # рядом прежние проверки из handlers.py (они только проверяют, без нормализации), затем пакетная проверка строк
+    inputs = synthetic_inputs(args.distinct)
+    results = {}
+    for field, normalizer in NORMALIZERS.items():
+        results[f'{field}_ns'] = ns_per_call(normalizer, inputs[field], args.inputs)
+        results[f'{field}_legacy_ns'] = ns_per_call(LEGACY_VALIDATORS[field], inputs[field], args.inputs)
+        results[f'{field}_valid_share'] = round(sum(1 for value in inputs[field] if normalizer(value)) / args.distinct, 3)
+    rows = [dict(zip(inputs, values)) for values in zip(*inputs.values())]
+    started = time.perf_counter()
+    for _ in normalize_batch(islice(cycle(rows), args.inputs)):
+        pass
+    elapsed = time.perf_counter() - started
+    results['batch_row_ns'] = round(elapsed / args.inputs * 1e9)
+    results['batch_rows_per_second'] = round(args.inputs / elapsed)
+    return results
+
+class MeteredFakeSession(MeteringMixin, FakeSession):
+    pass
+
+def middleware_chains(observers, excluded):
+    # Middleware наблюдателей как есть и без middleware типов excluded, в том же порядке
+    full = {observer: list(observer) for observer in observers}
+    bare = {
+        observer: [middleware for middleware in middlewares if not isinstance(middleware, excluded)]
+        for observer, middlewares in full.items()
+    }
+    return full, bare
+
+def set_middlewares(chains):
+    for observer, middlewares in chains.items():
+        for middleware in list(observer):
+            observer.unregister(middleware)
+        for middleware in middlewares:
+            observer.register(middleware)
+
+def cached_starts(bot, first, count):
+    # Повторный /start зарегистрированных участников: статус из кеша, без БД.
+    # У каждого прогона свои участники, чтобы не упереться в ограничение частоты запросов
+    updates = []
+    for index in range(count):
+        status_cache.set(first + index, STATUS_COMPLETE)
+        update = start_update(index)
+        update['message']['from']['id'] = update['message']['chat']['id'] = first + index
+        updates.append(Update.model_validate(update, context={'bot': bot}))
+    return updates
+
+async def metrics(args):
+    # Повторный /start зарегистрированного участника (статус из кеша, без БД) через диспетчер:
+    # со всеми замерами (middleware, сессия с замером вызовов Bot API, монитор задержки loop) и без них.
+    # Фазы чередуются --rounds раз, берется лучший прогон каждой
+    dispatcher, _ = create_dispatcher()
+    bots = {}
+    for name, session in (('bare', FakeSession()), ('instrumented', MeteredFakeSession())):
+        bots[name] = Bot(token='123456:benchmark', session=session)
+        bots[name].session.middleware(OutboundScheduler(args.rate))
+    observers = [dispatcher.update.outer_middleware, router.message.middleware, router.callback_query.middleware]
+    chains = dict(zip(
+        ('instrumented', 'bare'), middleware_chains(observers, (UpdateLatencyMiddleware, HandlerLatencyMiddleware))
+    ))
+    timings = defaultdict(list)
+    for round_index in range(args.rounds):
+        for phase_index, phase in enumerate(('bare', 'instrumented')):
+            first = SYNTHETIC_BASE_ID + (round_index * 2 + phase_index) * args.updates
+            updates = cached_starts(bots[phase], first, args.updates)
+            set_middlewares(chains[phase])
+            if phase == 'instrumented':
+                start_loop_monitor()
+            started = time.perf_counter()
+            for update in updates:
+                await dispatcher.feed_update(bots[phase], update)
+            timings[phase].append(time.perf_counter() - started)
+            if phase == 'instrumented':
+                await stop_loop_monitor()
+    bare, instrumented = min(timings['bare']), min(timings['instrumented'])
+    return {
+        'bare_update_us': round(bare / args.updates * 1e6, 1),
+        'instrumented_update_us': round(instrumented / args.updates * 1e6, 1),
+        'overhead_percent': round((instrumented - bare) / bare * 100, 1),
+    }
+
+async def throttle(args):
+    # Ограничение частоты: время самого middleware на разрешенный апдейт (прямой вызов, --users разных
+    # пользователей), доля в обработке повторного /start через диспетчер и память на 100k пользователей
+    async def handler(event, data):
+        return None
+
+    messages = []
+    for index in range(args.users):
+        update = start_update(index)
+        messages.append(Message.model_validate(update['message']))
+    middleware = ThrottlingMiddleware()
+    started = time.perf_counter()
+    for message in messages:
+        await handler(message, {})
+    bare = time.perf_counter() - started
+    started = time.perf_counter()
+    for message in messages:
+        await middleware(handler, message, {})
+    throttled = time.perf_counter() - started
+    results = {'middleware_ns': round((throttled - bare) / args.users * 1e9)}
+
+    def track(count):
+        limiter = ThrottlingMiddleware()
+        now = time.monotonic()
+        for index in range(count):
+            limiter.hit((SYNTHETIC_BASE_ID + index, '/start'), now)
+        return limiter
+
+    _, size = measure_memory(lambda: track(100_000))
+    results['memory_per_100k_users_mb'] = round(size / 2 ** 20, 1)
+
+    dispatcher, _ = create_dispatcher()
+    bot = Bot(token='123456:benchmark', session=FakeSession())
+    bot.session.middleware(OutboundScheduler(args.rate))
+    observers = [router.message.outer_middleware, router.callback_query.outer_middleware]
+    chains = dict(zip(('throttled', 'bare'), middleware_chains(observers, ThrottlingMiddleware)))
+    timings = defaultdict(list)
+    for round_index in range(args.rounds):
+        for phase_index, phase in enumerate(('bare', 'throttled')):
+            first = SYNTHETIC_BASE_ID + (round_index * 2 + phase_index) * args.updates
+            updates = cached_starts(bot, first, args.updates)
+            set_middlewares(chains[phase])
+            started = time.perf_counter()
+            for update in updates:
+                await dispatcher.feed_update(bot, update)
+            timings[phase].append(time.perf_counter() - started)
+    bare, throttled = min(timings['bare']), min(timings['throttled'])
+    results['start_overhead_us'] = round((throttled - bare) / args.updates * 1e6, 1)
+    results['start_overhead_percent'] = round((throttled - bare) / bare * 100, 1)
+    return results
+
+async def logs(args):
+    # Повторный /start через диспетчер при прежней настройке логов (basicConfig: запись в поток прямо
+    # из обработчика) и при setup_logging (очередь, запись в фоновом потоке). aiogram пишет строку INFO
+    # на каждый обработанный апдейт. Лог идет в --log-file: файл на диске принимает запись быстро,
+    # терминал или pipe с медленным читателем - намного медленнее
+    dispatcher, _ = create_dispatcher()
+    bot = Bot(token='123456:benchmark', session=FakeSession())
+    bot.session.middleware(OutboundScheduler(args.rate))
+    path = Path(args.log_file) if args.log_file else Path(tempfile.mkstemp(suffix='.log')[1])
+    output = open(path, 'a', encoding='utf-8')
+    previous = logging.StreamHandler(output)
+    previous.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    with contextlib.redirect_stderr(output):
+        setup_logging(level='INFO', levels='')
+    root = logging.getLogger()
+    handlers = {'sync': [previous], 'queue': list(root.handlers)}
+    timings = defaultdict(list)
+    try:
+        for round_index in range(args.rounds):
+            for phase_index, phase in enumerate(handlers):
+                first = SYNTHETIC_BASE_ID + (round_index * 2 + phase_index) * args.updates
+                updates = cached_starts(bot, first, args.updates)
+                root.handlers[:] = handlers[phase]
+                for update in updates:
+                    started = time.perf_counter()
+                    await dispatcher.feed_update(bot, update)
+                    timings[phase].append(time.perf_counter() - started)
+    finally:
+        stop_logging()
+        root.handlers[:] = []
+        output.close()
+        if not args.log_file:
+            path.unlink()
+    results = {}
+    for phase, values in timings.items():
+        results[f'{phase}_mean_us'] = round(sum(values) / len(values) * 1e6, 1)
+        results[f'{phase}_p50_us'] = round(percentile(values, 0.5) * 1e6, 1)
+        results[f'{phase}_p99_us'] = round(percentile(values, 0.99) * 1e6, 1)
+    return results
+
+async def sheet_snapshot(args):
+    # Чтение листа на одну выгрузку: прежняя выгрузка скачивает весь лист каждый раз, новая сверяет
+    # время изменения таблицы и после ручной правки читает только колонку telegram_id.
+    # Каждый прогон - отдельная сессия, как запуски выгрузки по расписанию
+    await require_scratch_database()
+    await create_users(args.users)
+    results = {}
+    async for session in get_session():
+        await reset_index(session)
+        worksheet = FakeWorksheet([SHEET_HEADER])
+        await legacy_update_google_sheet(session, worksheet)
+        worksheet.calls.clear()
+        results['legacy_downloaded_bytes'] = await legacy_update_google_sheet(session, worksheet)
+        results['legacy_api_calls'] = sum(worksheet.calls.values())
+    worksheet = FakeWorksheet(worksheet.rows)
+    sheet = fake_sheet(worksheet)
+
+    def edit_cell():
+        worksheet.rows[args.users // 2][7] = 'Исправлено вручную'
+        worksheet.version += 1
+
+    def delete_row():
+        # Строки ниже удаленной переезжают. Синтетические участники созданы только что и попадают
+        # в перекрытие watermark, поэтому переехавшие строки перезаписываются в этом же прогоне
+        del worksheet.rows[args.users // 3]
+        worksheet.version += 1
+
+    phases = [
+        ('bootstrap', None), ('unchanged', None), ('cell_edited', edit_cell), ('row_deleted', delete_row),
+        ('bot_changes', lambda: touch_users(args.users, max(1, round(1 / args.changed)))),
+    ]
+    for phase, change in phases:
+        if change is not None:
+            result = change()
+            if asyncio.iscoroutine(result):
+                await result
+        async for session in get_session():
+            stats = await sync_users(session, sheet)
+        results[f'{phase}_api_calls'] = stats.api_calls
+        results[f'{phase}_downloaded_bytes'] = stats.downloaded
+        results[f'{phase}_rows_written'] = stats.updated + stats.appended
+    async for session in get_session():
+        await reset_index(session)
+    await delete_users()
+    return results
+
+def option(*flags, **kwargs):
+    return flags, kwargs
+
+BENCHMARKS = {
+    'sheet-sync': (sheet_sync, 'incremental sheet sync vs the previous full rewrite, fake worksheet and DB', [
+        option('--users', type=int, default=10_000),
+        option('--changed', type=float, default=0.05, help='share of users edited before the incremental sync'),
+        option('--latency', type=float, default=0.0, help='simulated Google Sheets API latency per call, seconds'),
+        option('--keep', action='store_true', help='keep synthetic users in the DB'),
+    ]),
+    'fsm-storage': (fsm_storage, 'FSM state get/set latency and throughput, MemoryStorage vs PostgresStorage', [
+        option('--users', type=int, default=1000),
+        # Больше размера пула БД - замер превращается в ожидание свободного соединения
+        option('--concurrency', type=int, default=10),
+        option('--steps', type=int, default=10, help='questionnaire steps per user'),
+    ]),
+    'webhook': (webhook, 'replay synthetic updates against the webhook handler, updates/s per worker', [
+        option('--updates', type=int, default=5000),
+        option('--concurrency', type=int, default=100, help='parallel HTTP requests'),
+        option('--url', help='base URL of a running webhook server; by default one is started in-process'),
+        option('--workers', type=int, default=1, help='WEBHOOK_WORKERS of the server at --url'),
+        option('--api-latency', type=float, default=0.0, help='simulated Telegram API latency, seconds'),
+        option('--rate', type=float, default=10_000.0, help='outbound scheduler rate limit, messages per second'),
+        option('--timeout', type=float, default=300.0, help='how long to wait for the updates to be processed'),
+    ]),
+    'allowlist': (allowlist, 'email allow-list load time, memory, lookups and incremental reload', [
+        option('--addresses', type=int, default=1_000_000),
+        option('--lookups', type=int, default=200_000, help='half of them are hits'),
+        option('--appended', type=int, default=1000, help='addresses appended before the incremental reload'),
+    ]),
+    'sheet-export': (sheet_export, 'streaming full export to an empty fake sheet, rows/s and peak memory by size', [
+        option('--sizes', type=sizes, default=[10_000, 100_000, 1_000_000], help='comma-separated user counts'),
+        option('--latency', type=float, default=0.0, help='simulated Google Sheets API latency per call, seconds'),
+    ]),
+    'teams': (teams, 'team assignment time, optionally with saving to the DB', [
+        option('--participants', type=int, default=50_000),
+        option('--captains', type=float, default=0.12, help='share of participants who are captains'),
+        option('--seed', type=int, default=0),
+        option('--runs', type=int, default=3),
+        option('--save', action='store_true', help='also time writing the teams to a scratch DB'),
+    ]),
+    'keyboard': (keyboard, 'programs keyboard build time and Telegram API calls per selection session', [
+        option('--builds', type=int, default=100_000, help='keyboards built in the micro-benchmark'),
+        option('--sessions', type=int, default=200, help='participants choosing programs at once'),
+        option('--toggles', type=int, default=6, help='program taps per session'),
+        option('--tap-interval', type=float, default=0.2, help='max pause between taps, seconds'),
+        option('--rate', type=float, default=10_000.0, help='outbound scheduler rate limit, messages per second'),
+        option('--seed', type=int, default=0),
+    ]),
+    'upsert': (upsert, 'latency and SQL statements per answer save, single upsert vs the previous select + update/insert', [
+        option('--saves', type=int, default=5000),
+        option('--users', type=int, default=1000, help='distinct participants; the first save of each one inserts'),
+        # Больше размера пула БД - замер превращается в ожидание свободного соединения
+        option('--concurrency', type=int, default=10),
+    ]),
+    'copy': (copy, 'bulk import and export of participants and emails through COPY, rows/s', [
+        option('--rows', type=int, default=1_000_000),
+    ]),
+    'validation': (validation, 'name/phone/email/age normalization and batch validation, ns per call', [
+        option('--inputs', type=int, default=1_000_000, help='calls of each function'),
+        option('--distinct', type=int, default=100_000, help='distinct synthetic values they cycle through'),
+    ]),
+    'metrics': (metrics, 'overhead of the latency/DB/Telegram API instrumentation on a cached /start, target under 5%%', [
+        option('--updates', type=int, default=10_000, help='updates per run'),
+        option('--rounds', type=int, default=5, help='alternating runs with and without instrumentation'),
+        option('--rate', type=float, default=1_000_000.0, help='outbound scheduler rate limit, messages per second'),
+    ]),
+    'throttle': (throttle, 'anti-flood middleware cost per update and memory per 100k tracked users', [
+        option('--users', type=int, default=100_000, help='distinct users for the direct middleware calls'),
+        option('--updates', type=int, default=10_000, help='cached /start updates per dispatcher run'),
+        option('--rounds', type=int, default=5, help='alternating dispatcher runs with and without the middleware'),
+        option('--rate', type=float, default=1_000_000.0, help='outbound scheduler rate limit, messages per second'),
+    ]),
+    'logging': (logs, 'handler latency with the previous synchronous logging vs the queue-based setup_logging', [
+        option('--updates', type=int, default=10_000, help='cached /start updates per run'),
+        option('--rounds', type=int, default=3, help='alternating runs of each logging setup'),
+        option('--log-file', help='where both setups write; a temporary file by default'),
+        option('--rate', type=float, default=1_000_000.0, help='outbound scheduler rate limit, messages per second'),
+    ]),
+    'sheet-snapshot': (sheet_snapshot, 'bytes read and API calls per sheet sync, including syncs after manual edits', [
+        option('--users', type=int, default=20_000),
+        option('--changed', type=float, default=0.05, help='share of users edited through the bot before the last sync'),
+    ]),
+}
+
+async def main(args):
+    try:
+        return await BENCHMARKS[args.benchmark][0](args)
+    finally:
+        await dispose_engine()
+
+def print_results(name, results, previous):
+    before = (previous or {}).get('results', {})
+    for metric, value in results.items():
+        change = delta(value, before.get(metric)) if isinstance(value, (int, float)) else ''
+        print(f"{name} {metric}: {value}{change}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of individual bot subsystems')
+    parser.add_argument('--results', type=Path, default=Path('benchmark_results.jsonl'))
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    for name, (_, description, options) in BENCHMARKS.items():
+        subparser = subparsers.add_parser(name, help=description)
+        for flags, kwargs in options:
+            subparser.add_argument(*flags, **kwargs)
+    args = parser.parse_args()
+
+    params = {key: value for key, value in vars(args).items() if key not in ('results', 'keep')}
+    results = asyncio.run(main(args))
+    record = {
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'params': params,
+        'results': results,
+    }
+    print_results(args.benchmark, results, previous_result(args.results, params))
+    with open(args.results, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record, ensure_ascii=False) + '\n')
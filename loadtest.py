@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from aiogram import Bot
+from sqlalchemy import delete
+
+import app.handlers as handlers
+from app.allowlist import allowed_emails
+from app.broadcast import Broadcaster
+from app.database.buffer import answers
+from app.database.engine import db_queries, get_session
+from app.database.models import BroadcastDelivery, User
+from app.outbound import OutboundScheduler
+from run import create_dispatcher, on_shutdown, on_startup
+from tests.conftest import BASE_TELEGRAM_ID, FakeSession, VirtualUser, email_for
+
+# Нагрузочный прогон всей анкеты без сети: настоящий router из app/handlers.py, диспетчер
+# из run.py и фиктивная сессия бота вместо Telegram. БД - та, что настроена в .env (DB_*):
+#   python loadtest.py --users 1000 --concurrency 100
+#   python loadtest.py --users 500 --broadcast 10000 --rate 1000
+# --broadcast запускает рассылку параллельно с регистрациями через общий планировщик исходящих
+# сообщений: время шагов анкеты показывает, насколько рассылка задерживает ответы участникам.
+# --rate - лимит планировщика; у фиктивной сессии нет лимита Telegram, поэтому масштаб времени задается им
+# Результаты дописываются в loadtest_results.jsonl и сравниваются с прошлым прогоном тех же параметров
+
+# Получатели синтетической рассылки - отдельный диапазон
+BROADCAST_BASE_ID = BASE_TELEGRAM_ID + 1_000_000_000
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def delete_users(count):
+    async for session in get_session():
+        await session.execute(delete(User).where(User.telegram_id.between(BASE_TELEGRAM_ID, BASE_TELEGRAM_ID + count)))
+        await session.commit()
+
+async def delete_broadcast(broadcast_id):
+    async for session in get_session():
+        await session.execute(delete(BroadcastDelivery).where(BroadcastDelivery.broadcast_id == broadcast_id))
+        await session.commit()
+
+async def run(args):
+    random.seed(args.seed)
+    bot = Bot(token='123456:loadtest', session=FakeSession(args.api_latency))
+    scheduler = OutboundScheduler(args.rate)
+    bot.session.middleware(scheduler)
+    dispatcher, _ = create_dispatcher()
+
+    # Синтетические адреса подкладываются отдельным CSV-списком, он загружается при старте
+    emails_file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+    with emails_file:
+        emails_file.writelines(email_for(index) + '\n' for index in range(args.users))
+    allowed_emails.source = 'csv'
+    allowed_emails.path = Path(emails_file.name)
+    await on_startup(dispatcher)
+
+    # Участники прошлого прогона иначе пройдут /start как уже зарегистрированные
+    await delete_users(args.users)
+
+    timings = defaultdict(list)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    failures = []
+
+    async def user_flow(index):
+        async with semaphore:
+            try:
+                await VirtualUser(index, bot, dispatcher, timings, args.think).register(args.captains)
+            except Exception as e:
+                failures.append(repr(e))
+
+    broadcast_id = f"loadtest-{int(time.time())}"
+    broadcast_task = None
+    if args.broadcast:
+        messages = {BROADCAST_BASE_ID + index: 'Нагрузочная рассылка' for index in range(args.broadcast)}
+        broadcaster = Broadcaster(bot, global_rate=args.rate)
+
+    queries_before = db_queries.value
+    started = time.perf_counter()
+    if args.broadcast:
+        broadcast_task = asyncio.create_task(broadcaster.run(broadcast_id, messages))
+    await asyncio.gather(*(user_flow(index) for index in range(args.users)))
+    registrations_elapsed = time.perf_counter() - started
+    # Отложенные обновления клавиатуры и буфер ответов - часть нагрузки на БД
+    await asyncio.gather(*list(handlers.programs_tasks), return_exceptions=True)
+    await answers.flush()
+    report = await broadcast_task if broadcast_task is not None else None
+    elapsed = time.perf_counter() - started
+    queries = db_queries.value - queries_before
+
+    if not args.keep:
+        await delete_users(args.users)
+    if report is not None:
+        await delete_broadcast(broadcast_id)
+    await on_shutdown(dispatcher)
+    await bot.session.close()
+    Path(emails_file.name).unlink()
+
+    completed = args.users - len(failures)
+    updates = sum(len(values) for values in timings.values())
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'params': {
+            'users': args.users, 'concurrency': args.concurrency, 'api_latency': args.api_latency,
+            'think': args.think, 'captains': args.captains, 'seed': args.seed,
+            'broadcast': args.broadcast, 'rate': args.rate,
+        },
+        'elapsed': round(elapsed, 3),
+        'registrations_elapsed': round(registrations_elapsed, 3),
+        'broadcast': {
+            'sent': report.sent,
+            'failed': report.failed,
+            'elapsed': round(report.elapsed, 3),
+            'throughput': round(report.throughput, 1),
+        } if report is not None else None,
+        'outbound_wait': {
+            priority: {
+                'count': histogram.count,
+                'mean_ms': round(histogram.sum / histogram.count * 1000, 2) if histogram.count else 0.0,
+            }
+            for priority, histogram in scheduler.wait_time.children.items()
+        },
+        'edits_coalesced': scheduler.coalesced.value,
+        'completed': completed,
+        'failures': failures[:10],
+        'updates': updates,
+        'updates_per_second': round(updates / elapsed, 1) if elapsed else 0.0,
+        'db_queries': queries,
+        'db_queries_per_registration': round(queries / completed, 2) if completed else None,
+        'api_calls_per_registration': round(sum(bot.session.calls.values()) / completed, 2) if completed else None,
+        'steps': {
+            step: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 0.5) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            }
+            for step, values in timings.items()
+        },
+    }
+
+def previous_result(path, params):
+    if not path.exists():
+        return None
+    previous = None
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            record = json.loads(line)
+            if record.get('params') == params:
+                previous = record
+    return previous
+
+def delta(current, previous):
+    if not previous:
+        return ''
+    change = (current - previous) / previous * 100
+    return f" ({change:+.1f}% vs {previous})"
+
+def print_report(result, previous):
+    print(f"revision {result['revision']}: {result['completed']}/{result['params']['users']} registrations "
+          f"in {result['elapsed']} s")
+    before = previous or {}
+    print(f"updates/s: {result['updates_per_second']}{delta(result['updates_per_second'], before.get('updates_per_second'))}")
+    print(f"DB queries per registration: {result['db_queries_per_registration']}"
+          f"{delta(result['db_queries_per_registration'] or 0, before.get('db_queries_per_registration'))}")
+    print(f"Telegram API calls per registration: {result['api_calls_per_registration']}")
+    if result['broadcast']:
+        broadcast = result['broadcast']
+        print(f"broadcast: {broadcast['sent']} sent, {broadcast['failed']} failed in {broadcast['elapsed']} s "
+              f"({broadcast['throughput']} msg/s); registrations finished in {result['registrations_elapsed']} s")
+    for priority, wait in result['outbound_wait'].items():
+        print(f"outbound wait {priority}: {wait['count']} calls, mean {wait['mean_ms']} ms")
+    print(f"{'step':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, stats in result['steps'].items():
+        previous_p95 = before.get('steps', {}).get(step, {}).get('p95_ms')
+        print(f"{step:<20}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+              f"{delta(stats['p95_ms'], previous_p95)}")
+    for failure in result['failures']:
+        print(f"failure: {failure}", file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay load test of the registration funnel')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--api-latency', type=float, default=0.0, help='simulated Telegram API latency, seconds')
+    parser.add_argument('--think', type=float, default=0.0, help='max random pause between user steps, seconds')
+    parser.add_argument('--captains', type=float, default=0.3, help='share of users who become captains')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--broadcast', type=int, default=0, help='recipients of a broadcast run alongside registrations')
+    parser.add_argument('--rate', type=float, default=1000.0, help='outbound scheduler rate limit, messages per second')
+    parser.add_argument('--keep', action='store_true', help='keep synthetic users in the DB')
+    parser.add_argument('--results', type=Path, default=Path('loadtest_results.jsonl'))
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result, previous_result(args.results, result['params']))
+    with open(args.results, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(result, ensure_ascii=False) + '\n')
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import csv
+import sys
+import time
+from contextlib import asynccontextmanager
+from app.database.engine import dispose_engine, get_engine
+from app.database.migrations import migrate
+from app.logs import setup_logging
+from app.validation import normalize_batch, normalize_email
+
+# Миграции схемы БД и массовая загрузка и выгрузка участников и списка email через COPY:
+#   python manage.py migrate
+#   python manage.py export-users users.csv
+#   python manage.py import-users users.csv
+#   python manage.py export-emails emails.csv
+#   python manage.py import-emails emails.csv
+
+USER_COLUMNS = (
+    'telegram_id', 'name', 'phone', 'telegram', 'email', 'age', 'occupation', 'city',
+    'crypto_experience', 'programs', 'captain_motivation', 'status',
+)
+
+class Progress:
+    def __init__(self, label, interval=1.0):
+        self.label = label
+        self.interval = interval
+        self.rows = 0
+        self.invalid = 0
+        self.started = time.perf_counter()
+        self._reported = self.started
+
+    def add(self, rows=1):
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self._reported >= self.interval:
+            self._reported = now
+            self._print(now)
+
+    def _print(self, now, end=''):
+        elapsed = now - self.started
+        rate = self.rows / elapsed if elapsed else 0
+        print(f"\r{self.label}: {self.rows} rows, {elapsed:.1f} s, {rate:,.0f} rows/s", end=end, file=sys.stderr)
+
+    def done(self):
+        self._print(time.perf_counter(), end='\n')
+        if self.invalid:
+            print(f"{self.label}: {self.invalid} rows with invalid values", file=sys.stderr)
+
+@asynccontextmanager
+async def driver_connection():
+    # Соединение asyncpg из общего пула - для COPY нужен драйвер напрямую
+    async with get_engine().connect() as connection:
+        raw = await connection.get_raw_connection()
+        yield raw.driver_connection
+
+def parse_programs(value):
+    # Принимает и массив Postgres ({"a","b"}), как его выгружает COPY, и список через запятую
+    value = value.strip()
+    if not value:
+        return None
+    if value.startswith('{') and value.endswith('}'):
+        inner = value[1:-1]
+        if not inner:
+            return []
+        return next(csv.reader([inner], escapechar='\\'))
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def user_record(row):
+    record = []
+    for column in USER_COLUMNS:
+        value = row.get(column)
+        if column == 'telegram_id':
+            record.append(int(value))
+        elif column == 'programs':
+            record.append(parse_programs(value or ''))
+        elif column == 'status':
+            # Пустой статус не затирает существующий; новым участникам подставляется student
+            record.append(value or None)
+        elif column == 'age':
+            record.append(value if isinstance(value, int) else None)
+        else:
+            record.append(value or None)
+    return tuple(record)
+
+def read_users(path, progress):
+    with open(path, newline='', encoding='utf-8') as file:
+        rows = (
+            {column: (value or '').strip() for column, value in row.items() if column}
+            for row in csv.DictReader(file) if (row.get('telegram_id') or '').strip().isdigit()
+        )
+        # Телефоны приводятся к E.164, email - к каноническому виду; непрошедшие проверку значения
+        # сохраняются как есть (возраст - пустым) и считаются в отчете
+        for row, invalid in normalize_batch(rows):
+            progress.add()
+            if invalid:
+                progress.invalid += 1
+            yield user_record(row)
+
+def read_emails(path, progress):
+    with open(path, newline='', encoding='utf-8') as file:
+        for row in csv.reader(file):
+            for cell in row:
+                email = normalize_email(cell)
+                if email:
+                    progress.add()
+                    yield (email,)
+                elif '@' in cell:
+                    progress.invalid += 1
+
+async def export_query(query, path, label):
+    progress = Progress(label)
+    async with driver_connection() as connection:
+        with open(path, 'wb') as file:
+            # Данные приходят потоком кусками, в памяти держится только текущий кусок
+            async def write(chunk):
+                file.write(chunk)
+                progress.add(chunk.count(b'\n'))
+            await connection.copy_from_query(query, output=write, format='csv', header=True)
+    progress.done()
+
+async def export_users(path):
+    query = f"SELECT {', '.join(USER_COLUMNS)} FROM nastavnichestvo ORDER BY id"
+    await export_query(query, path, 'export-users')
+
+async def export_emails(path):
+    await export_query("SELECT email FROM allowed_emails ORDER BY email", path, 'export-emails')
+
+def csv_header(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        return {column.strip() for column in next(csv.reader(file), [])}
+
+def import_select(column):
+    # Новым участникам без статуса подставляется student; существующим пустой статус ничего не меняет
+    return "coalesce(status, 'student')" if column == 'status' else column
+
+def import_assignments(source, columns):
+    return ', '.join(f"{column} = coalesce({source}.{column}, nastavnichestvo.{column})" for column in columns)
+
+async def import_users(path):
+    progress = Progress('import-users')
+    header = csv_header(path)
+    if 'telegram_id' not in header:
+        raise SystemExit("import-users: CSV must have a telegram_id column")
+    columns = ', '.join(USER_COLUMNS)
+    # Существующим участникам обновляются только колонки из файла, и только непустыми значениями:
+    # файл сверки из telegram_id и email не стирает остальные данные
+    updated = [column for column in USER_COLUMNS if column != 'telegram_id' and column in header]
+    if updated:
+        existing = (
+            f"UPDATE nastavnichestvo SET {import_assignments('source', updated)}, updated_at = now() FROM source "
+            f"WHERE nastavnichestvo.telegram_id = source.telegram_id RETURNING nastavnichestvo.telegram_id"
+        )
+        on_conflict = f"DO UPDATE SET {import_assignments('EXCLUDED', updated)}, updated_at = now()"
+    else:
+        existing = "SELECT telegram_id FROM nastavnichestvo JOIN source USING (telegram_id)"
+        on_conflict = "DO NOTHING"
+    async with driver_connection() as connection:
+        async with connection.transaction():
+            # COPY во временную таблицу с теми же типами, затем одно выражение: существующие участники
+            # обновляются со статусом из файла как есть (NULL - оставить прежний), остальные вставляются.
+            # ON CONFLICT - только для участников, которых бот создал уже после начала выражения
+            await connection.execute(
+                f"CREATE TEMP TABLE users_import ON COMMIT DROP AS SELECT {columns} FROM nastavnichestvo WITH NO DATA"
+            )
+            await connection.copy_records_to_table('users_import', records=read_users(path, progress), columns=USER_COLUMNS)
+            result = await connection.fetchrow(
+                f"WITH source AS ("
+                f"SELECT DISTINCT ON (telegram_id) {columns} FROM users_import ORDER BY telegram_id, ctid DESC"
+                f"), existing AS ({existing}), inserted AS ("
+                f"INSERT INTO nastavnichestvo ({columns}) "
+                f"SELECT {', '.join(map(import_select, USER_COLUMNS))} FROM source "
+                f"WHERE NOT EXISTS (SELECT 1 FROM existing WHERE existing.telegram_id = source.telegram_id) "
+                f"ON CONFLICT (telegram_id) {on_conflict} RETURNING 1"
+                f") SELECT (SELECT count(*) FROM existing) AS existing, (SELECT count(*) FROM inserted) AS inserted"
+            )
+    progress.done()
+    print(f"import-users: {result['inserted']} new, {result['existing']} existing", file=sys.stderr)
+
+async def import_emails(path):
+    progress = Progress('import-emails')
+    async with driver_connection() as connection:
+        async with connection.transaction():
+            await connection.execute("CREATE TEMP TABLE emails_import (email text) ON COMMIT DROP")
+            await connection.copy_records_to_table('emails_import', records=read_emails(path, progress), columns=('email',))
+            result = await connection.execute(
+                "INSERT INTO allowed_emails (email) SELECT DISTINCT email FROM emails_import ON CONFLICT DO NOTHING"
+            )
+    progress.done()
+    print(f"import-emails: {result}", file=sys.stderr)
+
+async def migrate_command(path=None):
+    version = await migrate()
+    print(f"migrate: schema is at version {version}", file=sys.stderr)
+
+COMMANDS = {
+    'migrate': migrate_command,
+    'export-users': export_users,
+    'import-users': import_users,
+    'export-emails': export_emails,
+    'import-emails': import_emails,
+}
+
+async def main(command, path):
+    try:
+        if command.startswith('import'):
+            await migrate()
+        await COMMANDS[command](path)
+    finally:
+        await dispose_engine()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Schema migrations and bulk import/export of participants and emails')
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('path', nargs='?', help='CSV file')
+    args = parser.parse_args()
+    if args.command != 'migrate' and not args.path:
+        parser.error(f"{args.command} requires a CSV file path")
+    setup_logging()
+    asyncio.run(main(args.command, args.path))
@@ -0,0 +1,89 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Профиль запуска бота без сети и БД:
+#   python profile_startup.py            - время до готовности к polling и самые дорогие импорты
+#   python profile_startup.py --runs 10 --top 30
+# Готовность - импорт run.py, создание бота и диспетчера и on_startup, как в main() перед start_polling.
+# Миграции отключены (DB_INIT_ON_STARTUP=false): в проде их применяет manage.py migrate
+
+ROOT = Path(__file__).parent
+READY_TARGET_MS = 300
+
+READY_SCRIPT = """
+import time
+started = time.perf_counter()
+import asyncio
+import run
+
+async def ready():
+    bot = run.create_bot('123456:profile')
+    dispatcher, _ = run.create_dispatcher()
+    await run.on_startup(dispatcher)
+    elapsed = time.perf_counter() - started
+    await run.on_shutdown(dispatcher)
+    await bot.session.close()
+    print(elapsed)
+
+asyncio.run(ready())
+"""
+
+def child_env():
+    return {**os.environ, 'DB_INIT_ON_STARTUP': 'false', 'PYTHONDONTWRITEBYTECODE': '1'}
+
+def measure_ready(runs):
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-c', READY_SCRIPT], cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True
+        )
+        timings.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    return timings
+
+def import_profile():
+    # Вывод -X importtime: "import time: self [us] | cumulative | имя модуля", вложенность - отступом имени.
+    # Возвращает все модули, включая вложенные: (собственное время, с вложенными, глубина, имя)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import run'], cwd=ROOT, env=child_env(),
+        capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        modules.append((int(own), int(cumulative), depth, name.strip()))
+    return modules
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bot startup profile')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--depth', type=int, default=2, help='nesting levels in the cumulative report')
+    args = parser.parse_args()
+
+    modules = import_profile()
+    total = sum(cumulative for _, cumulative, depth, _ in modules if depth == 0)
+    print(f"Imports of run.py: {total / 1000:.0f} ms")
+    # Пакеты, которые импортирует run.py и модули бота: где набирается время
+    print(f"\nUp to {args.depth} levels deep, by cumulative time:")
+    print(f"{'cumulative ms':>14} {'self ms':>14}  module")
+    shallow = [module for module in modules if module[2] <= args.depth]
+    for own, cumulative, depth, name in sorted(shallow, key=lambda module: -module[1])[:args.top]:
+        print(f"{cumulative / 1000:>14.1f} {own / 1000:>14.1f}  {'  ' * depth}{name}")
+    # Отдельные модули, которые дороже всего загружать сами по себе
+    print("\nAll modules, by self time:")
+    print(f"{'self ms':>14} {'cumulative ms':>14}  module")
+    for own, cumulative, depth, name in sorted(modules, key=lambda module: -module[0])[:args.top]:
+        print(f"{own / 1000:>14.1f} {cumulative / 1000:>14.1f}  {name}")
+
+    timings = measure_ready(args.runs)
+    median = statistics.median(timings)
+    print(f"\nReady to poll: median {median:.0f} ms, min {min(timings):.0f} ms, max {max(timings):.0f} ms "
+          f"over {args.runs} runs (target {READY_TARGET_MS} ms)")
+    sys.exit(0 if median <= READY_TARGET_MS else 1)
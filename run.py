@@ -1,27 +1,194 @@
+import time
+# Отсчет времени запуска - до импорта aiogram и модулей бота
+started_at = time.perf_counter()
+
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from decouple import config
 import asyncio
+import logging
+import signal
 # Импорт и подключение роутера
 from app.google.google import setup_google_sheet_update
 from app.handlers import router
 
-from app.database.models import get_session, init_db
+from app.database.engine import dispose_engine, get_session
+from app.database.migrations import migrate
+from app.database.buffer import answers
+from app.database.changes import CHANGE_FEED_NOTIFY, changes
+from app.database.storage import FSM_CACHE_TTL, PostgresStorage
+from app.allowlist import allowed_emails
+from app.logs import LogContextMiddleware, setup_logging
+from app.metrics import (
+    HandlerLatencyMiddleware, UpdateLatencyMiddleware, metrics_view, start_loop_monitor, start_metrics_server,
+    stop_loop_monitor
+)
+from app.outbound import OutboundScheduler
+from app.session import MeteredSession
+from app.throttling import ThrottlingMiddleware
+
+logger = logging.getLogger(__name__)
+
+# BOT_MODE=polling - один процесс с long polling, BOT_MODE=webhook - aiohttp-сервер
+BOT_MODE = config('BOT_MODE', default='polling')
+FSM_STORAGE = config('FSM_STORAGE', default='memory')
+WEBHOOK_BASE_URL = config('WEBHOOK_BASE_URL', default='')
+WEBHOOK_PATH = config('WEBHOOK_PATH', default='/webhook')
+WEBHOOK_SECRET = config('WEBHOOK_SECRET', default='')
+WEBAPP_HOST = config('WEBAPP_HOST', default='0.0.0.0')
+WEBAPP_PORT = config('WEBAPP_PORT', default=8080, cast=int)
+WEBHOOK_WORKERS = config('WEBHOOK_WORKERS', default=1, cast=int)
+# Применять миграции схемы БД при запуске. Если они применяются отдельно (python manage.py migrate), бот не открывает
+# ни одного соединения с БД до первого апдейта
+DB_INIT_ON_STARTUP = config('DB_INIT_ON_STARTUP', default=True, cast=bool)
+# Сколько ждать завершения апдейтов в работе при остановке
+SHUTDOWN_TIMEOUT = config('SHUTDOWN_TIMEOUT', default=30, cast=float)
+# В режиме polling /metrics отдается отдельным сервером на этом порту (0 - выключено);
+# в режиме webhook - тем же сервером, что принимает вебхук
+METRICS_HOST = config('METRICS_HOST', default='127.0.0.1')
+METRICS_PORT = config('METRICS_PORT', default=0, cast=int)
+
+def create_storage():
+    # FSM_STORAGE=postgres - состояния анкет переживают перезапуск и доступны нескольким процессам бота
+    if FSM_STORAGE == 'postgres':
+        return PostgresStorage()
+    return MemoryStorage()
 
 # Инициализация бота и диспетчера
-bot = Bot(token=config('TOKEN'))
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-dp.include_router(router)
+def create_bot(token, session=None):
+    # Все вызовы Bot API проходят через общий планировщик: приоритет ответов над рассылками и лимит Telegram
+    bot = Bot(token=token, session=session or MeteredSession())
+    bot.session.middleware(OutboundScheduler())
+    return bot
+
+def create_dispatcher():
+    dp = Dispatcher(storage=create_storage())
+    latency = UpdateLatencyMiddleware()
+    dp.update.outer_middleware(latency)
+    dp.update.outer_middleware(LogContextMiddleware())
+    # Один экземпляр на сообщения и callback: общий учет пользователей
+    throttling = ThrottlingMiddleware()
+    for observer in (router.message, router.callback_query):
+        observer.outer_middleware(throttling)
+        observer.middleware(HandlerLatencyMiddleware())
+    dp.include_router(router)
+    dp.shutdown.register(on_shutdown)
+    return dp, latency
 
 async def on_startup(dispatcher: Dispatcher):
-    await init_db()
+    if DB_INIT_ON_STARTUP:
+        await migrate()
+    answers.start()
+    await allowed_emails.start()
+    start_loop_monitor()
+
+async def on_shutdown(dispatcher: Dispatcher):
+    # Записываем ответы, которые еще не успели попасть в БД
+    await answers.stop()
+    await changes.stop()
+    await allowed_emails.stop()
+    await stop_loop_monitor()
+    # Пул закрывается последним, после записи буферов
+    await dispose_engine()
 
 # Запуск бота
 async def main():
+    setup_logging()
+    bot = create_bot(config('TOKEN'))
+    dp, _ = create_dispatcher()
     await on_startup(dp)
     await setup_google_sheet_update(get_session)
-    await dp.start_polling(bot)
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    logger.info(f"Ready to poll in {(time.perf_counter() - started_at) * 1000:.0f} ms")
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+def create_webhook_app(bot, dp, latency, worker_index=0, startup=None):
+    # Модули сервера вебхука импортируются только в режиме webhook: polling без них запускается быстрее
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    from aiohttp import web
+    app = web.Application()
+
+    async def drain(app):
+        # Регистрируется раньше обработчиков aiogram: сессия бота закрывается только после дренажа.
+        # Фоновые задачи обработки апдейтов учитывает UpdateLatencyMiddleware, их и ждем
+        left = await latency.drain(SHUTDOWN_TIMEOUT)
+        if left:
+            logger.warning(f"Worker {worker_index}: {left} updates still in flight after {SHUTDOWN_TIMEOUT}s")
+
+    if startup is not None:
+        app.on_startup.append(startup)
+    app.on_shutdown.append(drain)
+    app.router.add_get('/metrics', metrics_view)
+    # Апдейт обрабатывается в фоне, Telegram сразу получает ответ. Иначе долгие команды (/send_links,
+    # /update_sheet) держат запрос дольше таймаута Telegram, и он присылает тот же апдейт повторно
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None, handle_in_background=True
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+def serve_webhook(worker_index):
+    from aiohttp import web
+    # Каждый процесс-воркер настраивает свой вывод логов
+    setup_logging()
+    bot = create_bot(config('TOKEN'))
+    dp, latency = create_dispatcher()
+
+    async def on_app_startup(app):
+        # Схема БД, вебхук и планировщик выгрузки нужны в одном экземпляре
+        if worker_index == 0 and DB_INIT_ON_STARTUP:
+            await migrate()
+        answers.start()
+        await allowed_emails.start()
+        start_loop_monitor()
+        if worker_index == 0:
+            await bot.set_webhook(WEBHOOK_BASE_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+            await setup_google_sheet_update(get_session)
+        logger.info(f"Worker {worker_index} ready in {(time.perf_counter() - started_at) * 1000:.0f} ms")
+
+    app = create_webhook_app(bot, dp, latency, worker_index, startup=on_app_startup)
+    web.run_app(
+        app, host=WEBAPP_HOST, port=WEBAPP_PORT, reuse_port=WEBHOOK_WORKERS > 1,
+        shutdown_timeout=SHUTDOWN_TIMEOUT, print=None
+    )
+
+def run_webhook():
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("WEBHOOK_BASE_URL is required for BOT_MODE=webhook")
+    if WEBHOOK_WORKERS > 1 and FSM_STORAGE == 'memory':
+        raise RuntimeError("WEBHOOK_WORKERS > 1 requires a shared FSM storage, set FSM_STORAGE=postgres")
+    if WEBHOOK_WORKERS > 1 and FSM_CACHE_TTL > 0:
+        # Кеш каждого процесса не видит записей других процессов
+        raise RuntimeError("WEBHOOK_WORKERS > 1 requires FSM_CACHE_TTL=0")
+    if WEBHOOK_WORKERS > 1 and not CHANGE_FEED_NOTIFY:
+        # Потребитель ленты изменений есть только в воркере 0, события остальных без NOTIFY терялись бы
+        raise RuntimeError("WEBHOOK_WORKERS > 1 requires CHANGE_FEED_NOTIFY=true")
+
+    if WEBHOOK_WORKERS == 1:
+        serve_webhook(0)
+        return
+
+    # Каждый процесс слушает тот же порт (SO_REUSEPORT), ядро распределяет соединения между ними
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=serve_webhook, args=(index,)) for index in range(WEBHOOK_WORKERS)]
+    for worker in workers:
+        worker.start()
+
+    def stop_workers(signum, frame):
+        for worker in workers:
+            worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    for worker in workers:
+        worker.join()
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    if BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,333 @@
+import asyncio
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Message, Update
+from decouple import config
+import app.keyboards as kb
+from app.database.models import UserStatus
+from app.google.client import AsyncSheet
+from app.google.sync import user_to_row
+from run import create_bot, create_dispatcher
+
+# Фиктивные Telegram, Google и БД общие для тестов; loadtest.py и benchmark.py берут их отсюда же
+
+# Диапазон telegram_id синтетических участников, не пересекается с настоящими
+BASE_TELEGRAM_ID = 9_000_000_000_000
+
+@pytest.fixture(scope='session')
+def dispatcher():
+    # Router из app/handlers.py подключается к диспетчеру один раз на процесс
+    dp, _ = create_dispatcher()
+    return dp
+
+async def _migrate():
+    from app.database.engine import dispose_engine
+    from app.database.migrations import migrate
+    try:
+        await migrate()
+    finally:
+        await dispose_engine()
+
+@pytest.fixture
+def postgres():
+    # Тесты с настоящим Postgres из DB_* (.env); без настроенной или доступной базы они пропускаются.
+    # Пул соединений привязан к event loop, поэтому закрывается после каждого asyncio.run теста
+    from app.database.engine import dispose_engine
+    if not config('DB_HOST', default=''):
+        pytest.skip('DB_* is not configured')
+    try:
+        asyncio.run(_migrate())
+    except OSError as e:
+        pytest.skip(f'Postgres is unavailable: {e}')
+    yield
+    asyncio.run(dispose_engine())
+
+class FakeSession(BaseSession):
+    # Отвечает на вызовы Bot API без сети, с заданной задержкой
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self._message_id += 1
+            return Message.model_validate({
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': method.chat_id, 'type': 'private'},
+                'text': method.text,
+            }, context={'bot': bot})
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+class VirtualUser:
+    def __init__(self, index, bot, dispatcher, timings, think):
+        self.telegram_id = BASE_TELEGRAM_ID + index
+        self.index = index
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.timings = timings
+        self.think = think
+        self.update_id = index * 100
+        self.sender = {'id': self.telegram_id, 'is_bot': False, 'first_name': 'Load', 'username': f'load{index}'}
+        self.chat = {'id': self.telegram_id, 'type': 'private'}
+
+    @property
+    def email(self):
+        return email_for(self.index)
+
+    async def _feed(self, step, payload):
+        self.update_id += 1
+        update = Update.model_validate({'update_id': self.update_id, **payload}, context={'bot': self.bot})
+        started = time.perf_counter()
+        await self.dispatcher.feed_update(self.bot, update)
+        self.timings[step].append(time.perf_counter() - started)
+        if self.think:
+            await asyncio.sleep(random.uniform(0, self.think))
+
+    def _message(self, text):
+        return {'message_id': self.update_id, 'date': int(time.time()), 'chat': self.chat, 'from': self.sender, 'text': text}
+
+    async def send(self, step, text):
+        await self._feed(step, {'message': self._message(text)})
+
+    async def press(self, step, data):
+        await self._feed(step, {'callback_query': {
+            'id': str(self.update_id), 'from': self.sender, 'chat_instance': str(self.telegram_id),
+            'data': data, 'message': self._message('...'),
+        }})
+
+    async def register(self, captain_share):
+        await self.send('start', '/start join')
+        await self.press('become_participant', 'become_participant')
+        await self.send('name', f"Нагрузочный Участник{self.index}")
+        await self.send('phone', f"+7900{self.index % 10_000_000:07d}")
+        await self.send('email', self.email)
+        await self.send('age', str(18 + self.index % 50))
+        await self.send('occupation', 'Тестирование')
+        await self.send('city', 'Казань')
+        await self.send('experience', 'Нет')
+        for program in random.sample(kb.programs[1:], random.randint(1, 3)):
+            await self.press('program', f"program:{program}")
+        await self.press('confirm', 'confirm_programs')
+        await self.press('about_captains', 'about_captains')
+        if random.random() < captain_share:
+            await self.press('become_captain', 'become_captain')
+            await self.send('motivation', 'Хочу помогать другим участникам')
+        else:
+            await self.press('not_interested', 'not_interested')
+
+def email_for(index):
+    return f"load{index}@loadtest.local"
+
+RANGE_RE = re.compile(r'([A-Z])(\d+):([A-Z])(\d+)')
+
+class FakeWorksheet:
+    # Лист Google в памяти с методами, которые вызывает AsyncSheet. Каждый вызов блокирует поток
+    # на latency секунд, как HTTP-запрос gspread; значения хранятся строками, как их возвращает Google
+    def __init__(self, rows=(), latency=0.0, row_count=1000):
+        self.rows = [['' if value is None else str(value) for value in row] for row in rows]
+        self.row_count = max(row_count, len(self.rows))
+        self.latency = latency
+        self.calls = Counter()
+        self.version = 0
+
+    def _call(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _range(range_name):
+        first_col, first_row, last_col, last_row = RANGE_RE.fullmatch(range_name).groups()
+        return int(first_row), int(last_row), ord(first_col) - ord('A'), ord(last_col) - ord('A')
+
+    @staticmethod
+    def _trim(values):
+        # Пустые ячейки и строки в конце диапазона Google не возвращает
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def get_values(self, range_name):
+        self._call('get_values')
+        first_row, last_row, first_col, last_col = self._range(range_name)
+        return self._trim([
+            self._trim(row[first_col:last_col + 1]) for row in self.rows[first_row - 1:last_row]
+        ])
+
+    def col_values(self, col):
+        self._call('col_values')
+        return self._trim([row[col - 1] if len(row) >= col else '' for row in self.rows])
+
+    def _write(self, range_name, rows):
+        first_row, last_row, first_col, _ = self._range(range_name)
+        if last_row > self.row_count:
+            raise ValueError(f"Range {range_name} exceeds grid limits ({self.row_count} rows)")
+        for row_num, values in enumerate(rows, start=first_row):
+            while len(self.rows) < row_num:
+                self.rows.append([])
+            row = self.rows[row_num - 1]
+            row.extend([''] * (first_col + len(values) - len(row)))
+            row[first_col:first_col + len(values)] = ['' if value is None else str(value) for value in values]
+        self.version += 1
+
+    def batch_update(self, data):
+        self._call('batch_update')
+        for item in data:
+            self._write(item['range'], item['values'])
+
+    def add_rows(self, rows):
+        self._call('add_rows')
+        self.row_count += rows
+        self.version += 1
+
+    # Вызовы прежней выгрузки (весь лист за раз и запись по строке) - для сравнения в benchmark.py
+    def get_all_values(self):
+        self._call('get_all_values')
+        return [list(row) for row in self.rows]
+
+    def update(self, range_name, values):
+        self._call('update')
+        self._write(range_name, values)
+
+    def append_rows(self, rows):
+        self._call('append_rows')
+        self.rows.extend(['' if value is None else str(value) for value in row] for row in rows)
+        self.row_count = max(self.row_count, len(self.rows))
+        self.version += 1
+
+    def get_lastUpdateTime(self):
+        self._call('get_lastUpdateTime')
+        return f"2026-01-01T00:00:00.{self.version:06d}Z"
+
+def fake_sheet(worksheet):
+    # AsyncSheet без подключения к Google: лист и файл таблицы подменены листом в памяти
+    sheet = AsyncSheet('fake', 'fake')
+    sheet._worksheet = worksheet
+    sheet._spreadsheet = worksheet
+    return sheet
+
+HEADER = ['telegram_id', 'name', 'phone', 'telegram', 'email', 'age', 'occupation', 'city',
+          'crypto_experience', 'programs', 'captain_motivation', 'status', 'synced_at']
+
+def synthetic_user(telegram_id, version=0):
+    return SimpleNamespace(
+        telegram_id=telegram_id, name=f"Участник {telegram_id} v{version}", phone='+79001234567',
+        telegram=f'user{telegram_id}', email=f'user{telegram_id}@example.com', age=30, occupation='Аналитик',
+        city='Казань', crypto_experience='нет', programs=['Трейдинг'], captain_motivation=None,
+        status=UserStatus.student, updated_at=datetime(2026, 1, 1) + timedelta(seconds=telegram_id),
+    )
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+class SheetDatabase:
+    # Участники, индекс строк листа и метаданные выгрузки в памяти вместо таблиц
+    # nastavnichestvo, sheet_rows и sheet_sync_meta
+    def __init__(self):
+        self.users = {}
+        self.index = {}
+        self.meta = {}
+        self.commits = 0
+
+    async def scalar(self, statement):
+        # Единственный запрос sync_users через scalar, кроме метаданных, - номер последней строки
+        return max((row for row, _ in self.index.values()), default=None)
+
+    async def execute(self, statement, parameters=None):
+        # Выборка участников по списку telegram_id
+        telegram_ids = statement.whereclause.right.value
+        return FakeResult([self.users[telegram_id] for telegram_id in telegram_ids if telegram_id in self.users])
+
+    async def commit(self):
+        self.commits += 1
+
+@pytest.fixture
+def sheet_db(monkeypatch):
+    from app.google import sync
+    db = SheetDatabase()
+
+    async def lookup_index(session, telegram_ids):
+        return {telegram_id: db.index[telegram_id] for telegram_id in telegram_ids if telegram_id in db.index}
+
+    async def save_index(session, entries):
+        for entry in entries:
+            db.index[entry['telegram_id']] = (entry['row'], entry['row_hash'])
+
+    async def get_meta(session, key):
+        return db.meta.get(key)
+
+    async def set_meta(session, key, value):
+        db.meta[key] = value
+
+    async def reset_index(session):
+        db.index.clear()
+        db.meta.clear()
+
+    monkeypatch.setattr(sync, '_lookup_index', lookup_index)
+    monkeypatch.setattr(sync, '_save_index', save_index)
+    monkeypatch.setattr(sync, '_get_meta', get_meta)
+    monkeypatch.setattr(sync, '_set_meta', set_meta)
+    monkeypatch.setattr(sync, 'reset_index', reset_index)
+    return db
+
+class RecordingSession(FakeSession):
+    # Запоминает тексты, которые бот отправил участнику
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            self.texts.append(method.text)
+        return await super().make_request(bot, method, timeout)
+
+@pytest.fixture
+def telegram_user(dispatcher):
+    # Участник с номером index пишет боту через фиктивную сессию; вызывается внутри event loop теста
+    def make(index):
+        session = RecordingSession()
+        bot = create_bot('123456:test', session=session)
+        return VirtualUser(index, bot, dispatcher, defaultdict(list), think=0), session
+
+    return make
+
+@pytest.fixture(name='synthetic_user')
+def synthetic_user_fixture():
+    return synthetic_user
+
+@pytest.fixture
+def uploaded_sheet(sheet_db):
+    # Участники 1..users уже выгружены в лист и есть в sheet_db; тест меняет их в sheet_db.users
+    def make(users, latency=0.0):
+        in_sheet = [synthetic_user(telegram_id) for telegram_id in range(1, users + 1)]
+        for user in in_sheet:
+            sheet_db.users[user.telegram_id] = user
+        worksheet = FakeWorksheet(
+            [HEADER] + [user_to_row(user) + ['2026-01-01 00:00:00'] for user in in_sheet], latency=latency
+        )
+        return worksheet, fake_sheet(worksheet)
+
+    return make
@@ -0,0 +1,113 @@
+import asyncio
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+from app.broadcast import STATUS_FAILED, STATUS_SENT, Broadcaster
+
+# Рассылка против фиктивного бота: 429 с retry_after, заблокированный бот и продолжение прерванной рассылки.
+# Журнал доставки хранится в памяти вместо таблицы broadcast_deliveries
+
+RETRY_AFTER = 0.2
+
+class FakeBot:
+    def __init__(self, flood=(), blocked=()):
+        # chat_id, на которые первая попытка получает RetryAfter
+        self.flood = set(flood)
+        self.blocked = set(blocked)
+        self.sent = []
+        self.attempts = []
+
+    async def send_message(self, chat_id, text):
+        method = SendMessage(chat_id=chat_id, text=text)
+        self.attempts.append((chat_id, asyncio.get_running_loop().time()))
+        if chat_id in self.flood:
+            self.flood.discard(chat_id)
+            raise TelegramRetryAfter(method, 'Too Many Requests', RETRY_AFTER)
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method, 'Forbidden: bot was blocked by the user')
+        self.sent.append(chat_id)
+
+class MemoryBroadcaster(Broadcaster):
+    def __init__(self, bot, log, **kwargs):
+        super().__init__(bot, global_rate=1000, per_chat_rate=1000, session_maker=self._no_session, **kwargs)
+        self.log = log
+
+    @staticmethod
+    async def _no_session():
+        yield None
+
+    async def _delivered(self, broadcast_id):
+        return {telegram_id for (log_id, telegram_id), entry in self.log.items()
+                if log_id == broadcast_id and entry['status'] == STATUS_SENT}
+
+    async def _save_log(self, session, entries):
+        for entry in entries:
+            key = (entry['broadcast_id'], entry['telegram_id'])
+            attempts = self.log.get(key, {}).get('attempts', 0)
+            self.log[key] = {**entry, 'attempts': attempts + entry['attempts']}
+
+def messages(count):
+    return {chat_id: f"Ссылка для {chat_id}" for chat_id in range(1, count + 1)}
+
+def test_retry_after_backs_off_and_retries():
+    bot = FakeBot(flood={3})
+    log = {}
+    report = asyncio.run(MemoryBroadcaster(bot, log).run('b1', messages(10)))
+
+    assert report.total == 10
+    assert report.sent == 10
+    assert report.failed == 0
+    assert report.retries == 1
+    assert sorted(bot.sent) == list(range(1, 11))
+    # Повтор не раньше retry_after после 429
+    first, second = [at for chat_id, at in bot.attempts if chat_id == 3]
+    assert second - first >= RETRY_AFTER * 0.9
+    assert log[('b1', 3)] == {'broadcast_id': 'b1', 'telegram_id': 3, 'status': STATUS_SENT, 'error': None, 'attempts': 2}
+
+def test_blocked_recipients_fail_without_retry():
+    bot = FakeBot(blocked={2, 5})
+    log = {}
+    report = asyncio.run(MemoryBroadcaster(bot, log).run('b2', messages(6)))
+
+    assert report.sent == 4
+    assert report.failed == 2
+    assert report.retries == 0
+    assert report.errors == {'TelegramForbiddenError': 2}
+    assert [chat_id for chat_id, _ in bot.attempts].count(2) == 1
+    assert log[('b2', 5)]['status'] == STATUS_FAILED
+
+def test_resume_skips_delivered_recipients():
+    log = {}
+    # Прерванная рассылка: первые четыре сообщения уже в журнале
+    for chat_id in range(1, 5):
+        log[('b3', chat_id)] = {'broadcast_id': 'b3', 'telegram_id': chat_id, 'status': STATUS_SENT,
+                                'error': None, 'attempts': 1}
+    log[('b3', 5)] = {'broadcast_id': 'b3', 'telegram_id': 5, 'status': STATUS_FAILED,
+                      'error': 'TelegramNetworkError', 'attempts': 4}
+    bot = FakeBot()
+    report = asyncio.run(MemoryBroadcaster(bot, log).run('b3', messages(8)))
+
+    assert report.skipped == 4
+    assert report.sent == 4
+    # Неудачная в прошлый раз доставка повторяется
+    assert sorted(bot.sent) == [5, 6, 7, 8]
+
+    again = FakeBot()
+    report = asyncio.run(MemoryBroadcaster(again, log).run('b3', messages(8)))
+    assert report.skipped == 8
+    assert report.sent == 0
+    assert again.attempts == []
+
+def test_sent_rows_are_logged_before_the_run_ends():
+    # Каждая доставка записывается сразу: при падении посреди рассылки журнал полон
+    log = {}
+    bot = FakeBot()
+    broadcaster = MemoryBroadcaster(bot, log, concurrency=1)
+    seen = []
+
+    async def send_message(chat_id, text):
+        seen.append(len(log))
+        bot.sent.append(chat_id)
+
+    bot.send_message = send_message
+    asyncio.run(broadcaster.run('b4', messages(5)))
+    assert seen == [0, 1, 2, 3, 4]
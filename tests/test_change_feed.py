@@ -0,0 +1,99 @@
+import asyncio
+from app.database.changes import ChangeFeed
+from app.google.sync import sync_users
+
+# Лента изменений против листа в памяти: сколько вызовов Google API уходит на N правок участников.
+# Без ленты каждая правка - отдельная запись строки. Тесты ждут обработки пачек, а не фиксированное время
+
+USERS = 1_000
+EDITS = 500
+EDITED_USERS = 100
+WINDOW = 0.01
+
+def recording(consumer):
+    # Потребитель, который сообщает о каждой обработанной (или упавшей) пачке через очередь
+    processed = asyncio.Queue()
+
+    async def consume(telegram_ids):
+        try:
+            return await consumer(telegram_ids)
+        finally:
+            processed.put_nowait(sorted(telegram_ids))
+
+    return consume, processed
+
+def edit(sheet_db, synthetic_user, feed, telegram_id, version):
+    # Запись участника в БД и событие после коммита, как в upsert_user
+    sheet_db.users[telegram_id] = synthetic_user(telegram_id, version=version)
+    feed.publish([telegram_id])
+
+def test_edits_are_coalesced_into_few_api_calls(sheet_db, uploaded_sheet, synthetic_user):
+    worksheet, sheet = uploaded_sheet(USERS)
+
+    async def scenario():
+        # Индекс строк уже построен прошлой выгрузкой
+        await sync_users(sheet_db, sheet, telegram_ids=list(sheet_db.users))
+        worksheet.calls.clear()
+
+        feed = ChangeFeed(notify=False, window=WINDOW)
+        consumer, processed = recording(lambda telegram_ids: sync_users(sheet_db, sheet, telegram_ids=telegram_ids))
+        await feed.start(consumer)
+        # Участник отвечает на вопросы анкеты подряд: несколько правок одной строки до конца окна.
+        # Правки одной сотни публикуются без переключения задач и попадают в одну пачку
+        for index in range(EDITS):
+            edit(sheet_db, synthetic_user, feed, index % EDITED_USERS + 1, version=index)
+            if index % 100 == 99:
+                assert await asyncio.wait_for(processed.get(), 5) == list(range(1, EDITED_USERS + 1))
+        await feed.stop()
+        return feed
+
+    feed = asyncio.run(scenario())
+    api_calls = sum(worksheet.calls.values())
+
+    assert feed.events.value == EDITS
+    assert feed.batches.value == EDITS // 100
+    # На пачку: проверка времени изменения таблицы, одна запись строк и новое время изменения
+    assert worksheet.calls['batch_update'] == feed.batches.value
+    assert api_calls <= 3 * feed.batches.value
+    assert api_calls * 10 < EDITS
+    # В листе последние версии участников
+    for telegram_id in range(1, EDITED_USERS + 1):
+        row_num, _ = sheet_db.index[telegram_id]
+        assert worksheet.rows[row_num - 1][1] == sheet_db.users[telegram_id].name
+
+def test_failed_batch_is_retried_with_a_longer_window(sheet_db, uploaded_sheet, synthetic_user):
+    worksheet, sheet = uploaded_sheet(USERS)
+    failures = []
+
+    async def flaky(telegram_ids):
+        if not failures:
+            failures.append(sorted(telegram_ids))
+            raise RuntimeError('Quota exceeded')
+        await sync_users(sheet_db, sheet, telegram_ids=telegram_ids)
+
+    async def scenario():
+        await sync_users(sheet_db, sheet, telegram_ids=list(sheet_db.users))
+        worksheet.calls.clear()
+        feed = ChangeFeed(notify=False, window=WINDOW)
+        consumer, processed = recording(flaky)
+        await feed.start(consumer)
+        for telegram_id in (1, 2, 3):
+            edit(sheet_db, synthetic_user, feed, telegram_id, version=1)
+        await asyncio.wait_for(processed.get(), 5)
+        # Окно выросло, пока Google отвечает ошибкой; новая правка попадает в ту же пачку
+        window = feed.window
+        edit(sheet_db, synthetic_user, feed, 4, version=1)
+        retried = await asyncio.wait_for(processed.get(), 5)
+        await feed.stop()
+        return feed, window, retried
+
+    feed, window, retried = asyncio.run(scenario())
+    assert failures == [[1, 2, 3]]
+    assert window == WINDOW * 2
+    assert retried == [1, 2, 3, 4]
+    assert feed.failures.value == 1
+    assert feed.batches.value == 2
+    assert feed.window == WINDOW
+    assert worksheet.calls['batch_update'] == 1
+    for telegram_id in (1, 2, 3, 4):
+        assert worksheet.rows[telegram_id][1] == sheet_db.users[telegram_id].name
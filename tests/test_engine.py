@@ -0,0 +1,55 @@
+import asyncio
+from pathlib import Path
+from app.database import engine
+
+# Один пул соединений на процесс: движок создается при первом обращении, а не при импорте.
+# Postgres не нужен - engine создается настоящий, но соединение не открывается
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def use_stub_database(monkeypatch):
+    for name, value in {'DB_USERNAME': 'bot', 'DB_PASSWORD': 'secret', 'DB_HOST': '127.0.0.1',
+                        'DB_PORT': '5432', 'DB_NAME': 'bot'}.items():
+        monkeypatch.setenv(name, value)
+    created = []
+    create_async_engine = engine.create_async_engine
+
+    def counting_create_async_engine(*args, **kwargs):
+        created.append(kwargs)
+        return create_async_engine(*args, **kwargs)
+
+    monkeypatch.setattr(engine, 'create_async_engine', counting_create_async_engine)
+    monkeypatch.setattr(engine, '_engine', None)
+    monkeypatch.setattr(engine, '_session_maker', None)
+    return created
+
+def test_importing_the_bot_creates_no_engine():
+    import app.database.models, app.database.requests, app.handlers, run  # noqa: F401
+    assert engine._engine is None
+
+def test_engine_is_created_only_in_the_runtime_module():
+    sources = [path for path in ROOT.rglob('*.py') if 'tests' not in path.parts]
+    users = [path.relative_to(ROOT).as_posix() for path in sources if 'create_async_engine(' in path.read_text('utf-8')]
+    assert users == ['app/database/engine.py']
+
+def test_one_pool_per_process(monkeypatch):
+    created = use_stub_database(monkeypatch)
+
+    first = engine.get_engine()
+    assert engine.get_engine() is first
+    assert engine.get_session_maker() is engine.get_session_maker()
+    assert engine.get_session_maker().kw['bind'] is first
+    assert len(created) == 1
+    assert isinstance(first.pool, engine.MeteredPool)
+    assert created[0]['pool_size'] == engine.DB_POOL_SIZE
+    assert created[0]['max_overflow'] == engine.DB_MAX_OVERFLOW
+    # Соединений нет, пока не пришел первый запрос
+    assert first.pool.checkedout() == 0
+    assert first.pool.checkedin() == 0
+
+    # После остановки следующий запрос создает новый пул
+    asyncio.run(engine.dispose_engine())
+    assert engine._engine is None
+    assert engine.get_engine() is not first
+    assert len(created) == 2
+    asyncio.run(engine.dispose_engine())
@@ -0,0 +1,31 @@
+import asyncio
+from aiogram.fsm.storage.base import StorageKey
+from app.database.engine import dispose_engine
+from app.database.storage import PostgresStorage
+
+# PostgresStorage против настоящего Postgres: состояние и данные одного ключа пишутся независимо
+
+KEY = StorageKey(bot_id=1, chat_id=8_200_000_000_000, user_id=8_200_000_000_000)
+
+def test_interleaved_set_state_and_set_data_keep_both(postgres):
+    storage = PostgresStorage(cache_ttl=5.0)
+
+    async def scenario():
+        try:
+            await storage.set_state(KEY, None)
+            await storage.set_data(KEY, {})
+            # Оба вызова читают пустую строку до того, как любой из них запишет свою колонку
+            await asyncio.gather(storage.set_state(KEY, 'Form:programs'), storage.set_data(KEY, {'programs': ['a']}))
+            cached = await storage.get_state(KEY), await storage.get_data(KEY)
+            stored = await PostgresStorage(cache_ttl=0).get_state(KEY), await PostgresStorage(cache_ttl=0).get_data(KEY)
+            await storage.set_state(KEY, None)
+            await storage.set_data(KEY, {})
+            cleared = await PostgresStorage(cache_ttl=0)._load(PostgresStorage._key(KEY))
+            return cached, stored, cleared
+        finally:
+            await dispose_engine()
+
+    cached, stored, cleared = asyncio.run(scenario())
+    assert stored == ('Form:programs', {'programs': ['a']})
+    assert cached == stored
+    assert cleared == (None, {})
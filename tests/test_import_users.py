@@ -0,0 +1,58 @@
+import asyncio
+import csv
+from app.database.engine import dispose_engine
+from app.database.models import UserStatus
+from manage import driver_connection, import_users
+
+# import-users против настоящего Postgres: пустые значения в файле не затирают данные участников
+
+FIRST_ID = 8_100_000_000_000
+CAPTAIN, STUDENT, NEW, NEW_CAPTAIN = range(FIRST_ID, FIRST_ID + 4)
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['telegram_id', 'name', 'status'])
+        writer.writerows(rows)
+
+async def statuses():
+    async with driver_connection() as connection:
+        rows = await connection.fetch(
+            "SELECT telegram_id, name, status::text FROM nastavnichestvo WHERE telegram_id BETWEEN $1 AND $2",
+            FIRST_ID, NEW_CAPTAIN,
+        )
+    return {row['telegram_id']: (row['name'], row['status']) for row in rows}
+
+async def delete_users():
+    async with driver_connection() as connection:
+        await connection.execute("DELETE FROM nastavnichestvo WHERE telegram_id BETWEEN $1 AND $2", FIRST_ID, NEW_CAPTAIN)
+
+def test_blank_status_keeps_existing_captain(postgres, tmp_path):
+    path = tmp_path / 'users.csv'
+
+    async def scenario():
+        await delete_users()
+        try:
+            async with driver_connection() as connection:
+                await connection.executemany(
+                    "INSERT INTO nastavnichestvo (telegram_id, name, status) VALUES ($1, $2, $3)",
+                    [(CAPTAIN, 'Капитан Прежний', 'captain'), (STUDENT, 'Ученик Прежний', 'student')],
+                )
+            write_csv(path, [
+                [CAPTAIN, 'Капитан Новый', ''],
+                [STUDENT, '', 'captain'],
+                [NEW, 'Участник Новый', ''],
+                [NEW_CAPTAIN, 'Капитан Из Файла', 'captain'],
+            ])
+            await import_users(path)
+            return await statuses()
+        finally:
+            await delete_users()
+            await dispose_engine()
+
+    assert asyncio.run(scenario()) == {
+        CAPTAIN: ('Капитан Новый', UserStatus.captain.name),
+        STUDENT: ('Ученик Прежний', UserStatus.captain.name),
+        NEW: ('Участник Новый', UserStatus.student.name),
+        NEW_CAPTAIN: ('Капитан Из Файла', UserStatus.captain.name),
+    }
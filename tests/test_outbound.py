@@ -0,0 +1,56 @@
+import asyncio
+import os
+import subprocess
+import sys
+from aiogram.methods import EditMessageText, SendMessage
+from app.outbound import OutboundScheduler
+
+# Планировщик исходящих вызовов без сети: make_request записывает отправленные методы
+
+CHAT_ID = 42
+
+class FakeTelegram:
+    def __init__(self):
+        self.sent = []
+        self.release = asyncio.Event()
+
+    async def make_request(self, bot, method):
+        # Первый вызов держит очередь чата, пока тест не отпустит его
+        if not self.sent:
+            self.sent.append(method)
+            await self.release.wait()
+        else:
+            self.sent.append(method)
+        return method
+
+def edit(text):
+    return EditMessageText(chat_id=CHAT_ID, message_id=1, text=text)
+
+def test_cancelled_edit_leader_still_sends_newest_edit():
+    async def scenario():
+        scheduler = OutboundScheduler(rate=1000)
+        telegram = FakeTelegram()
+        blocker = asyncio.create_task(scheduler(telegram.make_request, None, SendMessage(chat_id=CHAT_ID, text='busy')))
+        await asyncio.sleep(0.01)
+        leader = asyncio.create_task(scheduler(telegram.make_request, None, edit('old')))
+        await asyncio.sleep(0)
+        joiner = asyncio.create_task(scheduler(telegram.make_request, None, edit('new')))
+        await asyncio.sleep(0)
+        # Апдейт, начавший редактирование, отменен; присоединившийся вызов ждет результата
+        leader.cancel()
+        telegram.release.set()
+        result = await asyncio.wait_for(joiner, 1)
+        await blocker
+        return leader.cancelled(), result, telegram.sent
+
+    leader_cancelled, result, sent = asyncio.run(scenario())
+    assert leader_cancelled
+    assert result.text == 'new'
+    assert [method.text for method in sent] == ['busy', 'new']
+
+def test_rate_is_split_between_webhook_workers():
+    # Настройки читаются при импорте, поэтому модуль загружается в отдельном процессе
+    code = 'from app.outbound import OutboundScheduler; print(OutboundScheduler().bucket.rate)'
+    env = {**os.environ, 'OUTBOUND_RATE': '30', 'WEBHOOK_WORKERS': '3'}
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+    assert float(output) == 10
@@ -0,0 +1,109 @@
+import asyncio
+import gc
+from app.google.sync import sync_users
+from app.metrics import loop_lag, monitor_loop_lag
+
+# Выгрузка 10k участников в лист в памяти, который отвечает с задержкой сети: вызовы Google
+# не должны блокировать event loop. Задержка цикла измеряется тем же монитором, что и в боте
+
+USERS = 10_000
+LATENCY = 0.1
+LAG_INTERVAL = 0.005
+
+def prepare(sheet_db, uploaded_sheet, synthetic_user, users=USERS, latency=LATENCY):
+    # В листе уже есть все участники; у половины данные в БД изменились, и 10% - новые
+    worksheet, sheet = uploaded_sheet(users, latency=latency)
+    for telegram_id in range(1, users + 1):
+        sheet_db.users[telegram_id] = synthetic_user(telegram_id, version=telegram_id % 2)
+    for telegram_id in range(users + 1, users + users // 10 + 1):
+        sheet_db.users[telegram_id] = synthetic_user(telegram_id)
+    return worksheet, sheet
+
+def lag_during(sheet_db, sheet):
+    async def scenario():
+        before = list(loop_lag.counts)
+        monitor = asyncio.create_task(monitor_loop_lag(LAG_INTERVAL))
+        await asyncio.sleep(0)
+        stats = await sync_users(sheet_db, sheet, telegram_ids=list(sheet_db.users))
+        # Монитор успевает отметить последнюю задержку
+        await asyncio.sleep(LAG_INTERVAL * 2)
+        monitor.cancel()
+        observed = [after - earlier for after, earlier in zip(loop_lag.counts, before)]
+        # Верхняя граница корзины с самой большой задержкой
+        worst = max(index for index, count in enumerate(observed) if count)
+        return stats, sum(observed), (loop_lag.buckets + (float('inf'),))[worst]
+
+    # Полная сборка мусора по данным теста (десятки тысяч строк) сама дает паузу в десятки мс,
+    # к выгрузке она отношения не имеет: подготовленные данные исключаются из сборки
+    gc.collect()
+    gc.freeze()
+    try:
+        return asyncio.run(scenario())
+    finally:
+        gc.unfreeze()
+
+def test_sync_does_not_block_event_loop(sheet_db, uploaded_sheet, synthetic_user):
+    worksheet, sheet = prepare(sheet_db, uploaded_sheet, synthetic_user)
+    stats, samples, worst = lag_during(sheet_db, sheet)
+
+    assert stats.scanned == 11_000
+    assert stats.updated == 5_000
+    assert stats.appended == 1_000
+    assert stats.unchanged == 5_000
+    # Пока шли вызовы Google, цикл просыпался вовремя: задержка меньше одного вызова
+    assert samples > 100
+    assert worst <= 0.025 < LATENCY
+
+    # Лист совпадает с БД
+    assert worksheet.rows[1][1] == sheet_db.users[1].name
+    assert worksheet.rows[11_000][0] == '11000'
+    assert len(worksheet.rows) == 11_001
+
+def test_blocking_calls_show_up_as_loop_lag(sheet_db, uploaded_sheet, synthetic_user):
+    _, sheet = prepare(sheet_db, uploaded_sheet, synthetic_user, users=2_000)
+
+    # Вызов gspread прямо в event loop, без отдельного потока: тест должен заметить блокировку
+    async def direct(func, *args, write=False, **kwargs):
+        return func(*args, **kwargs)
+
+    sheet._run = direct
+    _, _, worst = lag_during(sheet_db, sheet)
+    assert worst >= LATENCY
+
+def test_sync_writes_only_changed_rows(sheet_db, uploaded_sheet, synthetic_user):
+    worksheet, sheet = prepare(sheet_db, uploaded_sheet, synthetic_user, users=3_000, latency=0)
+    asyncio.run(sync_users(sheet_db, sheet, telegram_ids=list(sheet_db.users)))
+
+    # Повторная выгрузка без изменений в БД ничего не пишет и не читает лист целиком
+    worksheet.calls.clear()
+    stats = asyncio.run(sync_users(sheet_db, sheet, telegram_ids=list(sheet_db.users)))
+    assert stats.unchanged == 3_300
+    assert stats.downloaded == 0
+    assert worksheet.calls == {'get_lastUpdateTime': 1}
+
+def test_timed_out_writes_are_not_retried(monkeypatch, uploaded_sheet):
+    from app.google import client
+    monkeypatch.setattr(client, 'SHEETS_BACKOFF', 0)
+    worksheet, sheet = uploaded_sheet(10, latency=0.2)
+    sheet.timeout = 0.05
+
+    async def scenario():
+        errors = []
+        # Запись по таймауту могла дойти до Google: ошибка сразу, без второй попытки
+        for call in (sheet.add_rows(10), sheet.batch_update([{'range': 'A2:A2', 'values': [['x']]}])):
+            try:
+                await call
+            except asyncio.TimeoutError as e:
+                errors.append(e)
+        # Чтение повторяется
+        try:
+            await sheet.get_values('A1:A1')
+        except asyncio.TimeoutError as e:
+            errors.append(e)
+        return errors
+
+    errors = asyncio.run(scenario())
+    assert len(errors) == 3
+    assert worksheet.calls['add_rows'] == 1
+    assert worksheet.calls['batch_update'] == 1
+    assert worksheet.calls['get_values'] == sheet.retries + 1
@@ -0,0 +1,75 @@
+import asyncio
+from types import SimpleNamespace
+import app.handlers as handlers
+from app.database.cache import status_cache
+
+# Повторный /start join после первого обращения обслуживается кешем статуса: ни одного запроса к БД.
+# Сессия БД подменена фиктивной, которая считает выполненные запросы
+
+# Меньше THROTTLE_LIMIT: все повторы доходят до обработчика
+REPEATS = 8
+
+class FakeResult:
+    def __init__(self, row):
+        self.row = row
+
+    def one(self):
+        return self.row
+
+class FakeDbSession:
+    def __init__(self, row):
+        self.row = row
+        self.statements = []
+
+    async def execute(self, statement, parameters=None):
+        self.statements.append(statement)
+        return FakeResult(self.row)
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    async def close(self):
+        pass
+
+def fake_database(monkeypatch, row):
+    db = FakeDbSession(row)
+
+    async def get_session():
+        yield db
+
+    monkeypatch.setattr(handlers, 'get_session', get_session)
+    return db
+
+def run_starts(telegram_user, db, index, repeats):
+    async def scenario():
+        user, session = telegram_user(index)
+        status_cache.invalidate(user.telegram_id)
+        counts = []
+        for _ in range(repeats):
+            before = len(db.statements)
+            await user.send('start', '/start join')
+            counts.append(len(db.statements) - before)
+        await user.bot.session.close()
+        return counts, session.texts
+
+    return asyncio.run(scenario())
+
+def test_repeated_start_of_registered_user_skips_db(telegram_user, monkeypatch):
+    db = fake_database(monkeypatch, SimpleNamespace(inserted=False, is_complete=True))
+    counts, texts = run_starts(telegram_user, db, 1, REPEATS)
+
+    # Один upsert при первом обращении, дальше - только кеш
+    assert counts == [1] + [0] * (REPEATS - 1)
+    assert len(texts) == REPEATS
+    assert all(text.startswith("Вы уже внесены в список участников") for text in texts)
+
+def test_repeated_start_of_new_user_skips_db(telegram_user, monkeypatch):
+    db = fake_database(monkeypatch, SimpleNamespace(inserted=True, is_complete=False))
+    counts, texts = run_starts(telegram_user, db, 2, REPEATS)
+
+    assert counts == [1] + [0] * (REPEATS - 1)
+    assert texts[0] == handlers.start_message
+    assert all(text.startswith("Вы начали регистрацию") for text in texts[1:])
@@ -0,0 +1,44 @@
+import asyncio
+from sqlalchemy import text
+from app.database.engine import dispose_engine, get_engine
+from app.google.coordinator import SyncCoordinator
+
+# Блокировка выгрузки против настоящего Postgres: прерванное снятие не оставляет блокировку в пуле
+
+LOCK_KEY = 731_099
+
+async def lock_holders():
+    async with get_engine().connect() as connection:
+        return await connection.scalar(text(
+            "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND objid = :key AND granted"
+        ), {'key': LOCK_KEY})
+
+def test_failed_unlock_does_not_leak_the_lock(postgres, monkeypatch):
+    from app.google import coordinator as module
+    coordinator = SyncCoordinator(lock_key=LOCK_KEY, lock_timeout=0)
+    failing = {'SELECT pg_advisory_unlock(:key)': 'SELECT pg_advisory_unlock(:key) AND 1 / 0 = 0'}
+
+    async def scenario():
+        try:
+            # Снятие блокировки падает с ошибкой запроса; при отмене запроса SQLAlchemy сам закрывает соединение
+            monkeypatch.setattr(module, 'text', lambda sql: text(failing.get(sql, sql)))
+            try:
+                async with coordinator._advisory_lock():
+                    pass
+            except Exception as e:
+                error = e
+            monkeypatch.setattr(module, 'text', text)
+            # Сессия закрытого соединения завершается на сервере не мгновенно
+            for _ in range(100):
+                if not await lock_holders():
+                    break
+                await asyncio.sleep(0.01)
+            holders = await lock_holders()
+            # Следующая выгрузка берет блокировку с любого соединения пула
+            async with coordinator._advisory_lock():
+                pass
+            return type(error).__name__, holders
+        finally:
+            await dispose_engine()
+
+    assert asyncio.run(scenario()) == ('DBAPIError', 0)
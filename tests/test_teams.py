@@ -0,0 +1,104 @@
+import random
+from collections import Counter
+from app.teams import Participant, age_band, assign_teams, has_experience
+
+# Разбиение на команды: детерминированность при одном seed, капитаны, размеры команд и смесь групп
+
+CITIES = ('Москва', 'Казань', 'Новосибирск', 'Екатеринбург', 'Минск')
+EXPERIENCE = ('нет', 'Да, торгую год', 'немного', '-', 'больше трех лет')
+
+def participants(count, captains, seed=1):
+    rng = random.Random(seed)
+    captain_ids = set(rng.sample(range(count), captains))
+    return [
+        Participant(
+            telegram_id=1000 + i,
+            city=rng.choice(CITIES),
+            age=rng.randint(16, 70),
+            crypto_experience=rng.choice(EXPERIENCE),
+            is_captain=i in captain_ids,
+        )
+        for i in range(count)
+    ]
+
+def skewed_participants(count, seed):
+    # 80% из одного города, 70% младше 25 лет, 90% без опыта
+    rng = random.Random(seed)
+    return [
+        Participant(
+            telegram_id=1000 + i,
+            city='Москва' if rng.random() < 0.8 else rng.choice(CITIES[1:]),
+            age=rng.randint(18, 24) if rng.random() < 0.7 else rng.randint(25, 70),
+            crypto_experience='нет' if rng.random() < 0.9 else 'Да, торгую год',
+            is_captain=rng.random() < 0.05,
+        )
+        for i in range(count)
+    ]
+
+def spread(teams, people, key):
+    # Наибольшая по всем значениям признака разница между командами в числе участников с этим значением
+    by_id = {p.telegram_id: key(p) for p in people}
+    worst = 0
+    for value in set(by_id.values()):
+        counts = [sum(1 for telegram_id in team.members if by_id[telegram_id] == value) for team in teams]
+        worst = max(worst, max(counts) - min(counts))
+    return worst
+
+def plan(teams):
+    return [(team.number, team.size, team.captain, list(team.members)) for team in teams]
+
+def test_same_seed_gives_same_teams():
+    people = participants(503, captains=60)
+    first = assign_teams(people, team_size=10, seed=42)
+    # Порядок входа не влияет на результат
+    shuffled = people[:]
+    random.Random(7).shuffle(shuffled)
+    second = assign_teams(shuffled, team_size=10, seed=42)
+    assert plan(first) == plan(second)
+    assert plan(first) != plan(assign_teams(people, team_size=10, seed=43))
+
+def test_every_participant_in_exactly_one_team():
+    people = participants(503, captains=60)
+    teams = assign_teams(people, team_size=10, seed=42)
+    members = Counter(telegram_id for team in teams for telegram_id in team.members)
+    assert set(members) == {p.telegram_id for p in people}
+    assert set(members.values()) == {1}
+
+def test_sizes_differ_by_at_most_one():
+    for count in (1, 9, 10, 11, 99, 503, 1000):
+        teams = assign_teams(participants(count, captains=min(count, 5)), team_size=10, seed=3)
+        sizes = [len(team.members) for team in teams]
+        assert [team.size for team in teams] == sizes
+        assert max(sizes) - min(sizes) <= 1
+        assert max(sizes) <= 10
+
+def test_one_captain_per_team():
+    people = participants(503, captains=60)
+    captains = {p.telegram_id for p in people if p.is_captain}
+    teams = assign_teams(people, team_size=10, seed=42)
+    for team in teams:
+        assert team.captain in captains
+        assert team.captain in team.members
+        # Лишние капитаны попадают в команды участниками, но капитан у команды один
+        assert team.members.count(team.captain) == 1
+    assert len({team.captain for team in teams}) == len(teams)
+
+def test_teams_without_enough_captains():
+    teams = assign_teams(participants(100, captains=3), team_size=10, seed=0)
+    assert sum(1 for team in teams if team.captain is not None) == 3
+    assert len(teams) == 10
+
+def test_no_participants():
+    assert assign_teams([], team_size=10, seed=0) == []
+
+def test_skewed_groups_are_spread_evenly():
+    for seed in range(5):
+        for count in (97, 503, 5000):
+            people = skewed_participants(count, seed)
+            teams = assign_teams(people, team_size=10, seed=seed)
+            # Раздача по кругу дает разницу не больше 1 на группу, капитаны, раздаваемые отдельно, - еще 1.
+            # Опыт - первый ключ сортировки; возрастная группа разбита на два блока по опыту;
+            # город - на блоки по опыту и возрасту, поэтому граница для него свободнее
+            assert spread(teams, people, lambda p: has_experience(p.crypto_experience)) <= 2
+            assert spread(teams, people, lambda p: age_band(p.age)) <= 3
+            assert spread(teams, people, lambda p: p.city) <= 5
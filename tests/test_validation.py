@@ -0,0 +1,111 @@
+import re
+from hypothesis import example, given, strategies as st
+from app.validation import (
+    AGE_MAX, AGE_MIN, NORMALIZERS, canonical_email, format_phone, normalize_batch, normalize_email, normalize_fields,
+    normalize_name, normalize_phone, parse_age, parse_name
+)
+
+# Свойства проверки и нормализации на произвольных входах: результат всегда в каноническом виде,
+# повторная нормализация его не меняет, и ни одна функция не падает на мусоре
+
+E164_RE = re.compile(r'^\+\d{11,15}$')
+
+national_numbers = st.from_regex(r'9\d{9}', fullmatch=True)
+separators = st.sampled_from(['', ' ', '-', '.'])
+
+@st.composite
+def formatted_phones(draw):
+    # Один российский номер в записи, как ее вводят люди: +7/8/7, скобки, пробелы и дефисы
+    digits = draw(national_numbers)
+    prefix = draw(st.sampled_from(['+7', '8', '7', '']))
+    sep = draw(separators)
+    code = f"({digits[:3]})" if draw(st.booleans()) else digits[:3]
+    body = sep.join([code, digits[3:6], digits[6:8], digits[8:]])
+    padding = draw(st.sampled_from(['', ' ', '  ']))
+    return digits, f"{padding}{prefix}{draw(separators)}{body}{padding}"
+
+emails = st.emails()
+
+@given(st.text())
+def test_phone_is_e164_or_none(text):
+    phone = normalize_phone(text)
+    assert phone is None or E164_RE.match(phone)
+
+@given(formatted_phones())
+def test_phone_formats_normalize_to_one_value(case):
+    digits, text = case
+    assert normalize_phone(text) == '+7' + digits
+
+@given(st.text())
+def test_phone_normalization_is_idempotent(text):
+    phone = normalize_phone(text)
+    if phone is not None:
+        assert normalize_phone(phone) == phone
+
+@given(st.one_of(st.none(), st.text()))
+def test_format_phone_keeps_unrecognized_values(text):
+    formatted = format_phone(text)
+    assert formatted == (normalize_phone(text) or text)
+
+@given(emails, st.sampled_from(['', ' ', '\t']), st.booleans())
+def test_email_case_and_spaces_are_canonicalized(email, padding, upper):
+    text = f"{padding}{email.upper() if upper else email}{padding}"
+    normalized = normalize_email(text)
+    assert normalized == normalize_email(email)
+    if normalized is not None:
+        assert normalized == canonical_email(email)
+        assert normalized == normalized.strip().lower()
+
+@given(st.text())
+def test_email_normalization_is_idempotent(text):
+    email = normalize_email(text)
+    if email is not None:
+        assert '@' in email
+        assert normalize_email(email) == email
+
+@given(st.integers(min_value=-1000, max_value=1000), st.sampled_from(['', ' ']))
+def test_age_from_text_and_int_agree(age, padding):
+    expected = age if AGE_MIN <= age <= AGE_MAX else None
+    assert parse_age(age) == expected
+    if age >= 0:
+        assert parse_age(f"{padding}{age}{padding}") == expected
+
+@given(st.one_of(st.text(), st.booleans(), st.floats(), st.none()))
+@example('30\x1f')
+def test_age_rejects_garbage_without_raising(value):
+    age = parse_age(value)
+    assert age is None or (isinstance(age, int) and AGE_MIN <= age <= AGE_MAX)
+
+@given(st.text())
+def test_name_has_two_or_more_words_joined_by_single_spaces(text):
+    parts = parse_name(text)
+    name = normalize_name(text)
+    if parts is None:
+        assert name is None
+    else:
+        assert len(parts) >= 2
+        assert name == ' '.join(text.split())
+        assert normalize_name(name) == name
+
+texts = st.one_of(st.none(), st.text(max_size=30))
+# Возраст приходит и строкой из анкеты или CSV, и числом из БД
+rows = st.fixed_dictionaries(
+    {},
+    optional={'name': texts, 'phone': texts, 'email': texts,
+              'age': st.one_of(texts, st.integers(min_value=-5, max_value=200)), 'city': st.text(max_size=10)},
+)
+
+@given(rows)
+def test_invalid_fields_keep_original_values(row):
+    normalized, invalid = normalize_fields(row)
+    assert set(normalized) == set(row)
+    assert normalized.get('city') == row.get('city')
+    for field in invalid:
+        assert normalized[field] == row[field]
+    for field, normalizer in NORMALIZERS.items():
+        if row.get(field) not in (None, '') and field not in invalid:
+            assert normalized[field] == normalizer(row[field])
+
+@given(st.lists(rows, max_size=20))
+def test_batch_matches_single_rows(batch):
+    assert list(normalize_batch(batch)) == [normalize_fields(row) for row in batch]